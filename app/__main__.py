@@ -6,12 +6,17 @@ from fastapi import FastAPI
 
 from starlette.staticfiles import StaticFiles
 
-from app.core.core import run_core, Core
+from app.core.core import run_core, Core, CoreManager
+from app.core.cluster import make_cluster_node
+from app.core.workers import make_process_poller
 from app.snmp.router_snmp import router as router_snmp
-from app.settings import STATIC_DIR
+from app.settings import STATIC_DIR, settings
 from app.client.router_web_client import router as router_web_client
+from app.auth.auth import password_pool
 from app.auth.router_auth import router as router_auth
 from app.core.router_core import router as router_core
+from app.database import motorchik
+from app.metrics import MetricsMiddleware, router as router_metrics
 
 
 def app_loader():
@@ -22,13 +27,28 @@ def app_loader():
     async def start_core():
         print("start_service")
         loop = asyncio.get_running_loop()
+        # индексы создаются в фоне и повторяются, пока unique не подтвердится: недоступная база
+        # не должна задерживать старт, а до подтверждения вставки проверяют дубли сами (unique_confirmed)
+        app.index_creator = loop.create_task(motorchik.keep_indexes(settings.DB_INDEX_RETRY_INTERVAL))
+        CoreManager.process_poller = make_process_poller()
+        CoreManager.cluster_node = make_cluster_node()
+        if CoreManager.cluster_node is not None:
+            app.cluster_runner = loop.create_task(CoreManager.cluster_node.run())
         app.core_runner = loop.create_task(run_core())
 
     @app.on_event("shutdown")
     async def stop_core():
         print("\nstop_service\n")
         Core.stop()
+        app.index_creator.cancel()
         await asyncio.gather(app.core_runner)
+        if CoreManager.cluster_node is not None:
+            app.cluster_runner.cancel()
+            # ведомые заберут аренду на ближайшем тике, не дожидаясь ее истечения
+            await CoreManager.cluster_node.release()
+        if CoreManager.process_poller is not None:
+            CoreManager.process_poller.shutdown()
+        password_pool.shutdown()
 
     app.mount("/static/", StaticFiles(directory=STATIC_DIR), name="static")
 
@@ -36,6 +56,11 @@ def app_loader():
     app.include_router(router_snmp)
     app.include_router(router_web_client)
     app.include_router(router_core)
+    if settings.METRICS_ENABLED:
+        if not settings.METRICS_TOKEN:
+            print("ВНИМАНИЕ: /metrics открыт без METRICS_TOKEN")
+        app.add_middleware(MetricsMiddleware)
+        app.include_router(router_metrics)
 
     return app
 
@@ -1,4 +1,9 @@
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from typing import Any, Hashable, Optional
 
 from bson import ObjectId
 from passlib.context import CryptContext
@@ -6,17 +11,146 @@ from jose import jwt, JWTError
 from fastapi import Request, HTTPException, status, Depends
 
 from app.database import motorchik
-from app.settings import get_auth_data
+from app.metrics import gauge_callback
+from app.settings import get_auth_data, settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+class TtlCache:
+    """
+    Ограниченный кэш: запись живет не дольше ttl секунд (или своего срока из put),
+    при переполнении вытесняется та, к которой дольше всего не обращались.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict = OrderedDict()  # key -> (value, deadline по time.monotonic)
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if item[1] <= time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        self._items[key] = (value, time.monotonic() + ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def discard_if(self, predicate):
+        """ Выбросить записи, для значений которых predicate(value) истинно """
+        for key in [key for key, (value, _) in self._items.items() if predicate(value)]:
+            del self._items[key]
+
+    def clear(self):
+        self._items.clear()
+
+
+# токен -> пользователь {"login", "password"}: повторный запрос с тем же токеном не ходит ни в jwt.decode, ни в базу.
+# Запись живет не дольше AUTH_CACHE_TTL и не дольше самого токена.
+auth_cache = TtlCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+
+
+def invalidate_user(login: str):
+    """ Пользователь изменился (пароль, регистрация) - все его токены перечитаются из базы """
+    auth_cache.discard_if(lambda user: user["login"] == login)
+
+
+class PasswordPool:
+    """
+    bcrypt в отдельных потоках: хэш считается ~250 мс, и в цикле событий он останавливал бы опрос и все запросы.
+    Одновременно считается не больше workers хэшей, остальные ждут в очереди.
+    Если в очереди уже max_queue, новый запрос сразу получает 503 - пачка логинов не копит бесконечную очередь.
+    Счетчики (queued, running, completed, rejected, ...) трогаются только из цикла событий.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = max(workers, 1)
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.in_flight = 0  # отправлено в пул и еще не готово: в очереди + считаются
+        self.max_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def running(self) -> int:
+        return min(self.in_flight, self.workers)
+
+    @property
+    def queued(self) -> int:
+        return self.in_flight - self.running
+
+    def _timed(self, func, *args):
+        started = time.perf_counter()
+        return func(*args), time.perf_counter() - started
+
+    async def run(self, func, *args):
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Сервер занят проверкой паролей, повторите позже.",
+                headers={"Retry-After": "1"}
+            )
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self.in_flight += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        try:
+            result, seconds = await asyncio.get_running_loop().run_in_executor(self._executor, self._timed, func, *args)
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        self.busy_seconds += seconds
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_pool = PasswordPool(settings.AUTH_HASH_WORKERS, settings.AUTH_HASH_MAX_QUEUE)
+
+
+@gauge_callback("netviewer_auth_hash_pool", "Пул bcrypt: PasswordPool.stats()", "stat")
+def collect_hash_pool():
+    return password_pool.stats()
+
+
+async def get_password_hash(password: str) -> str:
+    return await password_pool.run(pwd_context.hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_pool.run(pwd_context.verify, plain_password, hashed_password)
 
 
 def create_access_token(data: dict) -> str:
@@ -30,7 +164,7 @@ def create_access_token(data: dict) -> str:
 
 async def authenticate_user(login: str, password: str):
     user = await motorchik.find_one("users", {"login": login})
-    if user is None or not verify_password(plain_password=password, hashed_password=user["password"]):
+    if user is None or not await verify_password(plain_password=password, hashed_password=user["password"]):
         return None
     return user
 
@@ -43,6 +177,10 @@ def get_token(request: Request):
 
 
 async def get_current_user(token: str = Depends(get_token)):
+    user = auth_cache.get(token)
+    if user is not None:
+        return user
+
     try:
         auth_data = get_auth_data()
         payload = jwt.decode(token, auth_data['secret_key'], algorithms=[auth_data['algorithm']])
@@ -58,8 +196,10 @@ async def get_current_user(token: str = Depends(get_token)):
     if not user_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Не найден ID пользователя')
 
-    user = await motorchik.find_one("users", {"_id": ObjectId(user_id)})
+    user = await motorchik.find_one("users", {"_id": ObjectId(user_id)}, projection={"login": True, "password": True})
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='User not found')
 
-    return {"login": user["login"], "password": user["password"]}
+    user = {"login": user["login"], "password": user["password"]}
+    auth_cache.put(token, user, ttl=(expire_time - datetime.now(timezone.utc)).total_seconds())
+    return user
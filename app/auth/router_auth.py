@@ -1,6 +1,9 @@
 from fastapi import APIRouter, HTTPException, status, Response, Depends
+from pymongo.errors import DuplicateKeyError
 
-from app.auth.auth import get_password_hash, create_access_token, authenticate_user, get_current_user
+from app.auth.auth import (
+    get_password_hash, create_access_token, authenticate_user, get_current_user, invalidate_user, password_pool
+)
 from app.auth.models import UserData4Auth
 from app.database import motorchik
 
@@ -9,16 +12,23 @@ router = APIRouter(prefix="/auth", tags=["Auth API"])
 
 @router.post("/register", summary="Регистрация нового пользователя.")
 async def register_new_user(user_data: UserData4Auth, author: UserData4Auth = Depends(get_current_user)) -> dict:
-    user = await motorchik.find_one("users", {"login": user_data.login})
-    if user is not None:
+    # уникальность login держит индекс users.login; пока он не подтвержден - проверяем сами
+    if not motorchik.unique_confirmed("users") and \
+            await motorchik.find_one("users", {"login": user_data.login}, projection={"_id": True}) is not None:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Пользователь с таким логином уже существует."
         )
-
     user_dict = user_data.dict()
-    user_dict["password"] = get_password_hash(user_data.password)
-    await motorchik.insert_one("users", user_dict)
+    user_dict["password"] = await get_password_hash(user_data.password)
+    try:
+        await motorchik.insert_one("users", user_dict)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Пользователь с таким логином уже существует."
+        )
+    invalidate_user(user_data.login)
     return {"result": "Новый пользователь создан."}
 
 
@@ -29,16 +39,18 @@ async def change_password(
         author: UserData4Auth = Depends(get_current_user)
 ) -> dict:
 
+    password = await get_password_hash(user_data.password)
     res = await motorchik.update_one(
         "users",
         find_filter=dict({"login": author["login"]}),
-        new_data=dict({"$set": {"password": get_password_hash(user_data.password)}})
+        new_data=dict({"$set": {"password": password}})
     )
     if res is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Не удалось изменить пароль."
         )
+    invalidate_user(author["login"])
     response.delete_cookie(key="user_access_token")
     print("Изменен пароль для {}.".format(author["login"]))
     return {"result": "Пароль изменен."}
@@ -64,6 +76,15 @@ async def get_me(user_data: UserData4Auth = Depends(get_current_user)):
     return user_data
 
 
+@router.get("/hash_stats", summary="Загрузка пула проверки паролей")
+async def get_hash_stats(user: UserData4Auth = Depends(get_current_user)):
+    """
+    running - сколько хэшей считается сейчас, queued - сколько ждут (max_queued - наибольшая очередь),
+    rejected - сколько запросов получили 503 из-за переполненной очереди, busy_seconds - суммарное время bcrypt.
+    """
+    return password_pool.stats()
+
+
 @router.get("/logout", summary="Выход")
 async def logout_user(response: Response):
     response.delete_cookie(key="user_access_token")
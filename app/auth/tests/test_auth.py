@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+from bson import ObjectId
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from app.auth import auth
+from app.auth.router_auth import router
+
+USER_ID = ObjectId()
+
+
+def make_client() -> TestClient:
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+class TestTtlCache(unittest.TestCase):
+    def test_expiry_and_eviction(self):
+        cache = auth.TtlCache(max_size=2, ttl=60)
+        with mock.patch.object(auth.time, "monotonic", return_value=100.0):
+            cache.put("a", 1)
+            cache.put("b", 2, ttl=5)
+            cache.get("a")
+            cache.put("c", 3)  # вытесняет b - к нему дольше не обращались
+        with mock.patch.object(auth.time, "monotonic", return_value=159.0):
+            self.assertIsNone(cache.get("b"))
+            self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+        with mock.patch.object(auth.time, "monotonic", return_value=161.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 1)
+
+    def test_expired_token_is_not_cached(self):
+        cache = auth.TtlCache(max_size=2, ttl=60)
+        cache.put("a", 1, ttl=-1)
+        self.assertIsNone(cache.get("a"))
+
+
+class TestCurrentUserCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        auth.auth_cache.clear()
+        self.addCleanup(auth.auth_cache.clear)
+        self.token = auth.create_access_token({"sub": str(USER_ID)})
+        self.find_one = mock.AsyncMock(return_value={"_id": USER_ID, "login": "admin", "password": "hash"})
+        patcher = mock.patch.object(auth.motorchik, "find_one", self.find_one)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_repeated_requests_skip_database(self):
+        for _ in range(3):
+            self.assertEqual(await auth.get_current_user(self.token), {"login": "admin", "password": "hash"})
+        self.assertEqual(self.find_one.await_count, 1)
+
+    async def test_invalidated_user_is_reread(self):
+        await auth.get_current_user(self.token)
+        auth.invalidate_user("other")
+        await auth.get_current_user(self.token)
+        self.assertEqual(self.find_one.await_count, 1)
+
+        auth.invalidate_user("admin")
+        await auth.get_current_user(self.token)
+        self.assertEqual(self.find_one.await_count, 2)
+
+    def test_change_password_invalidates_cache(self):
+        client = make_client()
+        client.cookies.set("user_access_token", self.token)
+        with mock.patch("app.auth.router_auth.motorchik.update_one", mock.AsyncMock()), \
+                mock.patch("app.auth.router_auth.get_password_hash", return_value="new hash"):
+            self.assertEqual(client.get("/auth/me").status_code, 200)
+            self.assertEqual(len(auth.auth_cache), 1)
+            res = client.post("/auth/change_passwd", json={"login": "admin", "password": "secret"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(auth.auth_cache), 0)
+
+
+class TestPasswordPool(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.pool = auth.PasswordPool(workers=1, max_queue=1)
+        self.addCleanup(self.pool.shutdown)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def slow_hash(self, password: str) -> str:
+        self.release.wait(5)
+        return "hash:" + password
+
+    async def test_hashing_does_not_block_loop(self):
+        task = asyncio.create_task(self.pool.run(self.slow_hash, "a"))
+        started = time.monotonic()
+        await asyncio.sleep(0.05)
+        # цикл событий живет, пока поток считает хэш
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual((self.pool.running, self.pool.queued), (1, 0))
+
+        self.release.set()
+        self.assertEqual(await task, "hash:a")
+        self.assertEqual(self.pool.stats()["completed"], 1)
+        self.assertEqual(self.pool.in_flight, 0)
+
+    async def test_full_queue_is_rejected(self):
+        tasks = [asyncio.create_task(self.pool.run(self.slow_hash, str(i))) for i in range(2)]
+        await asyncio.sleep(0)
+        self.assertEqual((self.pool.running, self.pool.queued), (1, 1))
+
+        with self.assertRaises(HTTPException) as error:
+            await self.pool.run(self.slow_hash, "3")
+        self.assertEqual(error.exception.status_code, 503)
+
+        self.release.set()
+        self.assertEqual(await asyncio.gather(*tasks), ["hash:0", "hash:1"])
+        stats = self.pool.stats()
+        self.assertEqual((stats["completed"], stats["rejected"], stats["max_queued"]), (2, 1, 1))
+
+    async def test_real_bcrypt_roundtrip(self):
+        hashed = await auth.get_password_hash("secret")
+        self.assertTrue(await auth.verify_password("secret", hashed))
+        self.assertFalse(await auth.verify_password("wrong", hashed))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Скорость разбора обхода FDB и ARP на 100k строк.
+Запуск: python -m app.benchmarks.bench_decode [rows]
+
+Сравниваются:
+- legacy: прежний разбор через строки OID и регулярку (копия для сравнения);
+- extract_*: ответ для /snmp/* (словари в ResultQueryOID);
+- decode_*: легкие записи для CoreManager.
+Отдельно - во что обходится разбор varbind-ов по MIB (lookupMib=True), от которого walk-и отказались.
+"""
+import re
+import sys
+import time
+
+from pysnmp.hlapi.asyncio import ObjectIdentity, ObjectType
+from pysnmp.proto.rfc1902 import Integer, ObjectName, OctetString
+
+from app.snmp.decode import decode_arp, decode_mac_vlan_port
+from app.snmp.oid_query import extract_arp_table, extract_mac_vlan_port, mibViewController
+
+FDB_ROOT = (1, 3, 6, 1, 2, 1, 17, 7, 1, 2, 2, 1, 2)
+ARP_ROOT = (1, 3, 6, 1, 2, 1, 4, 22, 1, 2)
+
+
+def mac_octets(i: int):
+    return 0, 0x0a, (i >> 24) & 255, (i >> 16) & 255, (i >> 8) & 255, i & 255
+
+
+def fdb_walk(rows: int) -> dict:
+    return {
+        "oid_start": ObjectIdentity(".1.3.6.1.2.1.17.7.1.2.2.1.2").resolveWithMib(mibViewController),
+        "result_list": [
+            [ObjectName(FDB_ROOT + (1 + i % 16,) + mac_octets(i)), Integer(1 + i % 48)] for i in range(rows)
+        ],
+    }
+
+
+def arp_walk(rows: int) -> dict:
+    return {
+        "oid_start": ObjectIdentity(".1.3.6.1.2.1.4.22.1.2").resolveWithMib(mibViewController),
+        "result_list": [
+            [ObjectName(ARP_ROOT + (5, 10, (i >> 16) & 255, (i >> 8) & 255, i & 255)), OctetString(bytes(mac_octets(i)))]
+            for i in range(rows)
+        ],
+    }
+
+
+def legacy_mac_vlan_port(data) -> list:
+    reg_exp = re.compile(str(data["oid_start"]) + '.')
+    results = []
+    for elem in data["result_list"]:
+        vlan_and_mac = reg_exp.split(str(elem[0]))[1].split('.')
+        results.append({
+            "mac": ":".join(['{0:02x}'.format(int(el)) for el in vlan_and_mac[1:]]),
+            "vlan": vlan_and_mac[0],
+            "logical_interface_id": str(elem[1]),
+        })
+    return results
+
+
+def measure(name: str, func, data, rows: int, repeat: int = 3):
+    best = min(_timed(func, data) for _ in range(repeat))
+    print("{:<28} {:8.3f} сек. {:>12,.0f} строк/сек.".format(name, best, rows / best))
+
+
+def _timed(func, data) -> float:
+    start = time.perf_counter()
+    func(data)
+    return time.perf_counter() - start
+
+
+def main(rows: int = 100000):
+    print("строк в обходе: {:,}".format(rows))
+    walk = fdb_walk(rows)
+    measure("FDB legacy (строки OID)", legacy_mac_vlan_port, walk, rows)
+    measure("FDB extract_mac_vlan_port", extract_mac_vlan_port, walk, rows)
+    measure("FDB decode_mac_vlan_port", decode_mac_vlan_port, walk, rows)
+
+    walk = arp_walk(rows)
+    measure("ARP extract_arp_table", extract_arp_table, walk, rows)
+    measure("ARP decode_arp", decode_arp, walk, rows)
+
+    # MIB-разбор дорогой, меряем на выборке
+    sample = fdb_walk(2000)["result_list"]
+    measure("FDB lookupMib=True", lambda data: [
+        ObjectType(ObjectIdentity(oid), value).resolveWithMib(mibViewController) for oid, value in data
+    ], sample, len(sample), repeat=1)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,261 @@
+"""
+Сквозной бенчмарк цикла опроса: CoreManager.update_device_tree против имитации парка коммутаторов
+(app.benchmarks.snmp_agent) на loopback. Mongo не нужна - список устройств подставляется в motorchik.find.
+
+Запуск:
+    python -m app.benchmarks.bench_poll --devices 10,100,1000 --fdb 200 --arp 2000 --latency 0.002
+    python -m app.benchmarks.bench_poll --devices 100 --loss 0.01 --dead 5 --cycles 3 --json
+    python -m app.benchmarks.bench_poll --devices 100 --record /tmp/fleet.snmp
+    python -m app.benchmarks.bench_poll --replay /tmp/fleet.snmp --cycles 5
+    python -m app.benchmarks.bench_poll --devices 300 --fdb 2000 --workers 4
+
+С --record сырые ответы агентов пишутся в файл (app.snmp.recorder), с --replay цикл идет по записи
+без агентов и сети - так меряется чистый разбор ответов и сборка дерева.
+С --workers N опрос идет в N процессах (app.core.workers): CPU в отчете - только основного процесса,
+PDU и строки процессов-шардов не считаются.
+Каждый размер парка прогоняется в отдельном процессе, чтобы пиковый RSS был честным.
+На каждый цикл печатается:
+- время цикла и CPU опрашивающего процесса (разбор ответов, extract_*/decode_*, сборка снимка);
+- PDU, отправленные менеджером (get/next/bulk), и сколько запросов дошло до агентов (с повторами);
+- строк (varbind) получено и строк в секунду;
+- опрошено / недоступно устройств, записей FDB в снимке;
+- пиковый RSS процесса.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from unittest import mock
+
+from app.benchmarks.snmp_agent import AGENT_PORT, AgentFleet, FleetSpec
+from app.core.core import CoreManager
+from app.core.models import NewDevice
+from app.core.scheduler import PollScheduler
+from app.core.snapshot import TopologySnapshot
+from app.core.workers import ProcessPoller
+from app.settings import settings
+from app.snmp import oid_query
+from app.snmp.recorder import ReplaySource, WalkRecorder
+from app.snmp.session import SnmpSessionPool
+
+
+class _Cursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def to_list(self, length=None):
+        return self.documents
+
+
+class PduCounter:
+    """ Обертка над getCmd/nextCmd/bulkCmd: считает PDU и полученные varbind-ы """
+
+    def __init__(self):
+        self.pdus = {"get": 0, "next": 0, "bulk": 0}
+        self.rows = 0
+
+    def wrap(self, kind: str, command):
+        async def counted(*args, **options):
+            self.pdus[kind] += 1
+            error_indication, error_status, error_index, var_binds = await command(*args, **options)
+            if not error_indication and var_binds:
+                self.rows += sum(len(row) for row in var_binds) if kind != "get" else len(var_binds)
+            return error_indication, error_status, error_index, var_binds
+        return counted
+
+    def patch(self):
+        return [
+            mock.patch.object(oid_query, "getCmd", self.wrap("get", oid_query.getCmd)),
+            mock.patch.object(oid_query, "nextCmd", self.wrap("next", oid_query.nextCmd)),
+            mock.patch.object(oid_query, "bulkCmd", self.wrap("bulk", oid_query.bulkCmd)),
+        ]
+
+    def take(self):
+        pdus, rows = (dict(self.pdus), self.rows)
+        self.pdus, self.rows = ({"get": 0, "next": 0, "bulk": 0}, 0)
+        return pdus, rows
+
+
+def device_documents(hosts, port: int = AGENT_PORT, community: str = "public"):
+    """ hosts - список адресов или {host: port} """
+    example = NewDevice.model_config["json_schema_extra"]["examples"][0]
+    ports = hosts if isinstance(hosts, dict) else dict.fromkeys(hosts, port)
+    return [
+        {**example, "host": host, "port": host_port, "community": community, "snmp_ver": 1}
+        for host, host_port in ports.items()
+    ]
+
+
+async def run_cycles(documents: list, args, recorder=None, replay=None) -> list:
+    CoreManager.snapshot = TopologySnapshot.empty()
+    CoreManager.fingerprints, CoreManager.poll_stats = ({}, {})
+    CoreManager.scheduler = PollScheduler(
+        max_devices=args.max_devices, device_concurrency=args.device_concurrency, device_timeout=args.device_timeout
+    )
+    counter = PduCounter()
+    patches = counter.patch() + [
+        mock.patch.object(oid_query, "session_pool", SnmpSessionPool(settings.SNMP_SESSION_IDLE_TIMEOUT, args.pdu_rate)),
+        mock.patch("app.core.core.motorchik.find", return_value=_Cursor(documents)),
+        mock.patch("app.core.core.snapshot_store", None),
+        mock.patch("app.core.core.mac_history", None),
+        mock.patch.object(settings, "POLL_CHANGE_DETECTION", not args.no_change_detection),
+        mock.patch.object(oid_query, "walk_recorder", recorder),
+        mock.patch.object(oid_query, "replay_source", replay),
+    ]
+    poller = None
+    if args.workers:
+        poller = ProcessPoller(args.workers, args.max_devices)
+        # процессы-шарды читают настройки из окружения
+        patches += [
+            mock.patch.object(CoreManager, "process_poller", poller),
+            mock.patch.dict(os.environ, {
+                "POLL_CHANGE_DETECTION": str(not args.no_change_detection).lower(),
+                "POLL_DEVICE_CONCURRENCY": str(args.device_concurrency),
+                "POLL_DEVICE_TIMEOUT": str(args.device_timeout),
+                "SNMP_DEVICE_PDU_RATE": str(args.pdu_rate),
+            }),
+        ]
+    cycles = []
+    with contextlib.ExitStack() as stack:
+        for patcher in patches:
+            stack.enter_context(patcher)
+        for cycle in range(args.cycles):
+            started, cpu_started = (time.perf_counter(), time.process_time())
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                await CoreManager.update_device_tree()
+            elapsed, cpu = (time.perf_counter() - started, time.process_time() - cpu_started)
+            pdus, rows = counter.take()
+            snapshot = CoreManager.snapshot
+            cycles.append({
+                "cycle": cycle + 1,
+                "cycle_time": round(elapsed, 3),
+                "cpu_time": round(cpu, 3),
+                "pdus": pdus,
+                "pdus_total": sum(pdus.values()),
+                "rows": rows,
+                "rows_per_sec": round(rows / elapsed) if elapsed else 0,
+                "devices": len(snapshot.device_dict),
+                "unreachable": len(snapshot.unreachable),
+                "fdb_entries": len(snapshot.fdb),
+                "timeouts": (poller or CoreManager.scheduler).timeouts,
+            })
+    if poller is not None:
+        poller.shutdown()
+    return cycles
+
+
+def run_replay(args) -> dict:
+    replay = ReplaySource.load(args.replay)
+    cycles = asyncio.run(run_cycles(device_documents(replay.hosts), args, replay=replay))
+    return {
+        "devices": len(replay.hosts),
+        "cycles": cycles,
+        "agents": {"received": 0, "sent": 0, "dropped": 0},
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run_single(args) -> dict:
+    spec = FleetSpec(
+        devices=args.devices_single, ports=args.ports, fdb=args.fdb, arp=args.arp, vlans=args.vlans,
+        latency=args.latency, jitter=args.jitter, loss=args.loss, dead=args.dead
+    )
+    recorder = WalkRecorder(args.record) if args.record else None
+    fleet = AgentFleet(spec, procs=args.agent_procs).start()
+    try:
+        cycles = asyncio.run(run_cycles(device_documents(spec.hosts(), community=spec.community), args, recorder))
+    finally:
+        agents = fleet.stop()
+        if recorder is not None:
+            recorder.close()
+    return {
+        "devices": spec.devices,
+        "cycles": cycles,
+        "agents": agents,
+        # ru_maxrss в Linux - в килобайтах
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def print_report(result: dict):
+    print("\n=== {} устройств, пиковый RSS {} МБ, агенты: получено {received}, ответов {sent}, потеряно {dropped}".format(
+        result["devices"], result["peak_rss_mb"], **result["agents"]
+    ))
+    print("{:>5} {:>9} {:>8} {:>8} {:>6} {:>6} {:>6} {:>9} {:>10} {:>7} {:>6} {:>9}".format(
+        "цикл", "время,с", "CPU,с", "PDU", "get", "next", "bulk", "строк", "строк/с", "опрош.", "недост", "FDB"
+    ))
+    for c in result["cycles"]:
+        print("{:>5} {:>9.2f} {:>8.2f} {:>8} {:>6} {:>6} {:>6} {:>9} {:>10} {:>7} {:>6} {:>9}".format(
+            c["cycle"], c["cycle_time"], c["cpu_time"], c["pdus_total"], c["pdus"]["get"], c["pdus"]["next"],
+            c["pdus"]["bulk"], c["rows"], c["rows_per_sec"], c["devices"], c["unreachable"], c["fdb_entries"]
+        ))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк цикла опроса на имитации парка SNMP-коммутаторов")
+    parser.add_argument("--devices", default="10,100", help="размеры парка через запятую")
+    parser.add_argument("--ports", type=int, default=48, help="портов на access-коммутаторе")
+    parser.add_argument("--fdb", type=int, default=200, help="MAC-ов хостов в FDB каждого устройства")
+    parser.add_argument("--arp", type=int, default=0, help="записей ARP на ядре")
+    parser.add_argument("--vlans", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа агента, сек.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="плюс случайная задержка до jitter сек.")
+    parser.add_argument("--loss", type=float, default=0.0, help="доля теряемых запросов, 0..1")
+    parser.add_argument("--dead", type=int, default=0, help="сколько устройств не отвечают вообще")
+    parser.add_argument("--cycles", type=int, default=2, help="циклов опроса подряд")
+    parser.add_argument("--agent-procs", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--max-devices", type=int, default=settings.POLL_MAX_DEVICES)
+    parser.add_argument("--device-concurrency", type=int, default=settings.POLL_DEVICE_CONCURRENCY)
+    parser.add_argument("--device-timeout", type=float, default=settings.POLL_DEVICE_TIMEOUT)
+    parser.add_argument("--pdu-rate", type=float, default=settings.SNMP_DEVICE_PDU_RATE)
+    parser.add_argument("--no-change-detection", action="store_true")
+    parser.add_argument("--workers", type=int, default=0, help="опрашивать в стольких процессах (POLL_WORKERS)")
+    parser.add_argument("--record", help="дописывать сырые ответы агентов в этот файл")
+    parser.add_argument("--replay", help="вместо агентов отвечать из записи")
+    parser.add_argument("--json", action="store_true", help="результат одним JSON в stdout")
+    parser.add_argument("--devices-single", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+
+    if args.devices_single is not None:
+        print(json.dumps(run_single(args)))
+        return
+
+    if args.replay:
+        result = run_replay(args)
+        if args.json:
+            print(json.dumps([result], ensure_ascii=False, indent=2))
+        else:
+            print_report(result)
+        return
+
+    results = []
+    for devices in [int(el) for el in args.devices.split(",")]:
+        # свежий процесс на каждый размер - иначе пиковый RSS накапливается от прогона к прогону
+        proc = subprocess.run(
+            [sys.executable, "-m", "app.benchmarks.bench_poll", *argv, "--devices-single", str(devices)],
+            capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            raise SystemExit("прогон на {} устройствах упал".format(devices))
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        results.append(result)
+        if not args.json:
+            print_report(result)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
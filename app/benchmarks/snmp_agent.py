@@ -0,0 +1,311 @@
+"""
+Имитация парка SNMP-коммутаторов на loopback для бенчмарков опроса.
+
+Каждое устройство - UDP-сокет на своем адресе 127.1.x.y (порт общий), отвечает SNMP v2c
+GET / GETNEXT / GETBULK из синтетических таблиц: system, ifTable, ipAddrTable, ARP (ipNetToMedia),
+Q-BRIDGE FDB (dot1qTpFdbPort) и счетчики, которые смотрит change detection.
+Ответы можно задерживать (latency + jitter), терять (loss) и не отдавать совсем (dead - устройство "висит").
+SNMP v1 не поддерживается - такие запросы просто остаются без ответа.
+
+Топология - звезда: устройство 0 - ядро, остальные - access-коммутаторы, каждый на своем порту ядра.
+Ядро видит в FDB MAC-и access-коммутаторов, access-коммутатор видит ядро на порту 1.
+У каждого устройства еще fdb "хостов" на остальных портах, у ядра - ARP на arp записей.
+
+Агенты работают в отдельных процессах (procs), чтобы их CPU не смешивался с CPU опрашивающей стороны.
+"""
+import asyncio
+import bisect
+import multiprocessing
+import random
+import resource
+from typing import Dict, List, Optional, Tuple
+
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api, rfc1905
+from pysnmp.proto.rfc1902 import Integer, IpAddress, ObjectName, OctetString, TimeTicks
+
+AGENT_PORT = 16100
+
+SYSTEM = (1, 3, 6, 1, 2, 1, 1)
+IF_ENTRY = (1, 3, 6, 1, 2, 1, 2, 2, 1)
+IP_ADDR_ENTRY = (1, 3, 6, 1, 2, 1, 4, 20, 1)
+IP_NET_TO_MEDIA_PHYS = (1, 3, 6, 1, 2, 1, 4, 22, 1, 2)
+TP_LEARNED_ENTRY_DISCARDS = (1, 3, 6, 1, 2, 1, 17, 4, 2, 0)
+FDB_DYNAMIC_COUNT = (1, 3, 6, 1, 2, 1, 17, 7, 1, 2, 1, 1, 2)
+TP_FDB_PORT = (1, 3, 6, 1, 2, 1, 17, 7, 1, 2, 2, 1, 2)
+IF_TABLE_LAST_CHANGE = (1, 3, 6, 1, 2, 1, 31, 1, 5, 0)
+
+V2C = api.protoModules[api.protoVersion2c]
+
+
+class FleetSpec:
+    """
+    Параметры синтетического парка. Таблицы устройства строятся детерминированно по его номеру,
+    так что процессы-агенты собирают их сами и не гоняют через pickle.
+    """
+
+    def __init__(
+            self,
+            devices: int,
+            ports: int = 48,
+            fdb: int = 200,
+            arp: int = 0,
+            vlans: int = 4,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            loss: float = 0.0,
+            dead: int = 0,
+            community: str = "public",
+    ):
+        self.devices = devices
+        self.ports = max(2, ports)
+        self.fdb = fdb
+        self.arp = arp
+        self.vlans = max(1, vlans)
+        self.latency = latency  # сек., задержка каждого ответа
+        self.jitter = jitter  # сек., плюс случайно от 0 до jitter
+        self.loss = loss  # доля потерянных запросов, 0..1
+        self.dead = dead  # столько последних устройств не отвечают вообще
+        self.community = community
+
+    def host(self, index: int) -> str:
+        return "127.1.{}.{}".format(index // 250, index % 250 + 1)
+
+    def hosts(self) -> List[str]:
+        return [self.host(index) for index in range(self.devices)]
+
+    def is_dead(self, index: int) -> bool:
+        return index >= self.devices - self.dead
+
+    @staticmethod
+    def device_mac(index: int) -> int:
+        return 0x020000000000 + index
+
+    @staticmethod
+    def host_mac(index: int, n: int) -> int:
+        return 0x0a0000000000 + (index << 20) + n
+
+    def core_ports(self) -> int:
+        # у ядра портов хватает на всех access-коммутаторов плюс порты под хосты
+        return max(self.ports, self.devices)
+
+    def device_table(self, index: int) -> "AgentTable":
+        host = self.host(index)
+        n_ports = self.core_ports() if index == 0 else self.ports
+        own_mac = OctetString(self.device_mac(index).to_bytes(6, "big"))
+        rows: List[Tuple[Tuple[int, ...], object]] = [
+            (SYSTEM + (1, 0), OctetString("synthetic switch {}".format(host))),
+            (SYSTEM + (2, 0), ObjectName("1.3.6.1.4.1.8072.3.2.10")),
+            (SYSTEM + (3, 0), TimeTicks(360000)),
+            (SYSTEM + (4, 0), OctetString("bench")),
+            (SYSTEM + (5, 0), OctetString("sw-{}".format(index))),
+            (SYSTEM + (6, 0), OctetString("rack {}".format(index // 40))),
+            (SYSTEM + (7, 0), Integer(2)),
+            (TP_LEARNED_ENTRY_DISCARDS, Integer(0)),
+            (IF_TABLE_LAST_CHANGE, TimeTicks(100)),
+        ]
+        for if_index in range(1, n_ports + 1):
+            rows.append((IF_ENTRY + (2, if_index), OctetString("gi1/0/{}".format(if_index))))
+            rows.append((IF_ENTRY + (3, if_index), Integer(6)))
+            rows.append((IF_ENTRY + (6, if_index), own_mac))
+            rows.append((IF_ENTRY + (7, if_index), Integer(1)))
+
+        address = tuple(int(el) for el in host.split("."))
+        for column, value in enumerate(
+                (IpAddress(host), Integer(1), IpAddress("255.0.0.0"), Integer(1), Integer(65535)), 1):
+            rows.append((IP_ADDR_ENTRY + (column,) + address, value))
+
+        # FDB: (vlan, mac) -> port
+        fdb: Dict[Tuple[int, int], int] = {}
+        if index == 0:
+            for access in range(1, self.devices):
+                fdb[(1, self.device_mac(access))] = access
+        else:
+            fdb[(1, self.device_mac(0))] = 1
+        first_host_port = self.devices if index == 0 else 2
+        host_ports = max(1, n_ports - first_host_port + 1)
+        for n in range(self.fdb):
+            fdb[(1 + n % self.vlans, self.host_mac(index, n))] = first_host_port + n % host_ports
+        port_values = {}
+        for (vlan, mac), port in fdb.items():
+            value = port_values.setdefault(port, Integer(port))
+            rows.append((TP_FDB_PORT + (vlan,) + tuple(mac.to_bytes(6, "big")), value))
+        vlan_counts = {}
+        for vlan, _ in fdb:
+            vlan_counts[vlan] = vlan_counts.get(vlan, 0) + 1
+        for vlan, count in vlan_counts.items():
+            rows.append((FDB_DYNAMIC_COUNT + (vlan,), Integer(count)))
+
+        if index == 0:
+            for n in range(self.arp):
+                access = 1 + n % max(1, self.devices - 1)
+                mac = self.host_mac(access, n // max(1, self.devices - 1))
+                ip = (10, (n >> 16) & 255, (n >> 8) & 255, n & 255)
+                rows.append((IP_NET_TO_MEDIA_PHYS + (1,) + ip, OctetString(mac.to_bytes(6, "big"))))
+
+        return AgentTable(rows)
+
+
+class AgentTable:
+    """ Отсортированные OID-ы устройства и их значения, поиск следующего OID - бинарный """
+
+    def __init__(self, rows: List[Tuple[Tuple[int, ...], object]]):
+        rows.sort(key=lambda el: el[0])
+        self.oids = [el[0] for el in rows]
+        self.values = [el[1] for el in rows]
+        self._by_oid = dict(rows)
+
+    def get(self, oid: Tuple[int, ...]):
+        return self._by_oid.get(oid, rfc1905.noSuchObject)
+
+    def next(self, oid: Tuple[int, ...], count: int = 1) -> List[Tuple[Tuple[int, ...], object]]:
+        i = bisect.bisect_right(self.oids, oid)
+        rows = list(zip(self.oids[i:i + count], self.values[i:i + count]))
+        return rows
+
+
+def build_response(table: AgentTable, community: str, message: bytes) -> Optional[bytes]:
+    if int(api.decodeMessageVersion(message)) != api.protoVersion2c:
+        return None
+    request, _ = decoder.decode(message, asn1Spec=V2C.Message())
+    if str(V2C.apiMessage.getCommunity(request)) != community:
+        return None
+
+    response = V2C.apiMessage.getResponse(request)
+    request_pdu = V2C.apiMessage.getPDU(request)
+    response_pdu = V2C.apiMessage.getPDU(response)
+    var_binds = [(tuple(oid), value) for oid, value in V2C.apiPDU.getVarBinds(request_pdu)]
+
+    out = []
+    if request_pdu.isSameTypeWith(V2C.GetRequestPDU()):
+        out = [(oid, table.get(oid)) for oid, _ in var_binds]
+    elif request_pdu.isSameTypeWith(V2C.GetNextRequestPDU()):
+        for oid, _ in var_binds:
+            rows = table.next(oid)
+            out.append(rows[0] if rows else (oid, rfc1905.endOfMibView))
+    elif request_pdu.isSameTypeWith(V2C.GetBulkRequestPDU()):
+        non_repeaters = int(V2C.apiBulkPDU.getNonRepeaters(request_pdu))
+        max_repetitions = int(V2C.apiBulkPDU.getMaxRepetitions(request_pdu))
+        for oid, _ in var_binds[:non_repeaters]:
+            rows = table.next(oid)
+            out.append(rows[0] if rows else (oid, rfc1905.endOfMibView))
+        # GETBULK отдает строки: в каждой по следующему OID на каждый repeater
+        columns = []
+        for oid, _ in var_binds[non_repeaters:]:
+            rows = table.next(oid, max_repetitions)
+            last = rows[-1][0] if rows else oid
+            rows += [(last, rfc1905.endOfMibView)] * (max_repetitions - len(rows))
+            columns.append(rows)
+        for row in zip(*columns):
+            out.extend(row)
+    else:
+        return None
+
+    V2C.apiPDU.setVarBinds(response_pdu, [(ObjectName(oid), value) for oid, value in out])
+    return encoder.encode(response)
+
+
+class AgentProtocol(asyncio.DatagramProtocol):
+    def __init__(self, table: AgentTable, spec: FleetSpec, dead: bool, stats: Dict[str, int]):
+        self.table = table
+        self.spec = spec
+        self.dead = dead
+        self.stats = stats
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.stats["received"] += 1
+        if self.dead or random.random() < self.spec.loss:
+            self.stats["dropped"] += 1
+            return
+        response = build_response(self.table, self.spec.community, data)
+        if response is None:
+            self.stats["dropped"] += 1
+            return
+        self.stats["sent"] += 1
+        delay = self.spec.latency + random.random() * self.spec.jitter
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.transport.sendto, response, addr)
+        else:
+            self.transport.sendto(response, addr)
+
+
+def _raise_nofile_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def _serve(spec: FleetSpec, indexes: List[int], ready, stop, results):
+    _raise_nofile_limit()
+    stats = {"received": 0, "sent": 0, "dropped": 0}
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        transports = []
+        for index in indexes:
+            table = spec.device_table(index)
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: AgentProtocol(table, spec, spec.is_dead(index), stats),
+                local_addr=(spec.host(index), AGENT_PORT)
+            )
+            transports.append(transport)
+        ready.set()
+        while not stop.is_set():
+            await asyncio.sleep(0.1)
+        for transport in transports:
+            transport.close()
+
+    asyncio.run(serve())
+    results.put(stats)
+
+
+class AgentFleet:
+    """
+    Запуск агентов в procs процессах (устройства делятся между ними по кругу).
+    stop() возвращает сумму счетчиков: received / sent / dropped запросов.
+    """
+
+    def __init__(self, spec: FleetSpec, procs: int = 1):
+        self.spec = spec
+        self.procs = max(1, min(procs, spec.devices))
+        self._stop = multiprocessing.Event()
+        self._results = multiprocessing.Queue()
+        self._workers: List[multiprocessing.Process] = []
+
+    def start(self, timeout: float = 120) -> "AgentFleet":
+        ready_events = []
+        for proc in range(self.procs):
+            ready = multiprocessing.Event()
+            worker = multiprocessing.Process(
+                target=_serve,
+                args=(self.spec, list(range(proc, self.spec.devices, self.procs)), ready, self._stop, self._results),
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+            ready_events.append(ready)
+        for ready in ready_events:
+            if not ready.wait(timeout):
+                self.stop()
+                raise RuntimeError("SNMP агенты не поднялись за {} сек.".format(timeout))
+        return self
+
+    def stop(self) -> Dict[str, int]:
+        self._stop.set()
+        totals = {"received": 0, "sent": 0, "dropped": 0}
+        for worker in self._workers:
+            if worker.is_alive() or worker.exitcode == 0:
+                try:
+                    stats = self._results.get(timeout=10)
+                except Exception:
+                    continue
+                for key in totals:
+                    totals[key] += stats[key]
+        for worker in self._workers:
+            worker.join(timeout=5)
+        self._workers = []
+        return totals
@@ -0,0 +1,72 @@
+import asyncio
+import contextlib
+import io
+import unittest
+from unittest import mock
+
+from pysnmp.hlapi.asyncio import SnmpEngine
+
+from app.benchmarks.bench_poll import _Cursor, device_documents
+from app.benchmarks.snmp_agent import AGENT_PORT, AgentProtocol, FleetSpec
+from app.core.core import CoreManager
+from app.core.snapshot import TopologySnapshot
+from app.snmp import oid_query
+from app.snmp.models import QueryOID
+from app.snmp.session import SnmpSessionPool
+
+
+class TestSimulatedFleet(unittest.IsolatedAsyncioTestCase):
+    """
+    Агенты в том же event loop, запросы идут через настоящий UDP на loopback.
+    """
+
+    async def asyncSetUp(self):
+        self.spec = FleetSpec(devices=3, ports=8, fdb=30, arp=10)
+        self.stats = {"received": 0, "sent": 0, "dropped": 0}
+        loop = asyncio.get_running_loop()
+        for index in range(self.spec.devices):
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: AgentProtocol(self.spec.device_table(index), self.spec, False, self.stats),
+                local_addr=(self.spec.host(index), AGENT_PORT)
+            )
+            self.addCleanup(transport.close)
+        # у SnmpEngine транспорт привязан к event loop, а он у каждого теста свой
+        engine = SnmpEngine()
+        for patcher in (
+                mock.patch.object(oid_query, "snmp_engine", engine),
+                mock.patch.object(oid_query, "session_pool", SnmpSessionPool(600)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: engine.transportDispatcher and engine.transportDispatcher.closeDispatcher())
+
+    async def test_bulk_walk(self):
+        res = await oid_query.get_oid_from_to(QueryOID(
+            host=self.spec.host(1), port=AGENT_PORT,
+            oid_start=".1.3.6.1.2.1.17.7.1.2.2.1.2", oid_stop=".1.3.6.1.2.1.17.7.1.2.2.1.3", max_repetitions=10
+        ))
+        self.assertIsNone(res["error"])
+        # 30 хостов + ядро на аплинке
+        self.assertEqual(res["count"], 31)
+        self.assertEqual(self.stats["received"], 4)
+
+    async def test_poll_cycle_builds_star(self):
+        CoreManager.snapshot = TopologySnapshot.empty()
+        CoreManager.fingerprints, CoreManager.poll_stats = ({}, {})
+        with mock.patch("app.core.core.motorchik.find", return_value=_Cursor(device_documents(self.spec.hosts()))), \
+                mock.patch("app.core.core.snapshot_store", None), mock.patch("app.core.core.mac_history", None), \
+                contextlib.redirect_stdout(io.StringIO()):
+            await CoreManager.update_device_tree()
+
+        snapshot = CoreManager.snapshot
+        CoreManager.snapshot = TopologySnapshot.empty()
+        core, first, second = self.spec.hosts()
+        self.assertEqual(len(snapshot.device_dict), 3)
+        self.assertEqual(list(snapshot.device_tree), [core])
+        self.assertIn(first, snapshot.device_tree[core]["ports"]["1"]["uplink"])
+        self.assertIn(second, snapshot.device_tree[core]["ports"]["2"]["uplink"])
+        self.assertEqual(len(snapshot.mac_ip_dict), 10 + 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
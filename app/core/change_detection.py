@@ -0,0 +1,70 @@
+"""
+Дешевая проверка "изменилось ли что-нибудь на устройстве" перед тяжелыми обходами FDB и ARP.
+
+Отпечаток устройства:
+- sysUpTime - если уменьшился, устройство перезагружалось, таблицы надо перечитать;
+- ifTableLastChange - время последнего изменения таблицы интерфейсов (порты поднялись/упали);
+- dot1dTpLearnedEntryDiscards - счетчик выброшенных из переполненной FDB записей;
+- dot1qFdbDynamicCount - количество динамических записей по каждой FDB (обычно по одной на VLAN).
+
+Отдельного счетчика размера ARP-таблицы в IP-MIB нет, поэтому ARP и перемещения MAC-ов между портами
+(количество записей при этом не меняется) ловит только полный обход. Он делается принудительно раз
+в settings.POLL_FULL_WALK_EVERY циклов, даже если отпечаток не изменился.
+"""
+from typing import Optional, Tuple
+
+from app.core.models import NewDevice
+from app.snmp.models import QueryOID
+from app.snmp.oid_query import get_oids, get_oid_from_to
+
+SYS_UPTIME_OID = "1.3.6.1.2.1.1.3.0"
+IF_TABLE_LAST_CHANGE_OID = "1.3.6.1.2.1.31.1.5.0"
+TP_LEARNED_ENTRY_DISCARDS_OID = "1.3.6.1.2.1.17.4.2.0"
+FDB_DYNAMIC_COUNT_OID = ("1.3.6.1.2.1.17.7.1.2.1.1.2", "1.3.6.1.2.1.17.7.1.2.1.1.3")
+
+
+class DeviceFingerprint:
+    def __init__(self, uptime: int, counters: Tuple):
+        self.uptime = uptime
+        self.counters = counters
+
+    def same_state_as(self, previous: Optional["DeviceFingerprint"]) -> bool:
+        """
+        Состояние то же самое, если устройство не перезагружалось и ни один счетчик не изменился.
+        Без счетчиков FDB (устройство не поддерживает dot1qFdbDynamicCount) отпечаток ничего не доказывает.
+        """
+        if previous is None or self.counters[-1] is None:
+            return False
+        return self.uptime >= previous.uptime and self.counters == previous.counters
+
+
+async def take_fingerprint(dev: NewDevice) -> Optional[DeviceFingerprint]:
+    """
+    Два маленьких запроса: GET скаляров и обход колонки dot1qFdbDynamicCount (пара строк).
+    None - если устройство не ответило, тогда решение за полным обходом.
+    """
+    def query(oid_start: str = "", oid_stop: str = "") -> QueryOID:
+        return QueryOID(
+            host=dev.host, port=dev.port, community=dev.community, snmp_ver=dev.snmp_ver,
+            oid_start=oid_start, oid_stop=oid_stop
+        )
+
+    scalars = await get_oids(query(), [SYS_UPTIME_OID, IF_TABLE_LAST_CHANGE_OID, TP_LEARNED_ENTRY_DISCARDS_OID])
+    if scalars["error"] is not None:
+        return None
+    values = {str(oid): int(value) for oid, value in scalars["result_list"]}
+    if SYS_UPTIME_OID not in values:
+        return None
+
+    fdb_counts = await get_oid_from_to(query(*FDB_DYNAMIC_COUNT_OID))
+    if fdb_counts["error"] is not None:
+        return None
+
+    return DeviceFingerprint(
+        uptime=values[SYS_UPTIME_OID],
+        counters=(
+            values.get(IF_TABLE_LAST_CHANGE_OID),
+            values.get(TP_LEARNED_ENTRY_DISCARDS_OID),
+            tuple((str(oid), int(value)) for oid, value in fdb_counts["result_list"]) or None,
+        )
+    )
@@ -0,0 +1,148 @@
+"""
+Несколько экземпляров приложения за балансировщиком (CLUSTER_ENABLED).
+Опрашивает сеть ровно один - лидер, владелец аренды в MongoDB (коллекция leases, документ poller):
+{_id, holder, expires, update_requested}. Лидер продлевает аренду каждые CLUSTER_LEASE_TTL / 3 сек.
+и после каждого цикла пишет снимок в хранилище снимков (SNAPSHOT_STORE=mongo).
+Остальные только отвечают на HTTP: раз в тот же интервал смотрят версию сохраненного снимка
+и, если она новее своей, поднимают его и публикуют как обычный снимок - /core/get_place, /core/search
+и /core/events работают на любом экземпляре.
+
+Захват и продление - одна операция: update_one с upsert по фильтру "аренда моя или истекла".
+Если аренда чужая и живая, фильтр не находит документ, upsert упирается в уникальный _id -
+DuplicateKeyError, значит не лидер. Упавший лидер перестает продлевать, через CLUSTER_LEASE_TTL
+аренда истекает, и ближайший тик любого другого экземпляра ее забирает. Остановленный лидер
+отдает аренду сразу. Сроки сравниваются по часам экземпляров - их расхождение должно быть
+много меньше CLUSTER_LEASE_TTL.
+
+Запрос на опрос (добавили устройство) на не-лидере уходит лидеру через update_requested в документе аренды.
+"""
+import asyncio
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from app.core.core import Core, CoreManager
+from app.core.snapshot_store import snapshot_store
+from app.database import motorchik
+from app.metrics import gauge_callback
+from app.settings import settings
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ClusterNode:
+
+    def __init__(self, engine, store, node_id: str, lease_ttl: float,
+                 collection: str = "leases", name: str = "poller"):
+        self.engine = engine
+        self.store = store
+        self.node_id = node_id
+        self.lease_ttl = lease_ttl
+        self.collection = collection
+        self.name = name
+        self.is_leader = False
+        self.elections = 0
+        self.synced = 0
+
+    @property
+    def interval(self) -> float:
+        return self.lease_ttl / 3
+
+    async def acquire(self) -> bool:
+        """ Захватить или продлить аренду. True - этот экземпляр лидер до now + lease_ttl """
+        now = _now()
+        try:
+            await self.engine.update_one(
+                self.collection,
+                {"_id": self.name, "$or": [{"holder": self.node_id}, {"expires": {"$lte": now}}]},
+                {"$set": {"holder": self.node_id, "expires": now + timedelta(seconds=self.lease_ttl)}}
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def release(self):
+        if self.is_leader:
+            await self.engine.update_one(
+                self.collection, {"_id": self.name, "holder": self.node_id}, {"$set": {"expires": _now()}},
+                upsert=False
+            )
+        self.is_leader = False
+
+    async def request_update(self):
+        await self.engine.update_one(
+            self.collection, {"_id": self.name}, {"$set": {"update_requested": _now()}}, upsert=False
+        )
+
+    async def tick(self):
+        was_leader = self.is_leader
+        self.is_leader = await self.acquire()
+        if self.is_leader != was_leader:
+            print("узел {}: {}".format(self.node_id, "лидер, опрашиваю сеть" if self.is_leader else "ведомый"))
+        if self.is_leader:
+            if not was_leader:
+                self.elections += 1
+                # нумерация снимков продолжается с последнего сохраненного, а прежний лидер
+                # мог не закончить цикл - опрашиваем сразу
+                await self.sync()
+                Core.update()
+            lease = await self.engine.find_one(self.collection, {"_id": self.name})
+            if lease is not None and lease.get("update_requested") is not None:
+                Core.update()
+                await self.engine.update_one(
+                    self.collection, {"_id": self.name, "update_requested": lease["update_requested"]},
+                    {"$unset": {"update_requested": ""}}, upsert=False
+                )
+            return
+
+        if Core.is_in_progress():
+            await self.request_update()
+            Core.updated()
+        await self.sync()
+
+    async def sync(self):
+        """ Поднять снимок лидера, если он новее опубликованного здесь """
+        if self.store is None:
+            return
+        version = await self.store.version()
+        if version is not None and version > CoreManager.snapshot.version:
+            snapshot = await self.store.load()
+            if snapshot is not None and snapshot.version > CoreManager.snapshot.version:
+                CoreManager.publish(snapshot)
+                self.synced += 1
+
+    async def run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # база недоступна - аренду не продлить, опрашивать дальше нельзя
+                print("узел {}: {}".format(self.node_id, e))
+                self.is_leader = False
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {"node_id": self.node_id, "is_leader": self.is_leader, "elections": self.elections,
+                "synced": self.synced}
+
+
+@gauge_callback("netviewer_cluster_leader", "1 - этот экземпляр сейчас лидер и опрашивает сеть")
+def collect_cluster():
+    if CoreManager.cluster_node is not None:
+        return int(CoreManager.cluster_node.is_leader)
+
+
+def make_cluster_node() -> Optional[ClusterNode]:
+    if not settings.CLUSTER_ENABLED:
+        return None
+    if snapshot_store is None:
+        print("CLUSTER_ENABLED без SNAPSHOT_STORE: ведомые не увидят снимков лидера")
+    node_id = settings.CLUSTER_NODE_ID or "{}:{}".format(socket.gethostname(), os.getpid())
+    return ClusterNode(motorchik, snapshot_store, node_id, settings.CLUSTER_LEASE_TTL)
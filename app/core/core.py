@@ -1,29 +1,118 @@
 import asyncio
 import copy
+import heapq
+import time
 import traceback
+from datetime import datetime, timezone
 from pprint import pprint
-from typing import List, Dict, Optional
-
-from app.core.models import NewDevice, DeviceInfo, PortInfo, InternalIP
+from typing import List, Dict, Optional, Tuple
+
+from app.core.change_detection import DeviceFingerprint, take_fingerprint
+from app.core.events import diff_snapshots, event_hub
+from app.core.fdb_store import FdbStore, FdbTable, mac_to_int, int_to_mac
+from app.core.history import mac_history
+from app.core.models import NewDevice, DeviceInfo, PortInfo, InternalIP, LldpNeighbor
+from app.core.scheduler import PollScheduler
+from app.core.snapshot import TopologySnapshot, build_indexes, build_mac_ip_dict
+from app.core.snapshot_store import snapshot_store
+from app.core.topology import topology_engine
 from app.core.utils import is_it_ipv4, is_it_mac_addr
 from app.database import motorchik
-from app.snmp.models import QueryOID, ResultQueryOID
-from app.snmp.router_snmp import (
-    query_info_ip,
-    query_info,
-    query_mac_vlan_port,
-    query_ports,
-    query_arp_table,
-    query_info_mac
+from app.metrics import Counter, DURATION_BUCKETS, Histogram, gauge_callback, registry
+from app.settings import settings
+from app.snmp.decode import (
+    decode_system_info,
+    decode_mac_vlan_port,
+    decode_ports,
+    decode_ip_addr,
+    decode_arp,
+    decode_phys_address,
+    decode_lldp_local_ports,
+    decode_lldp_remote,
+)
+from app.snmp.models import QueryOID
+from app.snmp.oid_query import (
+    get_oid_from_to,
+    get_table,
+    table_to_walk,
+    ip_addr_columns,
+)
+
+# ifPhysAddress: MAC-адреса интерфейсов, индекс тот же ifIndex, что и у портов
+IF_PHYS_ADDRESS_OID = (".1.3.6.1.2.1.2.2.1.6", ".1.3.6.1.2.1.2.2.1.7")
+
+# LLDP-MIB: соседи одним get_table, несколько строк на устройство вместо FDB
+LLDP_LOC_PORT_OID = ".1.0.8802.1.1.2.1.3.7.1"
+LLDP_REM_OID = ".1.0.8802.1.1.2.1.4.1.1"
+LLDP_REM_MAN_ADDR_OID = ".1.0.8802.1.1.2.1.4.2.1"
+LLDP_COLUMNS = [
+    (LLDP_LOC_PORT_OID + ".3", LLDP_LOC_PORT_OID + ".5"),  # lldpLocPortId, lldpLocPortDesc
+    (LLDP_REM_OID + ".4", LLDP_REM_OID + ".6"),  # lldpRemChassisIdSubtype, lldpRemChassisId
+    (LLDP_REM_OID + ".7", LLDP_REM_OID + ".8"),  # lldpRemPortId
+    (LLDP_REM_OID + ".9", LLDP_REM_OID + ".10"),  # lldpRemSysName
+    (LLDP_REM_MAN_ADDR_OID + ".3", LLDP_REM_MAN_ADDR_OID + ".4"),  # lldpRemManAddrIfSubtype, адрес - в индексе
+]
+
+WALK_SECONDS = Histogram(
+    "netviewer_walk_duration_seconds", "Время одного обхода устройства, по таблице", ["table"],
+    buckets=DURATION_BUCKETS, registry=registry
+)
+WALK_ROWS = Counter(
+    "netviewer_walk_rows_total", "Строк (varbind) получено обходами, по таблице", ["table"], registry=registry
+)
+POLL_DEVICES = Counter(
+    "netviewer_poll_devices_total",
+    "Устройства по итогу опроса: walked - полный обход, skipped - не менялось, failed - ответ с ошибкой",
+    ["result"], registry=registry
+)
+POLL_TIMEOUTS = Counter(
+    "netviewer_poll_device_timeouts_total", "Устройства, брошенные по POLL_DEVICE_TIMEOUT", registry=registry
+)
+POLL_CYCLE_SECONDS = Histogram(
+    "netviewer_poll_cycle_seconds", "Цикл update_device_tree: poll - опрос устройств, build - сборка и публикация снимка",
+    ["phase"], buckets=DURATION_BUCKETS, registry=registry
 )
+DEVICE_POLL_SECONDS = Histogram(
+    "netviewer_device_poll_seconds", "Время опроса одного устройства", buckets=DURATION_BUCKETS, registry=registry
+)
+# самые медленные устройства последнего цикла: {host: секунд}, не больше METRICS_TOP_DEVICES
+slowest_devices: Dict[str, float] = {}
+
+
+@gauge_callback(
+    "netviewer_device_poll_slowest_seconds", "Самые медленные устройства последнего цикла (METRICS_TOP_DEVICES)",
+    "device"
+)
+def collect_slowest_devices():
+    return slowest_devices
+
+
+async def timed_walk(table: str, walk):
+    with WALK_SECONDS.labels(table=table).time():
+        result = await walk
+    if isinstance(result, dict):
+        WALK_ROWS.labels(table=table).inc(result["count"])
+    return result
+
+
+def record_cycle(scheduler):
+    """ Время опроса каждого устройства - в гистограмму, самые медленные - поименно """
+    POLL_CYCLE_SECONDS.labels(phase="poll").observe(scheduler.cycle_time)
+    POLL_TIMEOUTS.inc(scheduler.timeouts)
+    for seconds in scheduler.durations.values():
+        DEVICE_POLL_SECONDS.observe(seconds)
+    slowest_devices.clear()
+    for host, seconds in heapq.nlargest(settings.METRICS_TOP_DEVICES, scheduler.durations.items(), key=lambda el: el[1]):
+        slowest_devices[host] = round(seconds, 3)
 
 
 #################################################################
 # Секция вспомогательных инструментов
 #################################################################
-def search_mac_address(mac_ip: dict, where_dict: Dict[str, DeviceInfo]):
+def search_mac_address(mac_ip: dict, fdb: FdbStore, where_dict: Dict[str, DeviceInfo]):
     """
     mac_ip: {"mac": ""68:13:e2:85:c2:80, "ip": "10.20.30.41"}
+    Где светится MAC и сколько маков на порту - берем из fdb (см. build_indexes), имя порта - из where_dict.
     """
     # print("search_mac_address: {}".format(mac_ip))
     results = {
@@ -32,208 +121,416 @@ def search_mac_address(mac_ip: dict, where_dict: Dict[str, DeviceInfo]):
             "devices": {}
         }
     }
-    for host, dev in where_dict.items():
-        for port, port_data in dev.ports.items():
-            if mac_ip["mac"] in port_data.macs \
-                    and mac_ip["ip"] != host:
-                results[mac_ip["ip"]]["devices"].update({dev.host: {
-                    "port": port,
-                    "port_name": port_data.name,
-                    "port_macs_counter": len(port_data.macs)
-                }
-                })
+    for host, port, vlan in fdb.lookup(mac_to_int(mac_ip["mac"])):
+        if mac_ip["ip"] == host or host not in where_dict:
+            continue
+        results[mac_ip["ip"]]["devices"].update({host: {
+            "port": port,
+            "port_name": where_dict[host].ports[port].name,
+            "port_macs_counter": fdb.port_count(host, port)
+        }
+        })
     return results
 
 
 def generate_mac_ip_pair(
         query: str,
         where_mac_ip_dict: dict,
-        where_device_dict: Dict[str, DeviceInfo]
+        where_device_dict: Dict[str, DeviceInfo],
+        fdb: FdbStore,
+        ip_index: dict
 ):
     query = query.lower()
     if is_it_ipv4(query):
-        for mac, ip_list in where_mac_ip_dict.items():
-            if query in ip_list:
-                return search_mac_address({
-                    "mac": mac, "ip": ip_list[0]
-                }, where_device_dict)
-    elif is_it_mac_addr(query) and (query in where_mac_ip_dict.keys()):
-        return search_mac_address({
-            "mac": query, "ip": where_mac_ip_dict[query][0] if len(where_mac_ip_dict[query]) else "?"
-        }, where_device_dict)
+        mac = ip_index.get(query)
+        if mac is not None:
+            return search_mac_address({
+                "mac": int_to_mac(mac), "ip": where_mac_ip_dict[mac][0]
+            }, fdb, where_device_dict)
+    elif is_it_mac_addr(query):
+        mac = mac_to_int(query)
+        if mac in where_mac_ip_dict or mac in fdb:
+            return search_mac_address({
+                "mac": int_to_mac(mac), "ip": where_mac_ip_dict[mac][0] if mac in where_mac_ip_dict else "?"
+            }, fdb, where_device_dict)
     else:
         return None
 
 
-def construct_devices_tree(devices: dict):
-    sorted_devices = sorted(
-        devices.values(),
-        key=lambda item: item["device_macs_counter"],
-        reverse=True
-    )
-
-    dev = devices.pop(sorted_devices[0]["host"])
-    tree = {sorted_devices[0]["host"]: dev}
-
-    for port, data in dev["ports"].items():
-        # Ситуация однозначна, на одном порту одно устройство
-        if len(data["links"]) == 1:
-            el = devices.pop(data["links"][0])
-            # и воткнуть линк в элемент узла уровнем выше
-            dev["ports"][port].update(
-                {"uplink": {el["host"]: el}}
-            )
-        if not len(devices):
-            return tree
-    # Первый проход вытащил листья.
-    # Вторым проходом (поскольку нет больше лишних узлов в исходном списке) работаем по длинным веткам.
-    for port, data in dev["ports"].items():
-        if len(data["links"]) > 1:
-            # В ситуации когда на одном порту несколько линков, два важных момента:
-            # 1. Ближе к корню то устройство, общее количество маков на котором больше.
-            # 2. Устройство на котором линки только на одном порту - крайнее (лист дерева),
-            #    соответственно, если есть, например, два линка и они на разных портах -
-            #    то такое устройство - промежуточное. Правда это немного сложнее в реализации.
-            sub_tree = construct_devices_tree(devices)
-            dev["ports"][port].update(
-                {"uplink": sub_tree}
-            )
-        if not len(devices):
-            return tree
-
-    return tree
+def port_by_name(device: DeviceInfo, names: List[str], number: Optional[int] = None) -> Optional[str]:
+    """
+    Порт устройства (ifIndex) по тому, как его назвал LLDP: имя или описание порта совпадает с ifDescr,
+    иначе - номер порта LLDP, если такой ifIndex есть (у многих производителей они совпадают).
+    """
+    for name in names:
+        for if_index, port in device.ports.items():
+            if port.name == name:
+                return if_index
+        if name in device.ports:
+            return name
+    if number is not None and str(number) in device.ports:
+        return str(number)
+    return None
+
+
+def lldp_neighbors(device: DeviceInfo, table: dict) -> List[LldpNeighbor]:
+    local_ports = decode_lldp_local_ports(table_to_walk(table, LLDP_LOC_PORT_OID, [0]))
+    neighbors = []
+    for rec in decode_lldp_remote(
+            table_to_walk(table, LLDP_REM_OID, [1, 2, 3]), table_to_walk(table, LLDP_REM_MAN_ADDR_OID, [4])
+    ):
+        port = port_by_name(device, local_ports.get(rec.local_port, []), rec.local_port)
+        if port is not None:
+            neighbors.append(LldpNeighbor(
+                port=port, chassis_id=rec.chassis_id, port_id=rec.port_id, sys_name=rec.sys_name, mgmt_ip=rec.mgmt_ip
+            ))
+    return neighbors
+
+
+def lldp_links(device_dict: Dict[str, DeviceInfo]) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Соседи по LLDP среди опрошенных устройств: {хост: {порт: [хост соседа, ...]}}.
+    Сосед узнается по адресу управления, иначе по chassis id, совпавшему с MAC интерфейса.
+    Если LLDP есть только с одной стороны, встречный порт берется из lldpRemPortId.
+    """
+    by_address = {}
+    for host, device in device_dict.items():
+        by_address[host] = host
+        for ip, i_face in device.internal_ip.items():
+            by_address.setdefault(ip, host)
+            if i_face.ifPhyAddress:
+                by_address.setdefault(i_face.ifPhyAddress, host)
+
+    links: Dict[str, Dict[str, List[str]]] = {}
+
+    def add(host: str, port: str, peer: str):
+        peers = links.setdefault(host, {}).setdefault(port, [])
+        if peer not in peers:
+            peers.append(peer)
+
+    for host, device in device_dict.items():
+        for neighbor in device.lldp:
+            peer = by_address.get(neighbor.mgmt_ip) or by_address.get(neighbor.chassis_id)
+            if peer is None or peer == host:
+                continue
+            add(host, neighbor.port, peer)
+            peer_port = port_by_name(device_dict[peer], [neighbor.port_id])
+            if peer_port is not None:
+                add(peer, peer_port, host)
+    return links
 
 
 #################################################################
 # Секция инструментов для эндпоинтов
 #################################################################
 class CoreManager:
-    device_dict: Dict[str, DeviceInfo] = {}
-    device_tree = {}
-    mac_ip_dict = {}
+    # последний полностью собранный цикл опроса, только его и читают эндпоинты
+    snapshot: TopologySnapshot = TopologySnapshot.empty()
+    # отпечатки устройств на момент последнего полного обхода и статистика пропусков
+    fingerprints: Dict[str, DeviceFingerprint] = {}
+    poll_stats: Dict[str, Dict[str, int]] = {}
+    scheduler = PollScheduler(
+        max_devices=settings.POLL_MAX_DEVICES,
+        device_concurrency=settings.POLL_DEVICE_CONCURRENCY,
+        device_timeout=settings.POLL_DEVICE_TIMEOUT
+    )
+    # опрос в отдельных процессах (app.core.workers.ProcessPoller), None - в этом event loop через scheduler
+    process_poller = None
+    # узел кластера (app.core.cluster.ClusterNode): опрашивает и сохраняет снимки только лидер, None - один экземпляр
+    cluster_node = None
+
+    @classmethod
+    def publish(cls, snapshot: TopologySnapshot):
+        """
+        Одна замена ссылки - читатели видят либо старый снимок целиком, либо новый целиком.
+        Ответ для /core/get_place сериализуется здесь же, до замены.
+        Подписчикам /core/events уходит разница между прежним и новым снимком.
+        """
+        snapshot.serialize()
+        previous = cls.snapshot
+        events = diff_snapshots(previous, snapshot) if len(event_hub) else []
+        cls.snapshot = snapshot
+        if len(event_hub):
+            event_hub.publish("diff", {"version": snapshot.version, "prev_version": previous.version, "events": events})
+        print("опубликован снимок v{} ({} устройств)".format(snapshot.version, len(snapshot.device_dict)))
+
+    @classmethod
+    def has_previous(cls, host: str) -> bool:
+        return host in cls.snapshot.device_dict
+
+    @classmethod
+    def previous_result(cls, host: str) -> Tuple[DeviceInfo, FdbTable, List[Tuple[int, str]]]:
+        """ То, что устройство дало в последнем опубликованном снимке - если с тех пор на нем ничего не менялось """
+        previous = cls.snapshot
+        return previous.device_dict[host], previous.fdb.tables.get(host, FdbTable()), previous.device_arp.get(host, [])
 
     @classmethod
-    async def update_device_info(cls, dev: NewDevice):
+    async def update_device_info(
+            cls, dev: NewDevice, slots: Optional[asyncio.Semaphore] = None
+    ) -> Optional[Tuple[DeviceInfo, FdbTable, List[Tuple[int, str]]]]:
+        """
+        Опрашивает одно устройство. Общих структур не трогает, а возвращает результат:
+        (DeviceInfo, FDB устройства, пары (mac, ip) из ARP и внутренних интерфейсов) или None,
+        если опрос не удался.
+        """
         # pprint("start Update_device_info. dev: {}".format(dev))
 
         # Содержит в себе информацию, вынутую через SNMP из устройства
         device = DeviceInfo(host=dev.host)
 
-        # разворачиваем в строку именование, комментарии, производителя.
-        info: ResultQueryOID = await query_info(QueryOID(
-            host=dev.host, port=dev.port, community=dev.community, snmp_ver=dev.snmp_ver,
-            oid_start=dev.info_oid_start, oid_stop=dev.info_oid_stop
-        ))
-        device.info = "<br>".join(
-            [el for elem in info.results_list for el in elem.values() if not el == ""]
-        )
+        # Обходы устройства независимы друг от друга, запускаем их вместе.
+        # Сколько из них реально идут одновременно - решают слоты от планировщика.
+        slots = slots or asyncio.Semaphore(1)
 
-        # а какие порты есть на устройстве?
-        ports: ResultQueryOID = await query_ports(QueryOID(
-            host=dev.host, port=dev.port, community=dev.community, snmp_ver=dev.snmp_ver,
-            oid_start=dev.ports_oid_start, oid_stop=dev.ports_oid_stop
-        ))
-        for elem in ports.results_list:
-            device.ports.update({
-                elem["logical_interface_id"]: PortInfo(name=elem["port_name"])
-            })
-        # print(device.ports)
+        async def in_slot(walk):
+            async with slots:
+                return await walk
 
-        # внутренние IP адреса
-        internal_ips = await query_info_ip(QueryOID(
-            host=dev.host, port=dev.port, community=dev.community, snmp_ver=dev.snmp_ver,
-            oid_start=dev.internal_ip_oid_start, oid_stop=dev.internal_ip_oid_stop
-        ))
-        [device.internal_ip.update({el["ipAdEntAddr"]: InternalIP(**el)}) for el in internal_ips.results_list]
+        def query(oid_start: str, oid_stop: str) -> QueryOID:
+            return QueryOID(
+                host=dev.host, port=dev.port, community=dev.community, snmp_ver=dev.snmp_ver,
+                oid_start=oid_start, oid_stop=oid_stop
+            )
 
-        # С MAC-ами-VLAN-ами немного сложнее
-        mac_vlan: ResultQueryOID = await query_mac_vlan_port(QueryOID(
-            host=dev.host, port=dev.port, community=dev.community, snmp_ver=dev.snmp_ver,
-            oid_start=dev.macs_oid_start, oid_stop=dev.macs_oid_stop
-        ))
-        device.device_macs_counter = mac_vlan.count
-
-        for elem in mac_vlan.results_list:
-            if elem["logical_interface_id"] in device.ports:
-                device.ports[elem["logical_interface_id"]].macs.update(
-                    {elem["mac"]: elem["vlan"]}
-                )
-
-            if elem["mac"] not in cls.mac_ip_dict:
-                cls.mac_ip_dict.update({
-                    elem["mac"]: []  # Здесь будет IP-addr, если будет
-                })
-
-        # arp-table, если есть
-        arp: ResultQueryOID = await query_arp_table(QueryOID(
-            host=dev.host, port=dev.port, community=dev.community, snmp_ver=dev.snmp_ver,
-            oid_start=dev.arp_oid_start, oid_stop=dev.arp_oid_stop
-        ))
-        for elem in arp.results_list:
-            cls.mac_ip_dict.setdefault(elem["mac"], [])
-            # если уже добавляли такой IP, то незачем делать дубли
-            if elem["ip_addr"] not in cls.mac_ip_dict[elem["mac"]]:
-                cls.mac_ip_dict[elem["mac"]].append(elem["ip_addr"])
-
-        # mac адреса по портам
-        internal_macs: ResultQueryOID = await query_info_mac(QueryOID(
-            host=dev.host, port=dev.port, community=dev.community, snmp_ver=dev.snmp_ver,
-            oid_start=".1.3.6.1.2.1.2.2.1.6", oid_stop="1.3.6.1.2.1.2.2.1.7"
-        ))
-        ports = internal_macs.results_list[0]["ports"]
-        for i_face in device.internal_ip.values():
-            i_face.ifPhyAddress = ports[i_face.ipAdEntIfIndex]
-            cls.mac_ip_dict.setdefault(i_face.ifPhyAddress, [])
-            if i_face.ipAdEntAddr not in cls.mac_ip_dict[i_face.ifPhyAddress]:
-                cls.mac_ip_dict[i_face.ifPhyAddress].append(i_face.ipAdEntAddr)
-
-        # Добавим устройство
-        cls.device_dict.update({device.host: device})
+        # Если на устройстве ничего не поменялось с прошлого полного обхода - оставляем прежний DeviceInfo
+        stats = cls.poll_stats.setdefault(dev.host, {"skipped": 0, "rewalked": 0, "skipped_in_row": 0})
+        fingerprint = None
+        if settings.POLL_CHANGE_DETECTION:
+            fingerprint = await in_slot(timed_walk("fingerprint", take_fingerprint(dev)))
+            if cls.has_previous(dev.host) \
+                    and fingerprint is not None \
+                    and fingerprint.same_state_as(cls.fingerprints.get(dev.host)) \
+                    and stats["skipped_in_row"] < settings.POLL_FULL_WALK_EVERY:
+                stats["skipped"] += 1
+                stats["skipped_in_row"] += 1
+                print("устройство {} не изменилось, обход пропущен.".format(dev.host))
+                POLL_DEVICES.labels(result="skipped").inc()
+                return cls.previous_result(dev.host)
+
+        # Порты, MAC-и интерфейсов и внутренние IP - одним проходом сразу по нескольким колонкам.
+        # Колонка 0 - имена портов, 1 - ifPhysAddress, дальше - колонки ipAddrTable.
+        ip_columns = ip_addr_columns(dev.internal_ip_oid_start, dev.internal_ip_oid_stop)
+
+        walks = [
+            in_slot(timed_walk("info", get_oid_from_to(query(dev.info_oid_start, dev.info_oid_stop)))),
+            in_slot(timed_walk("ports", get_table(
+                query(dev.ports_oid_start, dev.ports_oid_stop),
+                [(dev.ports_oid_start, dev.ports_oid_stop), IF_PHYS_ADDRESS_OID] + ip_columns
+            ))),
+            in_slot(timed_walk("macs", get_oid_from_to(query(dev.macs_oid_start, dev.macs_oid_stop)))),
+            in_slot(timed_walk("arp", get_oid_from_to(query(dev.arp_oid_start, dev.arp_oid_stop)))),
+        ]
+        if settings.POLL_LLDP:
+            walks.append(in_slot(timed_walk(
+                "lldp", get_table(query(LLDP_COLUMNS[0][0], LLDP_COLUMNS[-1][1]), LLDP_COLUMNS)
+            )))
+        info, table, mac_vlan, arp, *lldp = await asyncio.gather(*walks)
+        for walk in (info, table, mac_vlan, arp):
+            if walk["error"] is not None:
+                print("опрос устройства {} не удался: {}".format(dev.host, walk["error"]))
+                POLL_DEVICES.labels(result="failed").inc()
+                return None
+
+        try:
+            # разворачиваем в строку именование, комментарии, производителя.
+            device.info = "<br>".join([text for _, text in decode_system_info(info) if not text == ""])
+
+            # а какие порты есть на устройстве?
+            for rec in decode_ports(table_to_walk(table, dev.ports_oid_start, [0])):
+                device.ports[rec.port] = PortInfo(name=rec.name)
+
+            # внутренние IP адреса
+            for el in decode_ip_addr(table_to_walk(table, dev.internal_ip_oid_start, range(2, 2 + len(ip_columns)))):
+                device.internal_ip[el["ipAdEntAddr"]] = InternalIP(**el)
+
+            # С MAC-ами-VLAN-ами немного сложнее: они идут не в PortInfo.macs, а в компактную FdbTable
+            fdb_records = decode_mac_vlan_port(mac_vlan)
+            device.device_macs_counter = len(fdb_records)
+
+            fdb = FdbTable()
+            for rec in fdb_records:
+                if rec.port in device.ports:
+                    fdb.add(rec.port, rec.mac, rec.vlan)
+
+            # arp-table, если есть
+            mac_ip_pairs = [(rec.mac, rec.ip) for rec in decode_arp(arp) if rec.mac is not None]
+
+            # mac адреса по портам
+            phys_address = decode_phys_address(table_to_walk(table, IF_PHYS_ADDRESS_OID[0], [1]))
+            for i_face in device.internal_ip.values():
+                mac = phys_address.get(i_face.ipAdEntIfIndex)
+                if mac is not None:
+                    i_face.ifPhyAddress = int_to_mac(mac)
+                    mac_ip_pairs.append((mac, i_face.ipAdEntAddr))
+
+            # соседи по LLDP; нет LLDP или ошибка - не беда, устройство найдется по FDB
+            if lldp and lldp[0]["error"] is None:
+                try:
+                    device.lldp = lldp_neighbors(device, lldp[0])
+                except ValueError as ex:
+                    print("LLDP устройства {} не разобран: {}".format(dev.host, ex))
+        except (ValueError, KeyError) as ex:
+            print("ответ устройства {} не разобран: {}".format(dev.host, ex))
+            POLL_DEVICES.labels(result="failed").inc()
+            return None
+
+        if fingerprint is not None:
+            cls.fingerprints[device.host] = fingerprint
+        stats["rewalked"] += 1
+        stats["skipped_in_row"] = 0
+        POLL_DEVICES.labels(result="walked").inc()
         print("опрос устройства окончен успешно.")
-        return
+        return device, fdb, mac_ip_pairs
 
     @classmethod
     async def update_device_tree(cls):
-        loop = asyncio.get_running_loop()
-        tasks = []
-
-        # вынимаю из коллекции все устройства, по очереди опрашиваю, формирую список устройств и коллекцию маков
-        cursor = motorchik.find("devices", None)
-
-        for device in await cursor.to_list(length=None):
-            tasks.append(
-                loop.create_task(
-                    cls.update_device_info(NewDevice(**device))
-                )
-            )
+        # вынимаю из коллекции все устройства, опрашиваю через планировщик, формирую список устройств и коллекцию маков
+        cursor = motorchik.find("devices", {}, projection={"_id": False})
+        devices = [NewDevice(**device) for device in await cursor.to_list(length=None)]
+
+        if cls.process_poller is not None:
+            results = await cls.process_poller.run(devices)
+            scheduler = cls.process_poller
+        else:
+            results = await cls.scheduler.run(devices, cls.update_device_info)
+            scheduler = cls.scheduler
+        print("опрос {} устройств занял {:.1f} сек., таймаутов: {}, ошибок: {}".format(
+            len(devices), scheduler.cycle_time, scheduler.timeouts, scheduler.errors
+        ))
+        record_cycle(scheduler)
+        build_started = time.monotonic()
+
+        # Новый снимок собираем в стороне, текущий в это время продолжает отдаваться как есть
+        device_dict: Dict[str, DeviceInfo] = {}
+        fdb_tables: Dict[str, FdbTable] = {}
+        device_arp: Dict[str, List[Tuple[int, str]]] = {}
+        unreachable = []
+        for dev, result in zip(devices, results):
+            if result is None:
+                unreachable.append(dev.host)
+                continue
+            device_dict[dev.host], fdb_tables[dev.host], device_arp[dev.host] = result
+
+        mac_ip_dict = build_mac_ip_dict(device_arp)
+        fdb, ip_index = build_indexes(fdb_tables, mac_ip_dict)
+        print("FDB: {entries} записей, {bytes} байт, {bytes_per_entry} байт на запись".format(**fdb.memory_usage()))
+
+        # Выясним встречные линки устройств: сначала точные по LLDP
+        links_dict = {}
 
-        results = await asyncio.gather(*tasks)
+        def link_node(host: str) -> dict:
+            return links_dict.setdefault(host, {
+                "host": device_dict[host].host,
+                "device_macs_counter": device_dict[host].device_macs_counter,
+                "ports": {}
+            })
 
-        # Выясним встречные линки устройств
-        links_dict = {}
+        def port_entry(ports: dict, host: str, port: str) -> dict:
+            return ports.setdefault(port, {
+                "port_name": device_dict[host].ports[port].name if port in device_dict[host].ports else port,
+                "port_macs_counter": fdb.port_count(host, port),
+                "links": []
+            })
 
-        print("\nНа каких портах видны устройства")
-        for dev_ip, dev_data in cls.device_dict.items():
+        lldp = lldp_links(device_dict)
+        for host, ports in lldp.items():
+            for port, peers in ports.items():
+                port_entry(link_node(host).setdefault("lldp", {}), host, port)["links"].extend(peers)
+                for peer in peers:
+                    link_node(peer)
+
+        # Остальные - по FDB: где чей MAC интерфейса виден. Корень ищется всегда, по нему понятно, где аплинки.
+        by_fdb = [host for host in device_dict if host not in links_dict]
+        if by_fdb and links_dict:
+            by_fdb.append(max(device_dict.values(), key=lambda device: device.device_macs_counter).host)
+        print("\nLLDP: {} устройств, по FDB ищем {}".format(len(links_dict), len(by_fdb)))
+
+        for dev_ip in by_fdb:
+            dev_data = device_dict[dev_ip]
+            if dev_ip not in dev_data.internal_ip or not dev_data.internal_ip[dev_ip].ifPhyAddress:
+                # устройство опрашивается не по своему внутреннему адресу - не узнаем его в чужих FDB
+                continue
             res = search_mac_address(
                 {"mac": dev_data.internal_ip[dev_ip].ifPhyAddress, "ip": dev_data.internal_ip[dev_ip].ipAdEntAddr},
-                cls.device_dict
+                fdb, device_dict
             )
 
             for ip, data in res[dev_ip]["devices"].items():
-                links_dict.setdefault(ip, {
-                    "host": cls.device_dict[ip].host,
-                    "device_macs_counter": cls.device_dict[ip].device_macs_counter,
-                    "ports": {}
-                })
-                links_dict[ip]["ports"].setdefault(data["port"], {
-                    "port_name": data["port_name"], "port_macs_counter": data["port_macs_counter"], "links": []
-                })
-                links_dict[ip]["ports"][data["port"]]["links"].append(dev_ip)
-
-        cls.device_tree = construct_devices_tree(links_dict)
+                port_entry(link_node(ip)["ports"], ip, data["port"])["links"].append(dev_ip)
 
+        device_tree = topology_engine.build(links_dict)
+        print("дерево: {}, {:.3f} сек.".format(
+            "пересчитано" if topology_engine.last_computed else "без изменений", topology_engine.last_time
+        ))
+
+        snapshot = TopologySnapshot(
+            version=cls.snapshot.version + 1,
+            device_dict=device_dict,
+            device_arp=device_arp,
+            mac_ip_dict=mac_ip_dict,
+            device_tree=device_tree,
+            fdb=fdb,
+            ip_index=ip_index,
+            unreachable=unreachable,
+        )
+        cls.publish(snapshot)
+        POLL_CYCLE_SECONDS.labels(phase="build").observe(time.monotonic() - build_started)
+
+        if cls.cluster_node is not None and not cls.cluster_node.is_leader:
+            # аренду потеряли посреди цикла - снимок уже пишет новый лидер
+            print("снимок v{} не сохранен: узел больше не лидер".format(snapshot.version))
+            return
+        # сохраняем для быстрого старта после перезапуска, опрос от этого не зависит
+        if snapshot_store is not None:
+            try:
+                await snapshot_store.save(snapshot)
+            except Exception as e:
+                print("снимок v{} не сохранен: {}".format(snapshot.version, e))
+        if mac_history is not None:
+            try:
+                print("история MAC: {} записей".format(await mac_history.record(snapshot)))
+            except Exception as e:
+                print("история MAC за снимок v{} не записана: {}".format(snapshot.version, e))
         print("update_device_tree finished")
 
+    @classmethod
+    async def warm_start(cls):
+        """
+        До первого опроса публикует последний сохраненный снимок: эндпоинты сразу отдают
+        устаревшие, но полезные данные, а не пустоту. Свежий опрос потом заменит его как обычно.
+        """
+        if snapshot_store is None or cls.snapshot.version:
+            return
+        try:
+            snapshot = await snapshot_store.load()
+        except Exception as e:
+            print("сохраненный снимок не загружен: {}".format(e))
+            return
+        if snapshot is None:
+            print("сохраненного снимка нет, ждем первого опроса")
+            return
+        cls.publish(snapshot)
+        print("поднят сохраненный снимок v{} от {}".format(snapshot.version, snapshot.timestamp.isoformat()))
+
+
+@gauge_callback(
+    "netviewer_snapshot", "Опубликованный снимок: версия, устройства, FDB, размер ответа /core/get_place, возраст",
+    "stat"
+)
+def collect_snapshot():
+    snapshot = CoreManager.snapshot
+    usage = snapshot.fdb.memory_usage()
+    return {
+        "version": snapshot.version,
+        "devices": len(snapshot.device_dict),
+        "unreachable": len(snapshot.unreachable),
+        "fdb_entries": usage["entries"],
+        "fdb_bytes": usage["bytes"],
+        "payload_bytes": len(snapshot.payload or b""),
+        "payload_gzip_bytes": len(snapshot.payload_gzip or b""),
+        "age_seconds": round((datetime.now(timezone.utc) - snapshot.timestamp).total_seconds(), 1),
+    }
+
 
 #################################################################
 # Секция запуска ядра
@@ -259,7 +556,10 @@ class Core:
 
 
 async def run_core():
-    Core.update()
+    # в кластере первый опрос запускает избранный лидер
+    if CoreManager.cluster_node is None:
+        Core.update()
+    await CoreManager.warm_start()
     sleep_time = 2
     while True:
         # print("Core tik")
@@ -269,7 +569,7 @@ async def run_core():
             # не забыть погасить свет
             print("run_core ends")
             break
-        elif Core.state == 2:
+        elif Core.state == 2 and (CoreManager.cluster_node is None or CoreManager.cluster_node.is_leader):
             print("start_update_device_tree")
             try:
                 await CoreManager.update_device_tree()
@@ -0,0 +1,274 @@
+"""
+Поиск устройств перебором адресов: на каждый адрес из заданных сетей - один SNMP GET
+sysObjectID.0 и sysDescr.0 с коротким таймаутом и без повторов (DISCOVERY_TIMEOUT, DISCOVERY_RETRIES).
+Одновременно в полете не больше DISCOVERY_WINDOW запросов: столько сопрограмм разбирают адреса
+из одного итератора, так что и /16 не разворачивается в 65 тысяч задач.
+
+Запросы идут не через hlapi (getCmd), а через низкоуровневый API сообщений pysnmp на своем UDP-сокете:
+hlapi заносит каждую новую цель в конфигурацию SnmpEngine (~9 мс CPU на адрес) и не забывает ее,
+а здесь сообщение GET кодируется один раз на перебор и одно и то же уходит на все адреса.
+Ответ узнается по адресу отправителя и request-id перебора; разбирается только то, что пришло.
+Молчащий адрес занимает место в окне на DISCOVERY_TIMEOUT, поэтому /22 (1022 адреса) при окне 256
+и таймауте 1 сек. перебирается примерно за 4 сек., даже если не ответил никто.
+
+Ответившие одним insert_many заносятся в devices со стандартными OID-ами опроса (как в примере
+/core/add_device); уже известные хосты пропускаются, дубли при гонках отсекает уникальный индекс devices.host.
+Пока индекс не подтвержден (MongoMotorEngine.unique_confirmed), регистрация идет по одному хосту
+с повторной проверкой перед каждой вставкой.
+"""
+import asyncio
+import ipaddress
+import random
+import time
+from typing import Dict, Iterator, List, Optional
+
+from pyasn1.codec.ber import decoder, encoder
+from pymongo.errors import BulkWriteError
+from pysnmp.proto import api
+
+from app.core.core import Core
+from app.core.models import DiscoveryRequest, NewDevice
+from app.database import motorchik
+from app.settings import settings
+
+SYS_DESCR = "1.3.6.1.2.1.1.1.0"
+SYS_OBJECT_ID = "1.3.6.1.2.1.1.2.0"
+
+# OID-ы опроса для найденных устройств - стандартные MIB-II и BRIDGE-MIB
+STANDARD_OIDS = {
+    "info_oid_start": ".1.3.6.1.2.1.1.1",
+    "info_oid_stop": ".1.3.6.1.2.1.1.7",
+    "ports_oid_start": ".1.3.6.1.2.1.2.2.1.2",
+    "ports_oid_stop": ".1.3.6.1.2.1.2.2.1.3",
+    "internal_ip_oid_start": ".1.3.6.1.2.1.4.20.1",
+    "internal_ip_oid_stop": ".1.3.6.1.2.1.4.20.2",
+    "macs_oid_start": ".1.3.6.1.2.1.17.7.1.2.2.1.2",
+    "macs_oid_stop": ".1.3.6.1.2.1.17.7.1.2.2.1.3",
+    "arp_oid_start": ".1.3.6.1.2.1.4.22.1.2",
+    "arp_oid_stop": ".1.3.6.1.2.1.4.22.1.3",
+}
+
+
+def sweep_networks(networks: List[str]) -> List[ipaddress.IPv4Network]:
+    """ Разбор CIDR; ValueError на кривую сеть или если адресов больше DISCOVERY_MAX_ADDRESSES """
+    parsed = [ipaddress.IPv4Network(network.strip(), strict=False) for network in networks]
+    parsed = list(ipaddress.collapse_addresses(parsed))
+    total = sum(network.num_addresses for network in parsed)
+    if total > settings.DISCOVERY_MAX_ADDRESSES:
+        raise ValueError("{} адресов - больше DISCOVERY_MAX_ADDRESSES ({})".format(total, settings.DISCOVERY_MAX_ADDRESSES))
+    return parsed
+
+
+def sweep_addresses(networks: List[ipaddress.IPv4Network]) -> Iterator[str]:
+    for network in networks:
+        # hosts() без адреса сети и широковещательного, у /31 и /32 - все адреса
+        for address in network.hosts():
+            yield str(address)
+
+
+def get_message(community: str, snmp_ver: int, request_id: int) -> bytes:
+    """ Закодированный GET sysObjectID.0 и sysDescr.0 """
+    proto = api.protoModules[snmp_ver]
+    pdu = proto.GetRequestPDU()
+    proto.apiPDU.setDefaults(pdu)
+    proto.apiPDU.setRequestID(pdu, request_id)
+    proto.apiPDU.setVarBinds(pdu, [(SYS_OBJECT_ID, proto.Null("")), (SYS_DESCR, proto.Null(""))])
+    message = proto.Message()
+    proto.apiMessage.setDefaults(message)
+    proto.apiMessage.setCommunity(message, community)
+    proto.apiMessage.setPDU(message, pdu)
+    return encoder.encode(message)
+
+
+def parse_response(data: bytes, request_id: int) -> Optional[dict]:
+    """ {sys_object_id, sys_descr} из ответа на get_message(), None - чужой или битый пакет """
+    try:
+        proto = api.protoModules[int(api.decodeMessageVersion(data))]
+        message, _ = decoder.decode(data, asn1Spec=proto.Message())
+        pdu = proto.apiMessage.getPDU(message)
+        if int(proto.apiPDU.getRequestID(pdu)) != request_id:
+            return None
+        # ответ с ошибкой (SNMP v1 без sysObjectID) - все равно SNMP-агент с этим community
+        values = {} if proto.apiPDU.getErrorStatus(pdu) else {
+            str(oid): value.prettyPrint() for oid, value in proto.apiPDU.getVarBinds(pdu)
+        }
+    except Exception:
+        return None
+    return {"sys_object_id": values.get(SYS_OBJECT_ID, ""), "sys_descr": values.get(SYS_DESCR, "")}
+
+
+class SweepProtocol(asyncio.DatagramProtocol):
+    """ Ответы раздаются ожидающим по адресу отправителя """
+
+    def __init__(self, request_id: int):
+        self.request_id = request_id
+        self.waiting: Dict[str, asyncio.Future] = {}
+
+    def datagram_received(self, data, addr):
+        future = self.waiting.get(addr[0])
+        if future is None or future.done():
+            return
+        found = parse_response(data, self.request_id)
+        if found is not None:
+            future.set_result(found)
+
+    def error_received(self, exc):
+        # ICMP unreachable и т.п. - адрес просто останется без ответа до таймаута
+        pass
+
+
+class DiscoverySweep:
+
+    def __init__(self, request: DiscoveryRequest, window: int, timeout: float, retries: int):
+        self.request = request
+        self.networks = sweep_networks(request.networks)
+        self.window = max(1, window)
+        self.timeout = timeout
+        self.retries = retries
+        self.total = sum(network.num_addresses - 2 if network.prefixlen < 31 else network.num_addresses
+                         for network in self.networks)
+        self.probed = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.found: List[dict] = []
+        self.registered = 0
+        self.started = 0.0
+        self.finished = 0.0
+        self.error: Optional[str] = None
+
+    async def probe(self, transport, protocol: SweepProtocol, message: bytes, host: str) -> Optional[dict]:
+        """ {host, sys_object_id, sys_descr}, если адрес ответил на SNMP с этим community, иначе None """
+        future = asyncio.get_running_loop().create_future()
+        protocol.waiting[host] = future
+        try:
+            for _ in range(self.retries + 1):
+                transport.sendto(message, (host, self.request.port))
+                try:
+                    return dict(host=host, **await asyncio.wait_for(asyncio.shield(future), self.timeout))
+                except asyncio.TimeoutError:
+                    continue
+            return None
+        finally:
+            del protocol.waiting[host]
+
+    async def _worker(self, transport, protocol: SweepProtocol, message: bytes, addresses: Iterator[str]):
+        for host in addresses:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                found = await self.probe(transport, protocol, message, host)
+            except OSError as e:
+                print("discovery {}: {}".format(host, e))
+                found = None
+            finally:
+                self.in_flight -= 1
+            self.probed += 1
+            if found is not None:
+                self.found.append(found)
+
+    async def run(self) -> List[dict]:
+        self.started = time.monotonic()
+        request_id = random.randint(1, 2 ** 31 - 1)
+        message = get_message(self.request.community, self.request.snmp_ver, request_id)
+        transport, protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: SweepProtocol(request_id), local_addr=("0.0.0.0", 0)
+        )
+        try:
+            addresses = sweep_addresses(self.networks)
+            await asyncio.gather(*[
+                self._worker(transport, protocol, message, addresses) for _ in range(min(self.window, self.total))
+            ])
+        finally:
+            transport.close()
+        self.found.sort(key=lambda el: ipaddress.IPv4Address(el["host"]))
+        self.finished = time.monotonic()
+        print("discovery: {} адресов за {:.1f} сек., ответили {}".format(
+            self.probed, self.finished - self.started, len(self.found)
+        ))
+        return self.found
+
+    async def register(self) -> int:
+        """ Заносит найденных в devices одним insert_many, возвращает сколько добавлено """
+        hosts = [el["host"] for el in self.found]
+        if not hosts:
+            return 0
+        cursor = motorchik.find("devices", {"host": {"$in": hosts}}, projection={"_id": False, "host": True})
+        known = {document["host"] for document in await cursor.to_list(length=None)}
+        devices = [
+            NewDevice(host=host, port=self.request.port, community=self.request.community,
+                      snmp_ver=self.request.snmp_ver, **STANDARD_OIDS)
+            for host in hosts if host not in known
+        ]
+        if not devices:
+            return 0
+        if not motorchik.unique_confirmed("devices"):
+            # индекс не отсечет дубль - сужаем окно гонки: проверка и вставка по одному хосту
+            for device in devices:
+                if await motorchik.find_one("devices", {"host": device.host}, projection={"_id": True}) is None:
+                    await motorchik.insert_one("devices", device)
+                    self.registered += 1
+            if self.registered:
+                Core.update()
+            return self.registered
+        try:
+            result = await motorchik.insert_many("devices", devices)
+            self.registered = len(result.inserted_ids) if result is not None else 0
+        except BulkWriteError as e:
+            # кто-то добавил часть хостов между find и insert - уникальный индекс их отсек
+            self.registered = e.details.get("nInserted", 0)
+        if self.registered:
+            Core.update()
+        return self.registered
+
+    def status(self) -> dict:
+        elapsed = (self.finished or time.monotonic()) - self.started if self.started else 0
+        return {
+            "networks": [str(network) for network in self.networks],
+            "running": bool(self.started) and not self.finished,
+            "total": self.total,
+            "probed": self.probed,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "found": self.found,
+            "registered": self.registered,
+            "elapsed": round(elapsed, 2),
+            "error": self.error,
+        }
+
+
+class Discovery:
+    """ Один перебор за раз; последний результат остается в status(), пока не запущен следующий """
+
+    def __init__(self):
+        self.current: Optional[DiscoverySweep] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, request: DiscoveryRequest) -> DiscoverySweep:
+        """ ValueError - кривые сети, RuntimeError - перебор уже идет """
+        if self.is_running():
+            raise RuntimeError("discovery is already running")
+        sweep = DiscoverySweep(request, settings.DISCOVERY_WINDOW, settings.DISCOVERY_TIMEOUT, settings.DISCOVERY_RETRIES)
+        self.current = sweep
+        self._task = asyncio.get_running_loop().create_task(self._run(sweep))
+        return sweep
+
+    @staticmethod
+    async def _run(sweep: DiscoverySweep):
+        try:
+            await sweep.run()
+            if sweep.request.add_devices:
+                await sweep.register()
+        except Exception as e:
+            print("discovery: {}".format(e))
+            sweep.error = str(e)
+            sweep.finished = sweep.finished or time.monotonic()
+
+    async def wait(self):
+        if self._task is not None:
+            await asyncio.gather(self._task)
+
+
+discovery = Discovery()
@@ -0,0 +1,107 @@
+"""
+Push изменений топологии в браузер (Server-Sent Events).
+При публикации нового снимка CoreManager считает разницу с предыдущим (diff_snapshots)
+и рассылает ее всем подписчикам /core/events. Дашборд патчит DOM по этим событиям,
+а не перекачивает /core/get_place целиком.
+"""
+import asyncio
+import json
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.core.fdb_store import FdbTable, int_to_mac
+from app.core.snapshot import TopologySnapshot
+
+
+def _mac_ports(table: Optional[FdbTable]) -> Dict[Tuple[int, int], str]:
+    """ {(mac, vlan): port} - как в FdbStore: один MAC в разных VLAN - разные записи """
+    return {(mac, vlan): port for port, mac, vlan in table} if table is not None else {}
+
+
+def diff_snapshots(old: TopologySnapshot, new: TopologySnapshot) -> List[dict]:
+    """
+    События между двумя снимками:
+    - device_added {host, device} / device_unreachable {host};
+    - mac_added {host, port, mac, vlan, ips} / mac_removed {host, port, mac, vlan} /
+      mac_moved {host, mac, vlan, from_port, to_port} - в пределах одного устройства и VLAN;
+    - tree {tree} - если поменялось дерево устройств.
+    Устройства, которые не перечитывались (тот же DeviceInfo и та же FdbTable), пропускаются без сравнения.
+    """
+    events = []
+    for host in old.device_dict:
+        if host not in new.device_dict:
+            events.append({"type": "device_unreachable", "host": host})
+
+    for host, dev in new.device_dict.items():
+        old_dev = old.device_dict.get(host)
+        if old_dev is None:
+            events.append({"type": "device_added", "host": host, "device": new.device_json(host)})
+            continue
+        old_table, new_table = old.fdb.tables.get(host), new.fdb.tables.get(host)
+        if old_dev is dev and old_table is new_table:
+            continue
+
+        old_macs, new_macs = (_mac_ports(old_table), _mac_ports(new_table))
+        for (mac, vlan), port in new_macs.items():
+            old_port = old_macs.get((mac, vlan))
+            if old_port is None:
+                events.append({
+                    "type": "mac_added", "host": host, "port": port, "mac": int_to_mac(mac), "vlan": str(vlan),
+                    "ips": new.mac_ip_dict.get(mac, [])
+                })
+            elif old_port != port:
+                events.append({
+                    "type": "mac_moved", "host": host, "mac": int_to_mac(mac), "vlan": str(vlan),
+                    "from_port": old_port, "to_port": port
+                })
+        for (mac, vlan), port in old_macs.items():
+            if (mac, vlan) not in new_macs:
+                events.append({
+                    "type": "mac_removed", "host": host, "port": port, "mac": int_to_mac(mac), "vlan": str(vlan)
+                })
+
+    if old.device_tree != new.device_tree:
+        events.append({"type": "tree", "tree": new.device_tree})
+
+    return events
+
+
+class EventHub:
+    """
+    Раздача сообщений подписчикам. У каждого подписчика своя очередь на queue_size сообщений;
+    если клиент не успевает их забирать, очередь сбрасывается и ему уходит resync -
+    пусть перечитает /core/get_place целиком.
+    """
+
+    def __init__(self, queue_size: int = 16):
+        self._queue_size = queue_size
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self._queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, event: str, data: dict):
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait((event, data))
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(("resync", {"version": data.get("version")}))
+
+    def __len__(self):
+        return len(self._subscribers)
+
+
+def sse_message(event: str, data: dict, event_id: Optional[int] = None) -> bytes:
+    message = "event: {}\n".format(event)
+    if event_id is not None:
+        message += "id: {}\n".format(event_id)
+    return (message + "data: {}\n\n".format(json.dumps(data, ensure_ascii=False))).encode("utf-8")
+
+
+event_hub = EventHub()
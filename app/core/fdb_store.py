@@ -0,0 +1,162 @@
+"""
+Компактное хранилище FDB (какие MAC на каких портах в каких VLAN).
+MAC хранится 48-битным целым, VLAN (dot1qFdbId - Unsigned32) и порт - малыми целыми, все по колонкам в array.array,
+а не строковыми ключами в PortInfo.macs. Имена портов (logical_interface_id) интернируются
+и хранятся по одному разу на устройство.
+В привычный JSON-вид ({port: {mac: vlan}}, "00:0a:...") данные переводятся только на границе API:
+в TopologySnapshot.serialize(), в поиске, выгрузке и событиях для дашборда.
+"""
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.snmp.decode import int_to_mac
+
+
+def mac_to_int(mac: str) -> int:
+    """ "00:0a:00:00:00:01" (или через '-') -> 0x000a00000001 """
+    return int(mac.replace(":", "").replace("-", ""), 16)
+
+
+def _array_bytes(column: array) -> int:
+    return column.itemsize * len(column)
+
+
+class FdbTable:
+    """
+    FDB одного устройства, строка i - (ports[i], macs[i], vlans[i]).
+    Заполняется при опросе устройства, после публикации снимка не меняется.
+    """
+    __slots__ = ("macs", "vlans", "ports", "port_names", "_port_ids", "_port_counts")
+
+    def __init__(self):
+        self.macs = array("Q")
+        self.vlans = array("I")
+        self.ports = array("H")
+        # номер порта в колонке ports -> logical_interface_id
+        self.port_names: List[str] = []
+        self._port_ids: Dict[str, int] = {}
+        self._port_counts: Optional[Dict[str, int]] = None
+
+    def add(self, port: str, mac: int, vlan: int):
+        port_id = self._port_ids.get(port)
+        if port_id is None:
+            port_id = self._port_ids[port] = len(self.port_names)
+            self.port_names.append(sys.intern(port))
+        self.macs.append(mac)
+        self.vlans.append(vlan)
+        self.ports.append(port_id)
+        self._port_counts = None
+
+    @classmethod
+    def from_dict(cls, ports: Dict[str, Dict[str, str]]) -> "FdbTable":
+        """ Обратное к to_dict(): {port: {mac: vlan}} """
+        table = cls()
+        for port, macs in ports.items():
+            for mac, vlan in macs.items():
+                table.add(port, mac_to_int(mac), int(vlan))
+        return table
+
+    @classmethod
+    def from_columns(cls, port_names: List[str], macs: array, vlans: array, ports: array) -> "FdbTable":
+        """ Таблица из готовых колонок (см. app.core.snapshot_store) """
+        table = cls()
+        table.macs, table.vlans, table.ports = (macs, vlans, ports)
+        table.port_names = [sys.intern(port) for port in port_names]
+        table._port_ids = {port: i for i, port in enumerate(table.port_names)}
+        return table
+
+    def __len__(self):
+        return len(self.macs)
+
+    def __iter__(self) -> Iterator[Tuple[str, int, int]]:
+        """ (port, mac, vlan) """
+        port_names = self.port_names
+        for port_id, mac, vlan in zip(self.ports, self.macs, self.vlans):
+            yield port_names[port_id], mac, vlan
+
+    def row(self, i: int) -> Tuple[str, int, int]:
+        return self.port_names[self.ports[i]], self.macs[i], self.vlans[i]
+
+    def port_counts(self) -> Dict[str, int]:
+        """ {port: сколько MAC на порту}, считается один раз """
+        if self._port_counts is None:
+            counts = [0] * len(self.port_names)
+            for port_id in self.ports:
+                counts[port_id] += 1
+            self._port_counts = dict(zip(self.port_names, counts))
+        return self._port_counts
+
+    def to_dict(self) -> Dict[str, Dict[str, str]]:
+        """ JSON-вид PortInfo.macs по всем портам: {port: {mac: vlan}} """
+        ports = {port: {} for port in self.port_names}
+        for port, mac, vlan in self:
+            ports[port][int_to_mac(mac)] = str(vlan)
+        return ports
+
+    def nbytes(self) -> int:
+        return _array_bytes(self.macs) + _array_bytes(self.vlans) + _array_bytes(self.ports) \
+            + sys.getsizeof(self.port_names) + sum(sys.getsizeof(el) for el in self.port_names)
+
+
+class FdbStore:
+    """
+    FDB всей сети: таблицы устройств плюс индекс по MAC - отсортированная колонка MAC-ов
+    и рядом номер устройства и номер строки в его таблице. Поиск MAC - бинарный поиск по колонке.
+    """
+
+    def __init__(self, tables: Dict[str, FdbTable]):
+        self.tables = tables
+        self.hosts: List[str] = list(tables)
+
+        total = sum(len(table) for table in tables.values())
+        macs = array("Q")
+        hosts = array("H")
+        rows = array("I")
+        for host_id, table in enumerate(tables.values()):
+            macs.extend(table.macs)
+            hosts.extend([host_id] * len(table))
+            rows.extend(range(len(table)))
+
+        order = sorted(range(total), key=macs.__getitem__)
+        self.index_macs = array("Q", [macs[i] for i in order])
+        self.index_hosts = array("H", [hosts[i] for i in order])
+        self.index_rows = array("I", [rows[i] for i in order])
+
+    def __len__(self):
+        return len(self.index_macs)
+
+    def __contains__(self, mac: int) -> bool:
+        i = bisect_left(self.index_macs, mac)
+        return i < len(self.index_macs) and self.index_macs[i] == mac
+
+    def lookup(self, mac: int) -> List[Tuple[str, str, int]]:
+        """ Где светится MAC: [(host, port, vlan), ...] """
+        found = []
+        for i in range(bisect_left(self.index_macs, mac), bisect_right(self.index_macs, mac)):
+            host = self.hosts[self.index_hosts[i]]
+            port, _, vlan = self.tables[host].row(self.index_rows[i])
+            found.append((host, port, vlan))
+        return found
+
+    def unique_macs(self) -> Iterator[int]:
+        previous = None
+        for mac in self.index_macs:
+            if mac != previous:
+                previous = mac
+                yield mac
+
+    def port_count(self, host: str, port: str) -> int:
+        table = self.tables.get(host)
+        return table.port_counts().get(port, 0) if table is not None else 0
+
+    def memory_usage(self) -> Dict[str, float]:
+        """ Сколько занимают таблицы и индекс, всего и в пересчете на одну запись FDB """
+        nbytes = sum(table.nbytes() for table in self.tables.values()) \
+            + _array_bytes(self.index_macs) + _array_bytes(self.index_hosts) + _array_bytes(self.index_rows)
+        return {
+            "entries": len(self),
+            "bytes": nbytes,
+            "bytes_per_entry": round(nbytes / len(self), 1) if len(self) else 0,
+        }
@@ -0,0 +1,158 @@
+"""
+История MAC-адресов: где (устройство, порт, VLAN) и с какими IP светился MAC.
+Хранится отрезками: один документ на непрерывное пребывание MAC на одном месте
+{mac, host, port, vlan, ips, first_seen, last_seen}, а не строка на каждый цикл опроса.
+Пока MAC стоит на месте, у отрезка только сдвигается last_seen - и то не чаще раза в HISTORY_WRITE_INTERVAL,
+поэтому за цикл в базу уходят в основном новые появления. Все пишется одним неупорядоченным bulk_write.
+Отрезок закрывается, когда MAC пропал с места на устройстве, которое в этом цикле ответило.
+Недоступные устройства отрезков не закрывают и не продлевают.
+После перезапуска открытые отрезки поднимаются из базы - те, что продлевались не позже HISTORY_WRITE_INTERVAL назад.
+
+Запросы: где был MAC в момент T (at) и по каким местам он ходил (moves) - оба по индексу (mac, last_seen).
+Открытый отрезок в базе отстает от реальности не больше чем на HISTORY_WRITE_INTERVAL,
+поэтому at() считает отрезок актуальным, если last_seen не раньше T - HISTORY_WRITE_INTERVAL.
+
+MAC в базе - 48-битное целое, как в FdbStore. Старые отрезки удаляет TTL-индекс по last_seen.
+
+Включается HISTORY_ENABLED, по умолчанию выключено. Объем записи за цикл - все новые появления и переезды
+плюс продление каждого стоящего на месте MAC раз в HISTORY_WRITE_INTERVAL: при 100 тыс. MAC, цикле в минуту
+и интервале 600 сек. это порядка 10 тыс. UpdateOne за цикл; в базе - по отрезку на место за HISTORY_RETENTION_DAYS.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from app.core.fdb_store import int_to_mac
+from app.core.snapshot import TopologySnapshot
+from app.database import motorchik
+from app.settings import settings
+
+HISTORY_COLLECTION = "mac_history"
+BULK_BATCH_SIZE = 1000
+
+# (mac, host, port, vlan)
+SightingKey = Tuple[int, str, str, int]
+
+
+def _stint_filter(key: SightingKey, first_seen: datetime) -> dict:
+    mac, host, port, vlan = key
+    return {"mac": mac, "host": host, "port": port, "vlan": vlan, "first_seen": first_seen}
+
+
+class MacHistory:
+
+    def __init__(self, engine, write_interval: float, retention_days: int, collection: str = HISTORY_COLLECTION):
+        self.engine = engine
+        self.collection = collection
+        self.write_interval = timedelta(seconds=write_interval)
+        self.retention = timedelta(days=retention_days)
+        # открытые отрезки: ключ -> [first_seen, last_seen в базе, когда MAC последний раз видели на месте]
+        self.open: Dict[SightingKey, List[datetime]] = {}
+        self._prepared = False
+
+        # создаются при старте приложения, см. MongoMotorEngine.ensure_indexes
+        engine.declare_index(collection, [
+            ("mac", ASCENDING), ("host", ASCENDING), ("port", ASCENDING), ("vlan", ASCENDING), ("first_seen", ASCENDING)
+        ], unique=True)
+        engine.declare_index(collection, [("mac", ASCENDING), ("last_seen", DESCENDING)])
+        engine.declare_index(collection, [("ips", ASCENDING), ("last_seen", DESCENDING)])
+        engine.declare_index(collection, [("host", ASCENDING), ("port", ASCENDING), ("last_seen", DESCENDING)])
+        engine.declare_index(collection, [("last_seen", ASCENDING)], expireAfterSeconds=int(self.retention.total_seconds()))
+
+    async def prepare(self, now: datetime):
+        """ Один раз перед первой записью: открытые отрезки, оставшиеся с прошлого запуска """
+        if self._prepared:
+            return
+        async for doc in self.engine.iterate(
+                self.collection, {"last_seen": {"$gte": now - self.write_interval}}, projection={"_id": False, "ips": False}
+        ):
+            key = (doc["mac"], doc["host"], doc["port"], doc["vlan"])
+            self.open[key] = [doc["first_seen"], doc["last_seen"], doc["last_seen"]]
+        self._prepared = True
+
+    def plan(self, snapshot: TopologySnapshot, now: datetime) -> List[Tuple[dict, dict]]:
+        """
+        Какие отрезки завести, продлить или закрыть по снимку: [(filter, update), ...] для upsert.
+        Заодно обновляет self.open.
+        """
+        operations = []
+        for host, table in snapshot.fdb.tables.items():
+            for port, mac, vlan in table:
+                key = (mac, host, port, vlan)
+                stint = self.open.get(key)
+                if stint is None:
+                    stint = self.open[key] = [now, None, now]
+                else:
+                    stint[2] = now
+                    if now - stint[1] < self.write_interval:
+                        continue
+                stint[1] = now
+                operations.append((
+                    _stint_filter(key, stint[0]),
+                    {"$set": {"last_seen": now}, "$addToSet": {"ips": {"$each": snapshot.mac_ip_dict.get(mac, [])}}}
+                ))
+
+        # пропал с места на опрошенном устройстве - отрезок закрыт, дописываем его настоящий last_seen
+        polled = snapshot.device_dict
+        for key in [key for key, stint in self.open.items() if stint[2] != now and key[1] in polled]:
+            first_seen, written, last_sighted = self.open.pop(key)
+            if last_sighted != written:
+                operations.append((_stint_filter(key, first_seen), {"$max": {"last_seen": last_sighted}}))
+        return operations
+
+    async def record(self, snapshot: TopologySnapshot) -> int:
+        """ Пишет в историю один цикл опроса, возвращает число операций """
+        # в MongoDB время хранится в UTC без зоны
+        now = snapshot.timestamp.replace(tzinfo=None)
+        await self.prepare(now)
+        operations = self.plan(snapshot, now)
+        for i in range(0, len(operations), BULK_BATCH_SIZE):
+            await self.engine.bulk_write(self.collection, [
+                UpdateOne(find_filter, update, upsert=True) for find_filter, update in operations[i:i + BULK_BATCH_SIZE]
+            ])
+        return len(operations)
+
+    async def at(self, mac: int, when: datetime) -> List[dict]:
+        """ Где светился MAC в момент when (UTC без зоны) """
+        cursor = self.engine.find(self.collection, {
+            "mac": mac, "first_seen": {"$lte": when}, "last_seen": {"$gte": when - self.write_interval}
+        }, projection={"_id": False})
+        return [history_json(doc) for doc in await cursor.to_list(length=None)]
+
+    async def moves(
+            self, mac: int, since: Optional[datetime] = None, until: Optional[datetime] = None, limit: int = 100
+    ) -> List[dict]:
+        """ Отрезки пребывания MAC по местам, от последнего к первому """
+        find_filter = {"mac": mac}
+        if since is not None:
+            find_filter["last_seen"] = {"$gte": since}
+        if until is not None:
+            find_filter["first_seen"] = {"$lte": until}
+        cursor = self.engine.find(self.collection, find_filter, projection={"_id": False})
+        cursor = cursor.sort("last_seen", DESCENDING).limit(limit)
+        return [history_json(doc) for doc in await cursor.to_list(length=None)]
+
+    async def mac_by_ip(self, ip: str) -> Optional[int]:
+        """ MAC, за которым IP видели последним """
+        cursor = self.engine.find(self.collection, {"ips": ip}, projection={"mac": True})
+        cursor = cursor.sort("last_seen", DESCENDING).limit(1)
+        docs = await cursor.to_list(length=1)
+        return docs[0]["mac"] if docs else None
+
+
+def history_json(doc: dict) -> dict:
+    return {
+        "mac": int_to_mac(doc["mac"]),
+        "host": doc["host"],
+        "port": doc["port"],
+        "vlan": str(doc["vlan"]),
+        "ips": doc.get("ips", []),
+        "first_seen": doc["first_seen"].isoformat(),
+        "last_seen": doc["last_seen"].isoformat(),
+    }
+
+
+mac_history = MacHistory(
+    motorchik, settings.HISTORY_WRITE_INTERVAL, settings.HISTORY_RETENTION_DAYS
+) if settings.HISTORY_ENABLED else None
@@ -51,6 +51,32 @@ class NewDevice(BaseModel):
     }
 
 
+class DiscoveryRequest(BaseModel):
+    """
+    Поиск устройств перебором адресов (app.core.discovery).
+    Ответившие на SNMP GET sysObjectID/sysDescr заносятся в devices со стандартными OID-ами опроса.
+    """
+    networks: List[str] = Field(description="Сети CIDR для перебора, например 10.20.30.0/22. Одиночный адрес - /32.")
+    port: int = Field(default=161, description="Port for SNMP query. Default: 161")
+    community: str = "public"
+    snmp_ver: int = 1  # 0 - for SNMP v1, 1 - for SNMP v2c (default)
+    add_devices: bool = Field(default=True, description="Заносить ответивших в devices. False - только найти.")
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "networks": ["10.20.28.0/22"],
+                    "port": 161,
+                    "community": "public",
+                    "snmp_ver": 1,
+                    "add_devices": True,
+                }
+            ]
+        }
+    }
+
+
 ##############################################################
 # Секция описывает структуру данных состояния устройства онлайн
 ##############################################################
@@ -68,11 +94,20 @@ class InternalIP(BaseModel):
     ifPhyAddress: str = Field(description="MAC адрес на этом интерфейсе.", default="")
 
 
+class LldpNeighbor(BaseModel):
+    port: str = Field(description="Свой порт (ifIndex), за которым виден сосед.")
+    chassis_id: str = Field(description="lldpRemChassisId соседа: MAC или текст.", default="")
+    port_id: str = Field(description="lldpRemPortId - порт соседа в его терминах.", default="")
+    sys_name: str = Field(description="lldpRemSysName соседа.", default="")
+    mgmt_ip: str = Field(description="Адрес управления соседа из lldpRemManAddrTable.", default="")
+
+
 class DeviceInfo(BaseModel):
     host: str = Field(description="Host IP-addr")
     info: str = Field(description="Строка с именованием, комментарием, производителем.", default="")
     internal_ip: Dict[str, InternalIP] = Field(description="Список внутренних IP адресов", default={})
     ports: Dict[str, PortInfo] = Field(description="Данные о портах, маках за ними.", default={})
     device_macs_counter: int = Field(description="Общее количество маков на устройстве.", default=0)
+    lldp: List[LldpNeighbor] = Field(description="Соседи по LLDP, пусто - LLDP нет или выключен.", default=[])
 
 
@@ -35,14 +35,26 @@
 
 """
 import asyncio
+from datetime import datetime, timezone
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+from pymongo.errors import DuplicateKeyError
 
 from app.auth.auth import get_current_user
 from app.auth.models import UserData4Auth
 from app.core.core import Core, generate_mac_ip_pair, CoreManager
-from app.core.models import NewDevice
+from app.core.discovery import discovery
+from app.core.events import event_hub, sse_message
+from app.core.export import ndjson_chunks, csv_chunks, parquet_file, file_chunks
+from app.core.fdb_store import mac_to_int
+from app.core.history import mac_history
+from app.core.topology import topology_engine
+from app.core.utils import is_it_ipv4, is_it_mac_addr
+from app.core.models import DiscoveryRequest, NewDevice
 from app.database import motorchik
+from app.settings import settings
 
 router = APIRouter(prefix="/core", tags=["Core functionality API"])
 
@@ -51,31 +63,187 @@ router = APIRouter(prefix="/core", tags=["Core functionality API"])
 async def add_new_device(device: NewDevice, user: UserData4Auth = Depends(get_current_user)):
     print("New device: {}".format(device))
 
-    dev = await motorchik.find_one(
-        "devices", {"host": device.host}
-    )
-    if dev is not None:
+    # уникальность host держит индекс devices.host - без отдельного find_one и без гонки между запросами;
+    # пока индекс не подтвержден (база была недоступна, в ней дубли), проверяем сами
+    if not motorchik.unique_confirmed("devices") and \
+            await motorchik.find_one("devices", {"host": device.host}, projection={"_id": True}) is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Host already exists')
+    try:
+        dev = await motorchik.insert_one("devices", device)
+    except DuplicateKeyError:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Host already exists')
-
-    dev = await motorchik.insert_one("devices", device)
 
     Core.update()
     return {"status": "ok", "inserted_id": str(dev.inserted_id)}
 
 
+@router.post("/discover", summary="Поиск устройств перебором сетей и их добавление")
+async def start_discovery(request: DiscoveryRequest, user: UserData4Auth = Depends(get_current_user)):
+    """
+    Запускает перебор в фоне и сразу отвечает его состоянием; ход и результат - GET /core/discover.
+    Каждому адресу из networks уходит SNMP GET sysObjectID/sysDescr, ответившие
+    (при add_devices) добавляются в devices со стандартными OID-ами и опрашиваются в ближайшем цикле.
+    Одновременно идет только один перебор.
+    """
+    try:
+        sweep = discovery.start(request)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except RuntimeError:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='Discovery is already running')
+    return sweep.status()
+
+
+@router.get("/discover", summary="Состояние последнего перебора сетей")
+async def get_discovery(user: UserData4Auth = Depends(get_current_user)):
+    """
+    total/probed - адресов всего и опрошено, found - ответившие {host, sys_object_id, sys_descr},
+    registered - сколько из них добавлено в devices.
+    """
+    if discovery.current is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Discovery was not started')
+    return discovery.current.status()
+
+
 @router.get("/get_place", summary="Отдает карту устройств, портов, маков на портах.")
-async def get_place(user: UserData4Auth = Depends(get_current_user)):
-    # Core.update()
-    while Core.is_in_progress():
-        await asyncio.sleep(1)
+async def get_place(request: Request, user: UserData4Auth = Depends(get_current_user)):
+    """
+    Отвечает сразу, из последнего полностью собранного цикла опроса (см. TopologySnapshot),
+    даже если прямо сейчас идет следующий цикл. version и timestamp - номер и время этого снимка.
 
+    Ответ сериализуется один раз на снимок. С заголовком If-None-Match, совпадающим с ETag
+    текущего снимка (любого из двух вариантов), возвращается 304 Not Modified без тела.
+    Если клиент принимает gzip (q > 0) - отдается gzip со своим ETag.
+    """
+    snapshot = CoreManager.snapshot
+    snapshot.serialize()
+    use_gzip = _accepts_gzip(request.headers.get("accept-encoding", ""))
+    etag = snapshot.etag_gzip if use_gzip else snapshot.etag
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+
+    # сравнение слабое (RFC 9110, 13.1.2): W/ не учитывается
+    if_none_match = [el.strip().removeprefix("W/") for el in request.headers.get("if-none-match", "").split(",")]
+    if snapshot.etag in if_none_match or snapshot.etag_gzip in if_none_match or "*" in if_none_match:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=snapshot.payload_gzip, media_type="application/json", headers=headers)
+    return Response(content=snapshot.payload, media_type="application/json", headers=headers)
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """ Accept-Encoding с q-значениями: "gzip;q=0" - отказ от gzip, "*" - согласие на любое кодирование """
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, *params = [el.strip() for el in item.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding.lower()] = q
+    q = weights.get("gzip", weights.get("x-gzip", weights.get("*", 0.0)))
+    return q > 0
+
+
+@router.get("/poll_stats", summary="Статистика опроса: сколько раз устройство пропущено, сколько перечитано")
+async def get_poll_stats(user: UserData4Auth = Depends(get_current_user)):
+    """
+    По каждому устройству:
+    - skipped: сколько циклов полный обход был пропущен, потому что на устройстве ничего не изменилось;
+    - rewalked: сколько раз устройство опрошено полностью;
+    - skipped_in_row: сколько последних циклов подряд пропущено.
+
+    fdb - размер FDB последнего снимка: записей, байт и байт на запись.
+    topology - сколько раз дерево пересчитано и сколько раз взято готовым, время последней сборки.
+    cluster - этот экземпляр в кластере: лидер ли он, сколько раз избирался, сколько снимков лидера поднял
+    (null, если кластер выключен).
+    """
     return {
-        "macs": CoreManager.mac_ip_dict,
-        "devices": CoreManager.device_dict,
-        "tree": CoreManager.device_tree
+        "devices": CoreManager.poll_stats,
+        "fdb": CoreManager.snapshot.fdb.memory_usage(),
+        "topology": topology_engine.stats(),
+        "cluster": CoreManager.cluster_node.stats() if CoreManager.cluster_node is not None else None,
+        "skipped": sum(el["skipped"] for el in CoreManager.poll_stats.values()),
+        "rewalked": sum(el["rewalked"] for el in CoreManager.poll_stats.values()),
     }
 
 
+@router.get("/events", summary="Поток изменений топологии (Server-Sent Events)")
+async def topology_events(request: Request, user: UserData4Auth = Depends(get_current_user)):
+    """
+    text/event-stream. Сразу после подключения - событие hello с текущей версией снимка.
+    Дальше на каждый опубликованный снимок - событие diff:
+    ```
+    {"version": int, "prev_version": int, "events": [{"type": "mac_added", ...}, ...]}
+    ```
+    Типы событий смотри в app.core.events.diff_snapshots.
+    Если prev_version не совпадает с версией, которая есть у клиента, или пришло событие resync -
+    клиенту надо перечитать /core/get_place целиком.
+    """
+    queue = event_hub.subscribe()
+
+    async def stream():
+        try:
+            yield sse_message("hello", {"version": CoreManager.snapshot.version})
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield b": ping\n\n"
+                    continue
+                yield sse_message(event, data, data.get("version"))
+        finally:
+            event_hub.unsubscribe(queue)
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/export", summary="Выгрузка инвентаризации: устройство, порт, MAC, VLAN, IP")
+async def export_inventory(fmt: str = "ndjson", user: UserData4Auth = Depends(get_current_user)):
+    """
+    Одна строка на (device, port, mac, vlan, ip) из последнего снимка опроса.
+    Колонки: device, port, port_name, mac, vlan, ip.
+
+    **fmt**:
+    - **ndjson** (по умолчанию) - по JSON-объекту на строку, потоком;
+    - **csv** - с заголовком, потоком;
+    - **parquet** - колоночный файл (нужен установленный pyarrow).
+    """
+    snapshot = CoreManager.snapshot
+    filename = "inventory_v{}".format(snapshot.version)
+
+    if fmt == "ndjson":
+        return StreamingResponse(ndjson_chunks(snapshot), media_type="application/x-ndjson")
+    elif fmt == "csv":
+        return StreamingResponse(
+            csv_chunks(snapshot), media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="{}.csv"'.format(filename)}
+        )
+    elif fmt == "parquet":
+        try:
+            out = await asyncio.to_thread(parquet_file, snapshot)
+        except ImportError:
+            raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail='Для parquet нужен pyarrow')
+        return StreamingResponse(
+            file_chunks(out), media_type="application/vnd.apache.parquet",
+            headers={"Content-Disposition": 'attachment; filename="{}.parquet"'.format(filename)}
+        )
+
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Unknown format')
+
+
 @router.post("/search/", summary="Поиск по MAC-ам или по IP")
 async def search_mac_or_ip(param: dict, user: UserData4Auth = Depends(get_current_user)):
     """
@@ -85,7 +253,10 @@ async def search_mac_or_ip(param: dict, user: UserData4Auth = Depends(get_curren
     """
     print("search_mac_or_ip: {}".format(param))
 
-    ret = generate_mac_ip_pair(param["query"], CoreManager.mac_ip_dict, CoreManager.device_dict)
+    snapshot = CoreManager.snapshot
+    ret = generate_mac_ip_pair(
+        param["query"], snapshot.mac_ip_dict, snapshot.device_dict, snapshot.fdb, snapshot.ip_index
+    )
     print("search_mac_or_ip: {}".format(ret))
     if ret is None:
         print("\tdata unrecognized.")
@@ -94,3 +265,61 @@ async def search_mac_or_ip(param: dict, user: UserData4Auth = Depends(get_curren
     return ret
 
 
+def _utc(value: Optional[str]) -> Optional[datetime]:
+    """ ISO 8601 -> UTC без зоны, как время хранится в истории. Время без зоны считается UTC """
+    if not value:
+        return None
+    try:
+        when = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Bad time: {}'.format(value))
+    return when.astimezone(timezone.utc).replace(tzinfo=None) if when.tzinfo else when
+
+
+def _limit(value) -> int:
+    """ Сколько отрезков истории отдать: целое от 1, больше HISTORY_MAX_LIMIT урезается до него """
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Bad limit: {}'.format(value))
+    if limit < 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Bad limit: {}'.format(value))
+    return min(limit, settings.HISTORY_MAX_LIMIT)
+
+
+@router.post("/history/", summary="Где MAC (или IP) был в момент времени и как перемещался")
+async def search_history(param: dict, user: UserData4Auth = Depends(get_current_user)):
+    """
+    Поиск по истории, как /core/search/, но не только по последнему циклу опроса.
+    ```
+    {"query": "68:13:e2:85:c2:80" OR "10.20.30.41", "at": "2024-05-14T10:00:00+03:00"}
+    {"query": "68:13:e2:85:c2:80", "since": "...", "until": "...", "limit": 100}
+    ```
+    С at - на каких портах каких устройств MAC светился в этот момент (locations),
+    без at - отрезки пребывания MAC по местам от последнего к первому (history).
+    Время в ISO 8601, без зоны - UTC. limit - не больше HISTORY_MAX_LIMIT отрезков.
+    """
+    if mac_history is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='MAC history is disabled')
+
+    query = str(param.get("query", "")).lower()
+    if is_it_mac_addr(query):
+        mac = mac_to_int(query)
+    elif is_it_ipv4(query):
+        mac = CoreManager.snapshot.ip_index.get(query)
+        if mac is None:
+            mac = await mac_history.mac_by_ip(query)
+        if mac is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Unknown IP')
+    else:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Bad or unknown data')
+
+    at = _utc(param.get("at"))
+    if at is not None:
+        return {"query": query, "at": at.isoformat(), "locations": await mac_history.at(mac, at)}
+    return {
+        "query": query,
+        "history": await mac_history.moves(
+            mac, since=_utc(param.get("since")), until=_utc(param.get("until")), limit=_limit(param.get("limit", 100))
+        ),
+    }
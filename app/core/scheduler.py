@@ -0,0 +1,59 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+
+class PollScheduler:
+    """
+    Планировщик одного цикла опроса.
+    - не больше max_devices устройств опрашиваются одновременно (не заваливаем UDP стек хоста);
+    - внутри устройства не больше device_concurrency обходов одновременно (слоты отдаются в poll_device);
+    - опрос одного устройства ограничен device_timeout секундами: медленное устройство пропускается
+      до следующего цикла и не держит весь цикл.
+    Частоту PDU к устройству ограничивает TokenBucket сессии (app.snmp.session).
+    """
+
+    def __init__(self, max_devices: int, device_concurrency: int, device_timeout: float):
+        self.max_devices = max(1, max_devices)
+        self.device_concurrency = max(1, device_concurrency)
+        self.device_timeout = device_timeout
+        self.cycle_time: float = 0
+        self.timeouts: int = 0
+        self.errors: int = 0
+        # сколько секунд опрашивалось каждое устройство в последнем цикле
+        self.durations: Dict[str, float] = {}
+
+    async def run(
+            self,
+            devices: Iterable,
+            poll_device: Callable[[object, asyncio.Semaphore], Awaitable]
+    ) -> List[Optional[object]]:
+        """
+        Вызывает poll_device(device, slots) для каждого устройства.
+        На выходе результаты в порядке devices, None - если устройство не опросилось.
+        """
+        started = time.monotonic()
+        self.timeouts, self.errors, self.durations = (0, 0, {})
+        devices_slots = asyncio.Semaphore(self.max_devices)
+
+        async def poll_one(device):
+            async with devices_slots:
+                device_started = time.monotonic()
+                try:
+                    return await asyncio.wait_for(
+                        poll_device(device, asyncio.Semaphore(self.device_concurrency)),
+                        timeout=self.device_timeout
+                    )
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    print("PollScheduler: timeout for device {}".format(getattr(device, "host", device)))
+                except Exception as ex:
+                    self.errors += 1
+                    print("PollScheduler: device {} failed: {}".format(getattr(device, "host", device), ex))
+                finally:
+                    self.durations[str(getattr(device, "host", device))] = time.monotonic() - device_started
+                return None
+
+        results = await asyncio.gather(*[poll_one(device) for device in devices])
+        self.cycle_time = time.monotonic() - started
+        return results
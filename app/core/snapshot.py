@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import json
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from app.core.fdb_store import FdbStore, FdbTable, int_to_mac
+from app.core.models import DeviceInfo
+
+
+class TopologySnapshot:
+    """
+    Полный результат одного цикла опроса: устройства, маки/IP, дерево и индексы для поиска.
+    Собирается целиком в стороне от того, что сейчас отдают эндпоинты, и публикуется
+    одной заменой ссылки CoreManager.snapshot. После публикации снимок не меняется,
+    поэтому читателям не нужны ни блокировки, ни ожидание конца цикла.
+    """
+
+    def __init__(
+            self,
+            version: int,
+            device_dict: Dict[str, DeviceInfo],
+            device_arp: Dict[str, List[Tuple[int, str]]],
+            mac_ip_dict: Dict[int, List[str]],
+            device_tree: dict,
+            fdb: FdbStore,
+            ip_index: Dict[str, int],
+            unreachable: List[str],
+    ):
+        self.version = version
+        self.timestamp = datetime.now(timezone.utc)
+        # устройства без FDB: маки на портах лежат в fdb и в PortInfo.macs попадают только в device_json()
+        self.device_dict = device_dict
+        # пары (mac, ip), которые дало каждое устройство (ARP и свои интерфейсы) - чтобы
+        # не опрошенное заново в следующем цикле устройство могло отдать их повторно
+        self.device_arp = device_arp
+        # {mac: [ip, ...]} только для маков, у которых IP известен
+        self.mac_ip_dict = mac_ip_dict
+        self.device_tree = device_tree
+        self.fdb = fdb
+        self.ip_index = ip_index
+        # устройства, которые в этом цикле не ответили
+        self.unreachable = unreachable
+        # готовый ответ /core/get_place, см. serialize()
+        # снимок поднят из сохраненного (app.core.snapshot_store), а не собран опросом в этом процессе
+        self.restored = False
+        self.payload: Optional[bytes] = None
+        self.payload_gzip: Optional[bytes] = None
+        self.etag: Optional[str] = None
+        # у gzip-варианта свой ETag: разные content-coding - разные представления (RFC 9110, 8.8.3)
+        self.etag_gzip: Optional[str] = None
+
+    def serialize(self):
+        """
+        Сериализует ответ /core/get_place один раз на снимок: JSON как есть и он же в gzip,
+        плюс строгий ETag по содержимому. Вызывается до публикации, так что запросы
+        дашборда только отдают готовые байты (или 304, если у браузера та же версия).
+        """
+        if self.payload is not None:
+            return
+        payload = json.dumps(
+            {
+                "version": self.version,
+                "timestamp": self.timestamp.isoformat(),
+                "macs": self.macs_json(),
+                "devices": {host: self.device_json(host) for host in self.device_dict},
+                "tree": self.device_tree,
+            },
+            ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+        self.set_payload(payload, gzip.compress(payload, compresslevel=6, mtime=0))
+
+    def set_payload(self, payload: bytes, payload_gzip: bytes):
+        """ Готовый ответ /core/get_place - свежесобранный или поднятый вместе с сохраненным снимком """
+        self.payload_gzip = payload_gzip
+        self.etag = '"{}-{}"'.format(self.version, hashlib.sha1(payload).hexdigest()[:20])
+        self.etag_gzip = self.etag[:-1] + '-gz"'
+        self.payload = payload
+
+    def device_json(self, host: str) -> dict:
+        """ DeviceInfo в виде для API: с маками на портах из FDB """
+        device = self.device_dict[host].model_dump()
+        table = self.fdb.tables.get(host)
+        if table is not None:
+            for port, macs in table.to_dict().items():
+                device["ports"][port]["macs"] = macs
+        return device
+
+    def macs_json(self) -> Dict[str, List[str]]:
+        """ {mac: [ip, ...]} в виде для API: все маки из FDB (IP может и не найтись) и все из ARP """
+        macs = {int_to_mac(mac): self.mac_ip_dict.get(mac, []) for mac in self.fdb.unique_macs()}
+        for mac, ip_list in self.mac_ip_dict.items():
+            macs.setdefault(int_to_mac(mac), ip_list)
+        return macs
+
+    @classmethod
+    def empty(cls) -> "TopologySnapshot":
+        return cls(
+            version=0, device_dict={}, device_arp={}, mac_ip_dict={}, device_tree={},
+            fdb=FdbStore({}), ip_index={}, unreachable=[]
+        )
+
+
+def build_mac_ip_dict(device_arp: Dict[str, List[Tuple[int, str]]]) -> Dict[int, List[str]]:
+    """
+    {mac: [ip, ...]} по всем устройствам цикла: IP из ARP-таблиц и внутренних интерфейсов, без дублей.
+    Маки из FDB без IP сюда не попадают, их список - FdbStore.unique_macs().
+    """
+    mac_ip_dict: Dict[int, List[str]] = {}
+    for pairs in device_arp.values():
+        for mac, ip in pairs:
+            ip_list = mac_ip_dict.setdefault(mac, [])
+            # если уже добавляли такой IP, то незачем делать дубли
+            if ip not in ip_list:
+                ip_list.append(ip)
+
+    return mac_ip_dict
+
+
+def build_indexes(fdb_tables: Dict[str, FdbTable], mac_ip_dict: Dict[int, List[str]]):
+    """
+    Обратные индексы, строятся один раз за цикл опроса:
+    fdb: FdbStore - где светится MAC (см. FdbStore.lookup);
+    ip_index: {ip: mac} - по IP сразу MAC, без перебора mac_ip_dict.
+    """
+    ip_index: Dict[str, int] = {}
+    for mac, ip_list in mac_ip_dict.items():
+        for ip in ip_list:
+            ip_index.setdefault(ip, mac)
+
+    return FdbStore(fdb_tables), ip_index
@@ -0,0 +1,215 @@
+"""
+Сохранение последнего снимка топологии между перезапусками.
+Включается SNAPSHOT_STORE (mongo или file), по умолчанию выключено: после каждого цикла опроса
+снимок кодируется компактно и перезаписывается целиком - FDB по 14 байт на запись до сжатия
+плюс gzip-ответ /core/get_place, в MongoDB кусками по MONGO_CHUNK_SIZE. При старте ядра снимок
+поднимается до первого опроса - дашборд и поиск сразу отвечают по последним известным данным,
+пока свежий опрос идет в фоне.
+
+Формат: MAGIC + <I длина> zlib(<I длина заголовка> заголовок JSON + колонки FDB) + ответ /core/get_place в gzip.
+В заголовке версия, время, устройства (без маков - они в FDB), пары (mac, ip) по устройствам,
+дерево, недоступные устройства и по каждой таблице FDB имена портов и число строк.
+Колонки FDB (macs "Q", vlans "I", ports "H") идут следом сырыми байтами, little-endian.
+mac_ip_dict и индексы не сохраняются - они пересобираются из сохраненного.
+Готовый gzip-ответ хранится как есть, чтобы после старта не сериализовать снимок заново.
+"""
+import asyncio
+import gzip
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime
+from typing import Optional
+
+from app.core.fdb_store import FdbTable
+from app.core.models import DeviceInfo
+from app.core.snapshot import TopologySnapshot, build_indexes, build_mac_ip_dict
+from app.database import motorchik
+from app.settings import BASE_DIR, settings
+
+MAGIC = b"NVSNAP2\n"
+_LEN = struct.Struct("<I")
+# документ MongoDB не больше 16 МБ - крупный снимок режем на куски
+MONGO_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _column_bytes(column: array) -> bytes:
+    if sys.byteorder != "little":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _column(typecode: str, data: bytes) -> array:
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column
+
+
+def encode_snapshot(snapshot: TopologySnapshot) -> bytes:
+    tables = snapshot.fdb.tables
+    header = json.dumps(
+        {
+            "version": snapshot.version,
+            "timestamp": snapshot.timestamp.isoformat(),
+            "devices": {host: device.model_dump() for host, device in snapshot.device_dict.items()},
+            "device_arp": snapshot.device_arp,
+            "tree": snapshot.device_tree,
+            "unreachable": snapshot.unreachable,
+            "fdb": [[host, table.port_names, len(table)] for host, table in tables.items()],
+        },
+        ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+    parts = [_LEN.pack(len(header)), header]
+    for table in tables.values():
+        parts.extend((_column_bytes(table.macs), _column_bytes(table.vlans), _column_bytes(table.ports)))
+    body = zlib.compress(b"".join(parts), 6)
+    return MAGIC + _LEN.pack(len(body)) + body + (snapshot.payload_gzip or b"")
+
+
+def decode_snapshot(data: bytes) -> TopologySnapshot:
+    if not data.startswith(MAGIC):
+        raise ValueError("not a topology snapshot")
+    body_len, = _LEN.unpack_from(data, len(MAGIC))
+    body_end = len(MAGIC) + _LEN.size + body_len
+    body = zlib.decompress(data[len(MAGIC) + _LEN.size:body_end])
+    payload_gzip = data[body_end:]
+    header_len, = _LEN.unpack_from(body)
+    pos = _LEN.size + header_len
+    header = json.loads(body[_LEN.size:pos])
+
+    fdb_tables = {}
+    for host, port_names, rows in header["fdb"]:
+        columns = []
+        for typecode, size in (("Q", 8), ("I", 4), ("H", 2)):
+            columns.append(_column(typecode, body[pos:pos + rows * size]))
+            pos += rows * size
+        fdb_tables[host] = FdbTable.from_columns(port_names, *columns)
+
+    device_arp = {host: [(mac, ip) for mac, ip in pairs] for host, pairs in header["device_arp"].items()}
+    mac_ip_dict = build_mac_ip_dict(device_arp)
+    fdb, ip_index = build_indexes(fdb_tables, mac_ip_dict)
+    snapshot = TopologySnapshot(
+        version=header["version"],
+        device_dict={host: DeviceInfo.model_validate(device) for host, device in header["devices"].items()},
+        device_arp=device_arp,
+        mac_ip_dict=mac_ip_dict,
+        device_tree=header["tree"],
+        fdb=fdb,
+        ip_index=ip_index,
+        unreachable=header["unreachable"],
+    )
+    # время того цикла, который снимок собрал, а не момент загрузки
+    snapshot.timestamp = datetime.fromisoformat(header["timestamp"])
+    snapshot.restored = True
+    if payload_gzip:
+        snapshot.set_payload(gzip.decompress(payload_gzip), payload_gzip)
+    return snapshot
+
+
+def snapshot_version(data: bytes) -> int:
+    """ Версия снимка по одному заголовку, без разбора FDB и ответа """
+    if not data.startswith(MAGIC):
+        raise ValueError("not a topology snapshot")
+    body_len, = _LEN.unpack_from(data, len(MAGIC))
+    body = data[len(MAGIC) + _LEN.size:len(MAGIC) + _LEN.size + body_len]
+    inflater = zlib.decompressobj()
+    head = inflater.decompress(body, _LEN.size)
+    header_len, = _LEN.unpack(head)
+    header = inflater.decompress(inflater.unconsumed_tail, header_len)
+    return json.loads(header)["version"]
+
+
+class FileSnapshotStore:
+    """
+    Снимок в локальном файле. Пишется во временный файл рядом и подменяется целиком,
+    так что оборванная запись не портит прежний снимок.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, data: bytes):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def _read(self) -> Optional[bytes]:
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    async def save(self, snapshot: TopologySnapshot):
+        data = await asyncio.to_thread(encode_snapshot, snapshot)
+        await asyncio.to_thread(self._write, data)
+
+    async def load(self) -> Optional[TopologySnapshot]:
+        data = await asyncio.to_thread(self._read)
+        return await asyncio.to_thread(decode_snapshot, data) if data is not None else None
+
+    async def version(self) -> Optional[int]:
+        data = await asyncio.to_thread(self._read)
+        return await asyncio.to_thread(snapshot_version, data) if data is not None else None
+
+
+class MongoSnapshotStore:
+    """
+    Снимок в коллекции MongoDB: заголовок {_id: name, version, timestamp, chunks} и куски {_id: "name.N", timestamp, data}.
+    Сначала пишутся куски, потом заголовок. Если запись оборвалась, метки времени кусков не совпадут
+    с заголовком, и такой снимок не грузится - лучше холодный старт, чем склейка двух циклов.
+    """
+
+    def __init__(self, engine, collection: str = "snapshots", name: str = "topology"):
+        self.engine = engine
+        self.collection = collection
+        self.name = name
+
+    async def save(self, snapshot: TopologySnapshot):
+        data = await asyncio.to_thread(encode_snapshot, snapshot)
+        timestamp = snapshot.timestamp.isoformat()
+        chunks = [data[i:i + MONGO_CHUNK_SIZE] for i in range(0, len(data), MONGO_CHUNK_SIZE)]
+        for i, chunk in enumerate(chunks):
+            await self.engine.update_one(
+                self.collection, {"_id": "{}.{}".format(self.name, i)},
+                {"$set": {"timestamp": timestamp, "data": chunk}}
+            )
+        await self.engine.update_one(
+            self.collection, {"_id": self.name},
+            {"$set": {"version": snapshot.version, "timestamp": timestamp, "chunks": len(chunks), "size": len(data)}}
+        )
+
+    async def load(self) -> Optional[TopologySnapshot]:
+        head = await self.engine.find_one(self.collection, {"_id": self.name})
+        if head is None:
+            return None
+        ids = ["{}.{}".format(self.name, i) for i in range(head["chunks"])]
+        documents = await self.engine.find(self.collection, {"_id": {"$in": ids}}).to_list(length=None)
+        chunks = {document["_id"]: document for document in documents}
+        if any(_id not in chunks or chunks[_id]["timestamp"] != head["timestamp"] for _id in ids):
+            print("сохраненный снимок v{} записан не полностью, пропускаю".format(head["version"]))
+            return None
+        data = b"".join(bytes(chunks[_id]["data"]) for _id in ids)
+        return await asyncio.to_thread(decode_snapshot, data)
+
+    async def version(self) -> Optional[int]:
+        """ Версия последнего сохраненного снимка - только заголовок, куски не читаются """
+        head = await self.engine.find_one(self.collection, {"_id": self.name}, projection={"version": True})
+        return head["version"] if head is not None else None
+
+
+def make_snapshot_store():
+    if settings.SNAPSHOT_STORE == "mongo":
+        return MongoSnapshotStore(motorchik)
+    if settings.SNAPSHOT_STORE == "file":
+        return FileSnapshotStore(str(BASE_DIR / settings.SNAPSHOT_FILE))
+    return None
+
+
+snapshot_store = make_snapshot_store()
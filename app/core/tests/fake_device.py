@@ -0,0 +1,103 @@
+"""
+Синтетические ответы коммутатора для тестов CoreManager (отдаются через FakeAgent из app.snmp.tests).
+"""
+import contextlib
+from unittest import mock
+
+from pysnmp.proto.rfc1902 import Integer, IpAddress, ObjectName, OctetString, TimeTicks
+
+from app.core.models import NewDevice
+from app.snmp.tests.test_oid_query import FakeAgent
+
+NEW_DEVICE_EXAMPLE = NewDevice.model_config["json_schema_extra"]["examples"][0]
+
+
+def new_device(host: str) -> NewDevice:
+    return NewDevice(**{**NEW_DEVICE_EXAMPLE, "host": host})
+
+
+def mac_to_oid(mac: str) -> str:
+    return ".".join(str(int(octet, 16)) for octet in mac.split(":"))
+
+
+def device_data(
+        host: str, own_mac: str, fdb=(), arp=(), n_ports: int = 4, uptime: int = 1000, fdb_count=None, lldp=None
+):
+    """
+    fdb: [(mac, vlan, ifIndex)], arp: [(mac, ip)]
+    fdb_count: значение dot1qFdbDynamicCount, None - устройство его не поддерживает.
+    lldp: [(ifIndex, chassis mac соседа, его ifIndex, его адрес управления или "")], None - LLDP нет.
+    lldpLocPortNum совпадает с ifIndex, lldpLocPortId - имя порта "giN".
+    """
+    data = [
+        (ObjectName("1.3.6.1.2.1.1.1.0"), OctetString("switch " + host)),
+        (ObjectName("1.3.6.1.2.1.1.3.0"), TimeTicks(uptime)),
+        (ObjectName("1.3.6.1.2.1.31.1.5.0"), TimeTicks(10)),
+    ]
+    for if_index in range(1, n_ports + 1):
+        data.append((ObjectName("1.3.6.1.2.1.2.2.1.2.{}".format(if_index)), OctetString("gi{}".format(if_index))))
+        data.append((ObjectName("1.3.6.1.2.1.2.2.1.6.{}".format(if_index)), OctetString(bytes.fromhex(own_mac.replace(":", "")))))
+    for column, value in enumerate((IpAddress(host), Integer(1), IpAddress("255.255.255.0"), Integer(1), Integer(65535)), 1):
+        data.append((ObjectName("1.3.6.1.2.1.4.20.1.{}.{}".format(column, host)), value))
+    for mac, vlan, if_index in fdb:
+        data.append((ObjectName("1.3.6.1.2.1.17.7.1.2.2.1.2.{}.{}".format(vlan, mac_to_oid(mac))), Integer(if_index)))
+    for mac, ip in arp:
+        data.append((ObjectName("1.3.6.1.2.1.4.22.1.2.1.{}".format(ip)), OctetString(bytes.fromhex(mac.replace(":", "")))))
+    if lldp is not None:
+        for if_index in range(1, n_ports + 1):
+            data.append((ObjectName("1.0.8802.1.1.2.1.3.7.1.3.{}".format(if_index)), OctetString("gi{}".format(if_index))))
+        for rem_index, (if_index, mac, rem_port, mgmt_ip) in enumerate(lldp, 1):
+            index = "0.{}.{}".format(if_index, rem_index)
+            data.append((ObjectName("1.0.8802.1.1.2.1.4.1.1.4." + index), Integer(4)))
+            data.append((ObjectName("1.0.8802.1.1.2.1.4.1.1.5." + index), OctetString(bytes.fromhex(mac.replace(":", "")))))
+            data.append((ObjectName("1.0.8802.1.1.2.1.4.1.1.7." + index), OctetString("gi{}".format(rem_port))))
+            data.append((ObjectName("1.0.8802.1.1.2.1.4.1.1.9." + index), OctetString("sw-" + mac[-2:])))
+            if mgmt_ip:
+                data.append((ObjectName("1.0.8802.1.1.2.1.4.2.1.3.{}.1.4.{}".format(index, mgmt_ip)), Integer(2)))
+    if fdb_count is not None:
+        data.append((ObjectName("1.3.6.1.2.1.17.7.1.2.1.1.2.1"), Integer(fdb_count)))
+    return data
+
+
+class FakeFleet:
+    """
+    Несколько FakeAgent-ов: запрос уходит тому, чей host указан в транспорте сессии.
+    """
+
+    def __init__(self, agents: dict):
+        self.agents = agents
+
+    def _agent(self, transport):
+        return self.agents[transport.transportAddr[0]]
+
+    async def get_cmd(self, engine, auth, transport, *args, **options):
+        return await self._agent(transport).get_cmd(engine, auth, transport, *args, **options)
+
+    async def next_cmd(self, engine, auth, transport, *args, **options):
+        return await self._agent(transport).next_cmd(engine, auth, transport, *args, **options)
+
+    async def bulk_cmd(self, engine, auth, transport, *args, **options):
+        return await self._agent(transport).bulk_cmd(engine, auth, transport, *args, **options)
+
+    def patch(self):
+        return FakeAgent.patch(self)
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def to_list(self, length=None):
+        return self.documents
+
+
+@contextlib.contextmanager
+def devices_collection(*hosts):
+    """
+    Подмена motorchik.find("devices", ...) для CoreManager.update_device_tree.
+    Снимки и история MAC при этом никуда не сохраняются.
+    """
+    with mock.patch("app.core.core.motorchik.find", return_value=FakeCursor([
+        new_device(host).model_dump() for host in hosts
+    ])), mock.patch("app.core.core.snapshot_store", None), mock.patch("app.core.core.mac_history", None):
+        yield
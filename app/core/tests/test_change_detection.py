@@ -0,0 +1,57 @@
+import unittest
+
+from app.core.core import CoreManager
+from app.core.fdb_store import FdbStore
+from app.core.snapshot import TopologySnapshot
+from app.core.tests.fake_device import device_data, new_device
+from app.snmp.tests.test_oid_query import FakeAgent
+
+
+class TestChangeDetection(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        CoreManager.snapshot = TopologySnapshot.empty()
+        CoreManager.fingerprints, CoreManager.poll_stats = ({}, {})
+        self.fdb = [("00:0a:00:00:00:01", 10, 2)]
+
+    async def poll(self, fdb_count, uptime=1000):
+        agent = FakeAgent(device_data("10.0.0.1", "00:01:02:03:04:05", self.fdb, uptime=uptime, fdb_count=fdb_count))
+        stop = agent.patch()
+        try:
+            device, fdb, mac_ip_pairs = await CoreManager.update_device_info(new_device("10.0.0.1"))
+        finally:
+            stop()
+        # как будто цикл закончился только этим устройством
+        CoreManager.publish(TopologySnapshot(
+            version=CoreManager.snapshot.version + 1, device_dict={device.host: device},
+            device_arp={device.host: mac_ip_pairs}, mac_ip_dict={}, device_tree={},
+            fdb=FdbStore({device.host: fdb}), ip_index={}, unreachable=[]
+        ))
+        return agent.pdu_count
+
+    async def test_unchanged_device_is_skipped(self):
+        await self.poll(fdb_count=1)
+        self.fdb.append(("00:0a:00:00:00:02", 10, 3))
+        pdu_count = await self.poll(fdb_count=1, uptime=2000)
+
+        self.assertEqual(pdu_count, {"get": 1, "next": 0, "bulk": 1})
+        self.assertEqual(CoreManager.snapshot.fdb.port_count("10.0.0.1", "3"), 0)
+        self.assertEqual(CoreManager.poll_stats["10.0.0.1"], {"skipped": 1, "rewalked": 1, "skipped_in_row": 1})
+
+    async def test_changed_counters_force_rewalk(self):
+        await self.poll(fdb_count=1)
+        self.fdb.append(("00:0a:00:00:00:02", 10, 3))
+        await self.poll(fdb_count=2)
+        self.assertEqual(CoreManager.snapshot.fdb.port_count("10.0.0.1", "3"), 1)
+
+        # перезагрузка: счетчики те же, но uptime меньше
+        await self.poll(fdb_count=2, uptime=10)
+        self.assertEqual(CoreManager.poll_stats["10.0.0.1"]["rewalked"], 3)
+
+    async def test_device_without_fdb_counters_always_rewalked(self):
+        await self.poll(fdb_count=None)
+        await self.poll(fdb_count=None)
+        self.assertEqual(CoreManager.poll_stats["10.0.0.1"], {"skipped": 0, "rewalked": 2, "skipped_in_row": 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
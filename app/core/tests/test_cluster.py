@@ -0,0 +1,155 @@
+import contextlib
+import io
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from pymongo.errors import DuplicateKeyError
+
+from app.core import cluster
+from app.core.cluster import ClusterNode
+from app.core.core import Core, CoreManager
+from app.core.snapshot import TopologySnapshot
+from app.core.snapshot_store import MongoSnapshotStore
+from app.core.tests.fake_device import devices_collection
+from app.core.tests.test_snapshot import make_fleet
+from app.core.tests.test_snapshot_store import FakeMongo, poll_once
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def matches(document: dict, find_filter: dict) -> bool:
+    for key, value in find_filter.items():
+        if key == "$or":
+            if not any(matches(document, el) for el in value):
+                return False
+        elif isinstance(value, dict):
+            if key not in document or not document[key] <= value["$lte"]:
+                return False
+        elif document.get(key) != value:
+            return False
+    return True
+
+
+class LeaseMongo:
+    """ update_one с фильтром и upsert, как у MongoDB: при занятом _id - DuplicateKeyError """
+
+    def __init__(self):
+        self.documents = {}
+
+    async def update_one(self, collection, find_filter: dict, new_data: dict, upsert: bool = True):
+        document = self.documents.get(find_filter["_id"])
+        if document is None or not matches(document, find_filter):
+            if not upsert:
+                return
+            if document is not None:
+                raise DuplicateKeyError("E11000 duplicate key")
+            document = self.documents[find_filter["_id"]] = {"_id": find_filter["_id"]}
+        document.update(new_data.get("$set", {}))
+        for key in new_data.get("$unset", {}):
+            document.pop(key, None)
+
+    async def find_one(self, collection, find_filter: dict):
+        return self.documents.get(find_filter["_id"])
+
+
+class TestClusterNode(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        CoreManager.snapshot = TopologySnapshot.empty()
+        CoreManager.fingerprints, CoreManager.poll_stats = ({}, {})
+        self.now = START
+        patcher = mock.patch.object(cluster, "_now", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(Core.updated)
+        self.addCleanup(setattr, CoreManager, "snapshot", TopologySnapshot.empty())
+
+        self.mongo = LeaseMongo()
+        self.store = MongoSnapshotStore(FakeMongo())
+        self.a = ClusterNode(self.mongo, self.store, "a", lease_ttl=15)
+        self.b = ClusterNode(self.mongo, self.store, "b", lease_ttl=15)
+
+    async def tick(self, *nodes):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for node in nodes:
+                await node.tick()
+
+    async def test_one_leader_and_failover_within_lease(self):
+        await self.tick(self.a)
+        # новый лидер сразу запускает опрос
+        self.assertTrue(Core.is_in_progress())
+        Core.updated()
+        await self.tick(self.b)
+        self.assertEqual((self.a.is_leader, self.b.is_leader), (True, False))
+
+        # лидер продлевает аренду, пока жив
+        for _ in range(5):
+            self.now += timedelta(seconds=self.a.interval)
+            await self.tick(self.a, self.b)
+        self.assertEqual((self.a.is_leader, self.b.is_leader), (True, False))
+
+        # лидер упал: до истечения аренды ведомый ждет, после - забирает ее на ближайшем тике
+        self.now += timedelta(seconds=10)
+        await self.tick(self.b)
+        self.assertFalse(self.b.is_leader)
+        self.now += timedelta(seconds=5)
+        await self.tick(self.b)
+        self.assertTrue(self.b.is_leader)
+        self.assertEqual(self.mongo.documents["poller"]["holder"], "b")
+
+        # вернувшийся a уже ведомый
+        await self.tick(self.a)
+        self.assertFalse(self.a.is_leader)
+
+    async def test_released_lease_is_taken_at_once(self):
+        await self.tick(self.a, self.b)
+        await self.a.release()
+        await self.tick(self.b)
+        self.assertTrue(self.b.is_leader)
+
+    async def test_follower_publishes_leader_snapshot(self):
+        await self.tick(self.a, self.b)
+        snapshot = await poll_once()
+        await self.store.save(snapshot)
+
+        # ведомый - другой процесс: своего снимка у него нет
+        CoreManager.snapshot = TopologySnapshot.empty()
+        await self.tick(self.b)
+        self.assertEqual(CoreManager.snapshot.version, snapshot.version)
+        self.assertEqual(CoreManager.snapshot.payload, snapshot.payload)
+        self.assertEqual(self.b.synced, 1)
+
+        # тот же снимок второй раз не поднимается
+        await self.tick(self.b)
+        self.assertEqual(self.b.synced, 1)
+
+    async def test_update_request_goes_to_leader(self):
+        await self.tick(self.a, self.b)
+        Core.updated()
+
+        # устройство добавили через ведомого
+        Core.update()
+        await self.tick(self.b)
+        self.assertFalse(Core.is_in_progress())
+        self.assertIn("update_requested", self.mongo.documents["poller"])
+
+        await self.tick(self.a)
+        self.assertTrue(Core.is_in_progress())
+        self.assertNotIn("update_requested", self.mongo.documents["poller"])
+
+    async def test_lost_lease_does_not_save_snapshot(self):
+        await self.tick(self.a)
+        self.addCleanup(make_fleet().patch())
+        with devices_collection("10.0.0.1", "10.0.0.2"), mock.patch("app.core.core.snapshot_store", self.store), \
+                mock.patch.object(CoreManager, "cluster_node", self.a), contextlib.redirect_stdout(io.StringIO()):
+            await CoreManager.update_device_tree()
+            self.assertEqual(await self.store.version(), 1)
+
+            # аренду перехватили посреди цикла
+            self.a.is_leader = False
+            await CoreManager.update_device_tree()
+        self.assertEqual(CoreManager.snapshot.version, 2)
+        self.assertEqual(await self.store.version(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import asyncio
+import contextlib
+import io
+import unittest
+from unittest import mock
+
+from pymongo.errors import BulkWriteError
+
+from app.benchmarks.bench_poll import _Cursor
+from app.benchmarks.snmp_agent import AGENT_PORT, AgentProtocol, FleetSpec
+from app.core.core import Core
+from app.core.discovery import Discovery, DiscoverySweep, STANDARD_OIDS, sweep_networks
+from app.core.models import DiscoveryRequest
+
+
+class InsertResult:
+    def __init__(self, documents):
+        self.inserted_ids = list(range(len(documents)))
+
+
+class TestDiscovery(unittest.IsolatedAsyncioTestCase):
+    """ Агенты 127.1.0.1-3 в event loop теста, .3 молчит; остальные адреса сети не заняты """
+
+    async def asyncSetUp(self):
+        self.spec = FleetSpec(devices=3, ports=4, fdb=0, dead=1)
+        self.stats = {"received": 0, "sent": 0, "dropped": 0}
+        loop = asyncio.get_running_loop()
+        for index in range(self.spec.devices):
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: AgentProtocol(self.spec.device_table(index), self.spec, self.spec.is_dead(index), self.stats),
+                local_addr=(self.spec.host(index), AGENT_PORT)
+            )
+            self.addCleanup(transport.close)
+        self.addCleanup(Core.updated)
+
+    def sweep(self, networks, window=4, **request) -> DiscoverySweep:
+        return DiscoverySweep(DiscoveryRequest(networks=networks, port=AGENT_PORT, **request), window, 0.3, 0)
+
+    async def test_responders_are_found_within_window(self):
+        sweep = self.sweep(["127.1.0.0/29"])
+        with contextlib.redirect_stdout(io.StringIO()):
+            found = await sweep.run()
+
+        self.assertEqual([el["host"] for el in found], ["127.1.0.1", "127.1.0.2"])
+        self.assertEqual(found[0]["sys_object_id"], "1.3.6.1.4.1.8072.3.2.10")
+        self.assertEqual(found[0]["sys_descr"], "synthetic switch 127.1.0.1")
+        self.assertEqual((sweep.total, sweep.probed, sweep.max_in_flight), (6, 6, 4))
+        self.assertEqual(self.stats["received"], 3)
+
+    async def test_wrong_community_finds_nothing(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            found = await self.sweep(["127.1.0.1/32", "127.1.0.2"], community="private").run()
+        self.assertEqual(found, [])
+        self.assertEqual(self.stats["sent"], 0)
+
+    def test_networks_are_checked(self):
+        self.assertEqual([str(el) for el in sweep_networks(["10.0.0.0/23", "10.0.1.0/24", "10.0.2.7/22"])],
+                         ["10.0.0.0/22"])
+        with self.assertRaises(ValueError):
+            sweep_networks(["10.0.0.300/24"])
+        with self.assertRaises(ValueError):
+            sweep_networks(["10.0.0.0/8"])
+
+    async def test_new_responders_are_registered_in_bulk(self):
+        inserted = []
+
+        async def insert_many(collection, documents):
+            inserted.extend(documents)
+            return InsertResult(documents)
+
+        with mock.patch("app.core.discovery.motorchik.find", return_value=_Cursor([{"host": "127.1.0.1"}])), \
+                mock.patch("app.core.discovery.motorchik.unique_confirmed", return_value=True), \
+                mock.patch("app.core.discovery.motorchik.insert_many", side_effect=insert_many), \
+                contextlib.redirect_stdout(io.StringIO()):
+            discovery = Discovery()
+            sweep = discovery.start(DiscoveryRequest(networks=["127.1.0.0/30"], port=AGENT_PORT))
+            self.assertTrue(discovery.is_running())
+            with self.assertRaises(RuntimeError):
+                discovery.start(DiscoveryRequest(networks=["127.1.0.0/30"], port=AGENT_PORT))
+            await discovery.wait()
+
+        # 127.1.0.1 уже в devices
+        self.assertEqual([device.host for device in inserted], ["127.1.0.2"])
+        self.assertEqual(inserted[0].macs_oid_start, STANDARD_OIDS["macs_oid_start"])
+        self.assertEqual(inserted[0].port, AGENT_PORT)
+        status = sweep.status()
+        self.assertEqual((status["running"], status["registered"], len(status["found"])), (False, 1, 2))
+        self.assertTrue(Core.is_in_progress())
+
+    async def test_race_on_unique_host_is_counted(self):
+        sweep = self.sweep(["127.1.0.0/30"])
+        error = BulkWriteError({"nInserted": 1, "writeErrors": [{"code": 11000}]})
+        with mock.patch("app.core.discovery.motorchik.find", return_value=_Cursor([])), \
+                mock.patch("app.core.discovery.motorchik.unique_confirmed", return_value=True), \
+                mock.patch("app.core.discovery.motorchik.insert_many", side_effect=error), \
+                contextlib.redirect_stdout(io.StringIO()):
+            await sweep.run()
+            self.assertEqual(await sweep.register(), 1)
+
+    async def test_without_unique_index_each_host_is_checked(self):
+        sweep = self.sweep(["127.1.0.0/30"])
+        # 127.1.0.2 добавили, пока шел перебор
+        find_one = mock.AsyncMock(side_effect=[None, {"_id": 1}])
+        insert_one = mock.AsyncMock()
+        with mock.patch("app.core.discovery.motorchik.find", return_value=_Cursor([])), \
+                mock.patch("app.core.discovery.motorchik.unique_confirmed", return_value=False), \
+                mock.patch("app.core.discovery.motorchik.find_one", find_one), \
+                mock.patch("app.core.discovery.motorchik.insert_one", insert_one), \
+                contextlib.redirect_stdout(io.StringIO()):
+            await sweep.run()
+            self.assertEqual(await sweep.register(), 1)
+        self.assertEqual(insert_one.call_args[0][1].host, "127.1.0.1")
+
+
+if __name__ == '__main__':
+    unittest.main()
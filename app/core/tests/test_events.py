@@ -0,0 +1,129 @@
+import asyncio
+import json
+import unittest
+
+from app.core.core import CoreManager
+from app.core.events import EventHub, diff_snapshots, event_hub, sse_message
+from app.core.fdb_store import FdbStore, FdbTable, mac_to_int
+from app.core.models import DeviceInfo, PortInfo
+from app.core.snapshot import TopologySnapshot
+
+
+def make_snapshot(version, devices, mac_ip_dict=None, tree=None):
+    """ devices: {host: (DeviceInfo, FdbTable)} """
+    return TopologySnapshot(
+        version=version, device_dict={host: dev for host, (dev, _) in devices.items()}, device_arp={},
+        mac_ip_dict=mac_ip_dict or {}, device_tree=tree or {},
+        fdb=FdbStore({host: table for host, (_, table) in devices.items()}), ip_index={}, unreachable=[]
+    )
+
+
+def make_device(host, ports):
+    return (
+        DeviceInfo(host=host, ports={port: PortInfo(name="gi" + port) for port in ports}),
+        FdbTable.from_dict(ports)
+    )
+
+
+class TestDiffSnapshots(unittest.TestCase):
+    def test_mac_events(self):
+        old = make_snapshot(1, {"10.0.0.1": make_device("10.0.0.1", {
+            "1": {"00:0a:00:00:00:01": "10", "00:0a:00:00:00:02": "10"},
+        })})
+        new = make_snapshot(2, {"10.0.0.1": make_device("10.0.0.1", {
+            "1": {"00:0a:00:00:00:01": "10"},
+            "2": {"00:0a:00:00:00:03": "20", "00:0a:00:00:00:02": "10"},
+        })}, mac_ip_dict={mac_to_int("00:0a:00:00:00:03"): ["10.0.0.53"]})
+
+        events = sorted(diff_snapshots(old, new), key=lambda e: e["type"])
+        self.assertEqual(events, [
+            {"type": "mac_added", "host": "10.0.0.1", "port": "2", "mac": "00:0a:00:00:00:03",
+             "vlan": "20", "ips": ["10.0.0.53"]},
+            {"type": "mac_moved", "host": "10.0.0.1", "mac": "00:0a:00:00:00:02", "vlan": "10",
+             "from_port": "1", "to_port": "2"},
+        ])
+
+    def test_mac_in_several_vlans(self):
+        mac = mac_to_int("00:0a:00:00:00:01")
+
+        def device(*rows):
+            table = FdbTable()
+            for port, vlan in rows:
+                table.add(port, mac, vlan)
+            return DeviceInfo(host="10.0.0.1", ports={"1": PortInfo(name="gi1"), "2": PortInfo(name="gi2")}), table
+
+        old = make_snapshot(1, {"10.0.0.1": device(("1", 10), ("2", 20))})
+        # в VLAN 20 MAC переехал, в VLAN 10 стоит на месте, в VLAN 30 появился
+        new = make_snapshot(2, {"10.0.0.1": device(("1", 10), ("1", 20), ("2", 30))})
+        events = sorted(diff_snapshots(old, new), key=lambda e: e["type"])
+        self.assertEqual(events, [
+            {"type": "mac_added", "host": "10.0.0.1", "port": "2", "mac": "00:0a:00:00:00:01", "vlan": "30",
+             "ips": []},
+            {"type": "mac_moved", "host": "10.0.0.1", "mac": "00:0a:00:00:00:01", "vlan": "20",
+             "from_port": "2", "to_port": "1"},
+        ])
+
+        events = diff_snapshots(new, make_snapshot(3, {"10.0.0.1": device(("1", 10), ("1", 20))}))
+        self.assertEqual(events, [
+            {"type": "mac_removed", "host": "10.0.0.1", "port": "2", "mac": "00:0a:00:00:00:01", "vlan": "30"},
+        ])
+
+    def test_devices_and_tree(self):
+        same = make_device("10.0.0.1", {"1": {"00:0a:00:00:00:01": "10"}})
+        old = make_snapshot(1, {"10.0.0.1": same, "10.0.0.2": make_device("10.0.0.2", {})})
+        new = make_snapshot(2, {"10.0.0.1": same, "10.0.0.3": make_device("10.0.0.3", {})},
+                            tree={"10.0.0.1": {"host": "10.0.0.1"}})
+
+        events = diff_snapshots(old, new)
+        self.assertEqual([e["type"] for e in events], ["device_unreachable", "device_added", "tree"])
+        self.assertEqual(events[0]["host"], "10.0.0.2")
+        self.assertEqual(events[1]["device"]["host"], "10.0.0.3")
+
+    def test_no_changes(self):
+        old = make_snapshot(1, {"10.0.0.1": make_device("10.0.0.1", {"1": {"00:0a:00:00:00:01": "10"}})})
+        new = make_snapshot(2, {"10.0.0.1": make_device("10.0.0.1", {"1": {"00:0a:00:00:00:01": "10"}})})
+        self.assertEqual(diff_snapshots(old, new), [])
+
+
+class TestEventHub(unittest.IsolatedAsyncioTestCase):
+    async def test_publish_and_overflow(self):
+        hub = EventHub(queue_size=2)
+        fast, slow = hub.subscribe(), hub.subscribe()
+
+        hub.publish("diff", {"version": 1})
+        self.assertEqual(await fast.get(), ("diff", {"version": 1}))
+        hub.publish("diff", {"version": 2})
+        self.assertEqual(await fast.get(), ("diff", {"version": 2}))
+        hub.publish("diff", {"version": 3})
+
+        # медленный подписчик переполнился: вместо пропущенных diff - один resync
+        self.assertEqual(slow.qsize(), 1)
+        self.assertEqual(await slow.get(), ("resync", {"version": 3}))
+        self.assertEqual(await fast.get(), ("diff", {"version": 3}))
+
+        hub.unsubscribe(slow)
+        self.assertEqual(len(hub), 1)
+
+    async def test_core_publish_sends_diff(self):
+        CoreManager.snapshot = make_snapshot(5, {})
+        queue = event_hub.subscribe()
+        try:
+            CoreManager.publish(make_snapshot(6, {"10.0.0.1": make_device("10.0.0.1", {})}))
+            event, data = await asyncio.wait_for(queue.get(), 1)
+        finally:
+            event_hub.unsubscribe(queue)
+            CoreManager.snapshot = TopologySnapshot.empty()
+
+        self.assertEqual(event, "diff")
+        self.assertEqual((data["version"], data["prev_version"]), (6, 5))
+        self.assertEqual([e["type"] for e in data["events"]], ["device_added"])
+
+    def test_sse_message(self):
+        message = sse_message("diff", {"version": 7}, 7).decode()
+        self.assertEqual(message.splitlines()[:2], ["event: diff", "id: 7"])
+        self.assertEqual(json.loads(message.splitlines()[2][len("data: "):]), {"version": 7})
+        self.assertTrue(message.endswith("\n\n"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from app.core.fdb_store import FdbStore, FdbTable, int_to_mac, mac_to_int
+
+
+class TestFdbStore(unittest.TestCase):
+    def setUp(self):
+        self.ports = {
+            "1": {"00:0a:00:00:00:01": "10", "ff:ff:ff:ff:ff:fe": "4094"},
+            "49": {"00:0b:00:00:00:01": "20"},
+        }
+        self.store = FdbStore({
+            "10.0.0.1": FdbTable.from_dict(self.ports),
+            "10.0.0.2": FdbTable.from_dict({"7": {"00:0a:00:00:00:01": "10"}}),
+        })
+
+    def test_mac_conversion(self):
+        self.assertEqual(mac_to_int("00:0A:00:00:00:01"), 0x000a00000001)
+        self.assertEqual(mac_to_int("00-0a-00-00-00-01"), 0x000a00000001)
+        self.assertEqual(int_to_mac(0xffffffffffff), "ff:ff:ff:ff:ff:ff")
+        self.assertEqual(int_to_mac(1), "00:00:00:00:00:01")
+
+    def test_table_round_trip(self):
+        table = self.store.tables["10.0.0.1"]
+        self.assertEqual(table.to_dict(), self.ports)
+        self.assertEqual(table.port_counts(), {"1": 2, "49": 1})
+        self.assertEqual(len(table), 3)
+
+    def test_lookup(self):
+        mac = mac_to_int("00:0a:00:00:00:01")
+        self.assertEqual(sorted(self.store.lookup(mac)), [("10.0.0.1", "1", 10), ("10.0.0.2", "7", 10)])
+        self.assertIn(mac, self.store)
+        self.assertNotIn(mac_to_int("00:0a:00:00:00:02"), self.store)
+        self.assertEqual(self.store.lookup(mac_to_int("00:0a:00:00:00:02")), [])
+        self.assertEqual(len(list(self.store.unique_macs())), 3)
+        self.assertEqual(self.store.port_count("10.0.0.1", "49"), 1)
+        self.assertEqual(self.store.port_count("10.0.0.9", "1"), 0)
+
+    def test_fdb_id_above_16_bits(self):
+        # dot1qFdbId - Unsigned32, у некоторых коммутаторов FDB id больше 65535
+        table = FdbTable()
+        table.add("1", mac_to_int("00:0a:00:00:00:01"), 70000)
+        table.add("1", mac_to_int("00:0a:00:00:00:02"), 2 ** 32 - 1)
+        self.assertEqual(table.to_dict(), {"1": {"00:0a:00:00:00:01": "70000", "00:0a:00:00:00:02": "4294967295"}})
+
+    def test_memory_per_entry(self):
+        tables = {}
+        for host_id in range(100):
+            table = tables["10.0.{}.1".format(host_id)] = FdbTable()
+            for i in range(1000):
+                table.add(str(i % 48 + 1), (host_id << 24) + i, i % 4094 + 1)
+        usage = FdbStore(tables).memory_usage()
+
+        self.assertEqual(usage["entries"], 100000)
+        # 14 байт в таблице устройства + 14 в индексе, имена портов - копейки
+        self.assertLess(usage["bytes_per_entry"], 32)
+
+
+if __name__ == '__main__':
+    unittest.main()
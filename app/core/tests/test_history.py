@@ -0,0 +1,176 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from app.core import router_core
+from app.core.fdb_store import FdbStore, FdbTable, mac_to_int
+from app.core.history import MacHistory
+from app.core.models import DeviceInfo
+from app.core.snapshot import TopologySnapshot
+from app.core.tests.test_router_core import make_client
+from app.settings import settings
+
+PC_MAC = "00:0a:00:00:00:01"
+T0 = datetime(2024, 5, 14, 10, 0)
+
+
+def snapshot_at(minutes: int, fdb: dict, polled=("10.0.0.1", "10.0.0.2")) -> TopologySnapshot:
+    """ fdb: {host: {port: {mac: vlan}}} """
+    snapshot = TopologySnapshot(
+        version=minutes, device_dict={host: DeviceInfo(host=host) for host in polled}, device_arp={},
+        mac_ip_dict={mac_to_int(PC_MAC): ["10.0.0.50"]}, device_tree={},
+        fdb=FdbStore({host: FdbTable.from_dict(ports) for host, ports in fdb.items()}), ip_index={}, unreachable=[]
+    )
+    snapshot.timestamp = (T0 + timedelta(minutes=minutes)).replace(tzinfo=timezone.utc)
+    return snapshot
+
+
+def _match(doc: dict, find_filter: dict) -> bool:
+    for field, cond in find_filter.items():
+        value = doc.get(field)
+        if isinstance(cond, dict):
+            if "$lte" in cond and not value <= cond["$lte"] or "$gte" in cond and not value >= cond["$gte"]:
+                return False
+        elif isinstance(value, list):
+            if cond not in value:
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, field, direction):
+        self.docs = sorted(self.docs, key=lambda doc: doc[field], reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self.docs = self.docs[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeHistoryEngine:
+    """ Коллекция истории в списке: upsert по фильтру, $set/$max/$addToSet """
+
+    def __init__(self):
+        self.docs = []
+        self.bulk_calls = 0
+
+    def declare_index(self, collection, keys, **kwargs):
+        pass
+
+    async def bulk_write(self, collection, requests, ordered=False):
+        self.bulk_calls += 1
+        for request in requests:
+            doc = next((doc for doc in self.docs if _match(doc, request._filter)), None)
+            if doc is None:
+                doc = dict(request._filter)
+                self.docs.append(doc)
+            update = request._doc
+            doc.update(update.get("$set", {}))
+            for field, value in update.get("$max", {}).items():
+                doc[field] = max(doc.get(field, value), value)
+            for field, value in update.get("$addToSet", {}).items():
+                doc.setdefault(field, [])
+                doc[field].extend(el for el in value["$each"] if el not in doc[field])
+
+    def find(self, collection, find_filter, projection=None, batch_size=None):
+        return FakeCursor([doc for doc in self.docs if _match(doc, find_filter)])
+
+    async def iterate(self, collection, find_filter, projection=None, batch_size=None):
+        for doc in self.docs:
+            if _match(doc, find_filter):
+                yield doc
+
+
+class TestMacHistory(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.history = MacHistory(FakeHistoryEngine(), write_interval=600, retention_days=30)
+
+    async def test_steady_mac_is_written_once_per_interval(self):
+        self.assertEqual(await self.history.record(snapshot_at(0, {"10.0.0.1": {"1": {PC_MAC: "10"}}})), 1)
+        self.assertEqual(await self.history.record(snapshot_at(5, {"10.0.0.1": {"1": {PC_MAC: "10"}}})), 0)
+        self.assertEqual(await self.history.record(snapshot_at(10, {"10.0.0.1": {"1": {PC_MAC: "10"}}})), 1)
+
+        docs = self.history.engine.docs
+        self.assertEqual(len(docs), 1)
+        self.assertEqual((docs[0]["first_seen"], docs[0]["last_seen"]), (T0, T0 + timedelta(minutes=10)))
+        self.assertEqual(docs[0]["ips"], ["10.0.0.50"])
+
+    async def test_move_closes_stint_with_real_last_seen(self):
+        await self.history.record(snapshot_at(0, {"10.0.0.1": {"1": {PC_MAC: "10"}}}))
+        await self.history.record(snapshot_at(5, {"10.0.0.1": {"1": {PC_MAC: "10"}}}))
+        await self.history.record(snapshot_at(7, {"10.0.0.2": {"3": {PC_MAC: "10"}}}))
+
+        moves = await self.history.moves(mac_to_int(PC_MAC))
+        self.assertEqual([(el["host"], el["port"]) for el in moves], [("10.0.0.2", "3"), ("10.0.0.1", "1")])
+        self.assertEqual(moves[1]["last_seen"], (T0 + timedelta(minutes=5)).isoformat())
+
+        where = await self.history.at(mac_to_int(PC_MAC), T0 + timedelta(minutes=2))
+        self.assertEqual([el["host"] for el in where], ["10.0.0.1"])
+        self.assertEqual(await self.history.at(mac_to_int(PC_MAC), T0 - timedelta(minutes=1)), [])
+
+    async def test_unreachable_device_keeps_stint_open(self):
+        await self.history.record(snapshot_at(0, {"10.0.0.1": {"1": {PC_MAC: "10"}}}))
+        await self.history.record(snapshot_at(5, {}, polled=("10.0.0.2",)))
+        self.assertEqual(len(self.history.open), 1)
+
+        await self.history.record(snapshot_at(6, {}))
+        self.assertEqual(self.history.open, {})
+
+    async def test_restart_resumes_open_stints(self):
+        await self.history.record(snapshot_at(0, {"10.0.0.1": {"1": {PC_MAC: "10"}}}))
+
+        restarted = MacHistory(self.history.engine, write_interval=600, retention_days=30)
+        await restarted.record(snapshot_at(10, {"10.0.0.1": {"1": {PC_MAC: "10"}}}))
+        self.assertEqual(len(restarted.engine.docs), 1)
+        self.assertEqual(restarted.engine.docs[0]["last_seen"], T0 + timedelta(minutes=10))
+
+
+class TestHistoryEndpoint(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.history = MacHistory(FakeHistoryEngine(), write_interval=600, retention_days=30)
+        await self.history.record(snapshot_at(0, {"10.0.0.1": {"1": {PC_MAC: "10"}}}))
+        await self.history.record(snapshot_at(30, {"10.0.0.2": {"3": {PC_MAC: "10"}}}))
+        patcher = mock.patch.object(router_core, "mac_history", self.history)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = make_client()
+
+    def test_location_at_time(self):
+        res = self.client.post("/core/history/", json={"query": PC_MAC, "at": "2024-05-14T13:10:00+03:00"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([el["host"] for el in res.json()["locations"]], ["10.0.0.1"])
+
+    def test_moves_by_ip(self):
+        res = self.client.post("/core/history/", json={"query": "10.0.0.50"})
+        self.assertEqual([el["host"] for el in res.json()["history"]], ["10.0.0.2", "10.0.0.1"])
+
+    def test_bad_query(self):
+        self.assertEqual(self.client.post("/core/history/", json={"query": "nope"}).status_code, 400)
+        self.assertEqual(self.client.post("/core/history/", json={"query": PC_MAC, "at": "yesterday"}).status_code, 400)
+
+    def test_limit_is_checked_and_capped(self):
+        for limit in ("abc", -1, 0, None):
+            self.assertEqual(self.client.post("/core/history/", json={"query": PC_MAC, "limit": limit}).status_code, 400)
+        with mock.patch.object(self.history, "moves", mock.AsyncMock(return_value=[])) as moves:
+            res = self.client.post("/core/history/", json={"query": PC_MAC, "limit": 10 ** 9})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(moves.call_args.kwargs["limit"], settings.HISTORY_MAX_LIMIT)
+
+
+if __name__ == '__main__':
+    unittest.main()
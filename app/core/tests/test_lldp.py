@@ -0,0 +1,84 @@
+import unittest
+from unittest import mock
+
+from app.core import core
+from app.core.core import CoreManager
+from app.core.snapshot import TopologySnapshot
+from app.core.tests.fake_device import FakeFleet, device_data, devices_collection
+from app.snmp.tests.test_oid_query import FakeAgent
+
+CORE_MAC = "00:00:00:00:00:01"
+DIST_MAC = "00:00:00:00:00:02"
+ACCESS_MAC = "00:00:00:00:00:03"
+PC_MAC = "00:0a:00:00:00:01"
+
+
+def make_fleet(access_lldp=None):
+    """
+    core:1 - dist:4 по LLDP, dist:2 - access:3.
+    У access LLDP нет (если не задан access_lldp), его место - только по FDB.
+    """
+    return FakeFleet({
+        "10.0.0.1": FakeAgent(device_data(
+            "10.0.0.1", CORE_MAC, fdb=[(DIST_MAC, 1, 1), (ACCESS_MAC, 1, 1), (PC_MAC, 1, 1)],
+            lldp=[(1, DIST_MAC, 4, "10.0.0.2")]
+        )),
+        "10.0.0.2": FakeAgent(device_data(
+            "10.0.0.2", DIST_MAC, fdb=[(CORE_MAC, 1, 4), (ACCESS_MAC, 1, 2)],
+            lldp=[(4, CORE_MAC, 1, "")] + ([(2, ACCESS_MAC, 3, "")] if access_lldp else [])
+        )),
+        "10.0.0.3": FakeAgent(device_data(
+            "10.0.0.3", ACCESS_MAC, fdb=[(CORE_MAC, 1, 3)], lldp=access_lldp
+        )),
+    })
+
+
+class TestLldpTopology(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        CoreManager.snapshot = TopologySnapshot.empty()
+        CoreManager.fingerprints, CoreManager.poll_stats = ({}, {})
+        patcher = mock.patch.object(core.settings, "POLL_LLDP", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def poll(self, fleet) -> TopologySnapshot:
+        self.addCleanup(fleet.patch())
+        with devices_collection("10.0.0.1", "10.0.0.2", "10.0.0.3"), \
+                mock.patch.object(core, "search_mac_address", wraps=core.search_mac_address) as search:
+            await CoreManager.update_device_tree()
+        self.searched = sorted(call.args[0]["ip"] for call in search.call_args_list)
+        return CoreManager.snapshot
+
+    async def test_neighbors_are_collected(self):
+        snapshot = await self.poll(make_fleet())
+        neighbor = snapshot.device_dict["10.0.0.1"].lldp[0]
+        self.assertEqual((neighbor.port, neighbor.chassis_id, neighbor.port_id, neighbor.mgmt_ip),
+                         ("1", DIST_MAC, "gi4", "10.0.0.2"))
+        self.assertEqual(snapshot.device_dict["10.0.0.3"].lldp, [])
+
+    async def test_fdb_only_for_devices_without_lldp(self):
+        tree = (await self.poll(make_fleet())).device_tree
+
+        # access ищется по FDB, ядро - чтобы найти аплинки; dist известен по LLDP
+        self.assertEqual(self.searched, ["10.0.0.1", "10.0.0.3"])
+        dist = tree["10.0.0.1"]["ports"]["1"]["uplink"]["10.0.0.2"]
+        self.assertEqual(list(dist["ports"]["2"]["uplink"]), ["10.0.0.3"])
+        self.assertEqual(dist["ports"]["2"]["port_name"], "gi2")
+
+    async def test_full_lldp_skips_fdb_search(self):
+        tree = (await self.poll(make_fleet(access_lldp=[(3, DIST_MAC, 2, "10.0.0.2")]))).device_tree
+
+        self.assertEqual(self.searched, [])
+        dist = tree["10.0.0.1"]["ports"]["1"]["uplink"]["10.0.0.2"]
+        self.assertEqual(list(dist["ports"]["2"]["uplink"]), ["10.0.0.3"])
+
+    async def test_lldp_can_be_turned_off(self):
+        with mock.patch.object(core.settings, "POLL_LLDP", False):
+            snapshot = await self.poll(make_fleet())
+        self.assertEqual(snapshot.device_dict["10.0.0.1"].lldp, [])
+        self.assertEqual(self.searched, ["10.0.0.1", "10.0.0.2", "10.0.0.3"])
+        self.assertIn("10.0.0.2", snapshot.device_tree["10.0.0.1"]["ports"]["1"]["uplink"])
+
+
+if __name__ == '__main__':
+    unittest.main()
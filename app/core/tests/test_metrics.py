@@ -0,0 +1,151 @@
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from prometheus_client import CollectorRegistry, generate_latest
+
+from app import metrics
+from app.core import core
+from app.core.core import CoreManager, record_cycle
+from app.core.snapshot import TopologySnapshot
+from app.core.tests.fake_device import devices_collection
+from app.core.tests.test_snapshot import make_fleet
+from app.metrics import GaugeCallback, MetricsMiddleware, registry, render, router
+from app.settings import BASE_DIR, settings
+
+
+def sample(name: str, **labels) -> float:
+    return registry.get_sample_value(name, {key: str(value) for key, value in labels.items()}) or 0
+
+
+class TestRegistry(unittest.TestCase):
+    def test_gauge_callbacks_are_read_on_scrape(self):
+        test_registry = CollectorRegistry()
+        values = {"a": 1}
+        test_registry.register(GaugeCallback("pool", "pool", lambda: values, "stat"))
+        test_registry.register(GaugeCallback("leader", "leader", lambda: None))
+
+        def broken():
+            raise KeyError("gone")
+        test_registry.register(GaugeCallback("broken", "broken", broken))
+
+        values["b"] = 2
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            text = generate_latest(test_registry).decode()
+        self.assertIn('pool{stat="a"} 1.0\npool{stat="b"} 2.0\n', text)
+        self.assertNotIn("leader", text)
+        self.assertIn("metrics broken", out.getvalue())
+
+    def test_shard_processes_are_summed(self):
+        """ Многопроцессный режим: два процесса пишут счетчики в общий каталог, render() их складывает """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        script = (
+            "from app.snmp.oid_query import SNMP_PDUS; from app.snmp.decode import PARSE_SECONDS; "
+            "SNMP_PDUS.labels(kind='bulk').inc(2); PARSE_SECONDS.labels(function='decode_arp').observe(0.001)"
+        )
+        for _ in range(2):
+            subprocess.run([sys.executable, "-c", script], check=True, capture_output=True, cwd=BASE_DIR,
+                           env=dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory))
+
+        with mock.patch.object(metrics, "MULTIPROC_DIR", directory):
+            text = render().decode()
+        self.assertIn('netviewer_snmp_pdus_total{kind="bulk"} 4.0\n', text)
+        self.assertIn('netviewer_parse_duration_seconds_count{function="decode_arp"} 2.0\n', text)
+        # значения основного процесса - тоже в выдаче
+        self.assertIn('netviewer_snapshot{stat="version"}', text)
+
+
+class TestPollMetrics(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        CoreManager.snapshot = TopologySnapshot.empty()
+        CoreManager.fingerprints, CoreManager.poll_stats = ({}, {})
+        self.addCleanup(setattr, CoreManager, "snapshot", TopologySnapshot.empty())
+
+    async def test_cycle_is_instrumented(self):
+        pdus = sample("netviewer_snmp_pdus_total", kind="bulk")
+        walked = sample("netviewer_poll_devices_total", result="walked")
+        macs = sample("netviewer_walk_duration_seconds_count", table="macs")
+        parsed = sample("netviewer_parse_duration_seconds_count", function="decode_mac_vlan_port")
+
+        self.addCleanup(make_fleet().patch())
+        with devices_collection("10.0.0.1", "10.0.0.2"), contextlib.redirect_stdout(io.StringIO()):
+            await CoreManager.update_device_tree()
+
+        self.assertGreater(sample("netviewer_snmp_pdus_total", kind="bulk"), pdus)
+        self.assertEqual(sample("netviewer_poll_devices_total", result="walked") - walked, 2)
+        self.assertEqual(sample("netviewer_walk_duration_seconds_count", table="macs") - macs, 2)
+        self.assertEqual(sample("netviewer_parse_duration_seconds_count", function="decode_mac_vlan_port") - parsed, 2)
+        self.assertEqual(sorted(core.slowest_devices), ["10.0.0.1", "10.0.0.2"])
+
+        text = render().decode()
+        self.assertIn('netviewer_snapshot{stat="devices"} 2.0\n', text)
+        self.assertIn('netviewer_poll_cycle_seconds_count{phase="build"}', text)
+
+    def test_thousand_devices_stay_cheap(self):
+        class Scheduler:
+            cycle_time, timeouts = (30.0, 3)
+            durations = {"10.1.{}.{}".format(i // 250, i % 250): i / 1000 for i in range(1000)}
+
+        record_cycle(Scheduler)
+        self.assertEqual(len(core.slowest_devices), 20)
+        self.assertEqual(sample("netviewer_device_poll_slowest_seconds", device="10.1.3.249"), 0.999)
+
+        started = time.perf_counter()
+        text = render().decode()
+        self.assertLess(time.perf_counter() - started, 0.1)
+        self.assertLess(len(text.splitlines()), 1000)
+
+
+class TestMiddleware(unittest.TestCase):
+    def test_latency_by_route_template(self):
+        app = FastAPI()
+
+        @app.get("/items/{item}")
+        async def item(item: int):
+            if item == 0:
+                raise HTTPException(status_code=404)
+            return {"item": item}
+
+        app.add_middleware(MetricsMiddleware)
+        app.include_router(router)
+        client = TestClient(app)
+
+        before = sample("netviewer_http_request_duration_seconds_count", method="GET", route="/items/{item}", status=200)
+        for i in range(1, 4):
+            self.assertEqual(client.get("/items/{}".format(i)).status_code, 200)
+        client.get("/items/0")
+        client.get("/nowhere/1")
+
+        requests = "netviewer_http_request_duration_seconds_count"
+        self.assertEqual(sample(requests, method="GET", route="/items/{item}", status=200) - before, 3)
+        self.assertGreaterEqual(sample(requests, method="GET", route="/items/{item}", status=404), 1)
+        self.assertGreaterEqual(sample(requests, method="GET", route="unmatched", status=404), 1)
+
+        response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn('route="/items/{item}"', response.text)
+
+    def test_token_is_required_when_set(self):
+        app = FastAPI()
+        app.include_router(router)
+        client = TestClient(app)
+
+        with mock.patch.object(settings, "METRICS_TOKEN", "s3cret"):
+            self.assertEqual(client.get("/metrics").status_code, 401)
+            self.assertEqual(client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code, 401)
+            self.assertEqual(client.get("/metrics", headers={"Authorization": "Bearer s3cret"}).status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import gzip
+import importlib.util
+import io
+import json
+import unittest
+from unittest import mock
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pymongo.errors import DuplicateKeyError
+
+from app.auth.auth import get_current_user
+from app.core.core import CoreManager
+from app.core.fdb_store import FdbStore, FdbTable, mac_to_int
+from app.core.models import DeviceInfo, NewDevice, PortInfo
+from app.core.router_core import router
+from app.core.snapshot import TopologySnapshot
+
+
+def make_client() -> TestClient:
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_current_user] = lambda: {"login": "admin", "password": ""}
+    return TestClient(app)
+
+
+def publish_snapshot(version: int = 1):
+    devices = {"10.0.0.1": DeviceInfo(host="10.0.0.1", ports={"1": PortInfo(name="gi1")})}
+    mac = mac_to_int("00:0a:00:00:00:01")
+    CoreManager.publish(TopologySnapshot(
+        version=version, device_dict=devices, device_arp={}, mac_ip_dict={mac: ["10.0.0.50"]}, device_tree={},
+        fdb=FdbStore({"10.0.0.1": FdbTable.from_dict({"1": {"00:0a:00:00:00:01": "10"}})}),
+        ip_index={"10.0.0.50": mac}, unreachable=[]
+    ))
+
+
+class TestGetPlace(unittest.TestCase):
+    def setUp(self):
+        publish_snapshot()
+        self.client = make_client()
+
+    def test_payload_and_etag(self):
+        res = self.client.get("/core/get_place", headers={"Accept-Encoding": "identity"})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("content-encoding", res.headers)
+        self.assertEqual(res.json()["devices"]["10.0.0.1"]["ports"]["1"]["macs"], {"00:0a:00:00:00:01": "10"})
+        self.assertEqual(res.json()["version"], 1)
+        self.assertTrue(res.headers["etag"].startswith('"1-'))
+
+    def test_gzip(self):
+        res = self.client.get("/core/get_place", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(res.headers["content-encoding"], "gzip")
+        self.assertEqual(res.json()["macs"], {"00:0a:00:00:00:01": ["10.0.0.50"]})
+        self.assertEqual(gzip.decompress(CoreManager.snapshot.payload_gzip), CoreManager.snapshot.payload)
+        self.assertEqual(res.headers["etag"], CoreManager.snapshot.etag_gzip)
+        self.assertNotEqual(CoreManager.snapshot.etag_gzip, CoreManager.snapshot.etag)
+
+    def test_gzip_refused_by_q_value(self):
+        for accept in ("gzip;q=0", "gzip; q=0.0, identity", "*;q=0", "br, deflate"):
+            res = self.client.get("/core/get_place", headers={"Accept-Encoding": accept})
+            self.assertNotIn("content-encoding", res.headers, accept)
+            self.assertEqual(res.headers["etag"], CoreManager.snapshot.etag)
+        for accept in ("gzip;q=0.5", "deflate, *", "GZIP"):
+            res = self.client.get("/core/get_place", headers={"Accept-Encoding": accept})
+            self.assertEqual(res.headers["content-encoding"], "gzip", accept)
+
+    def test_not_modified_for_either_encoding(self):
+        snapshot = CoreManager.snapshot
+        for etag in (snapshot.etag, snapshot.etag_gzip, "W/" + snapshot.etag):
+            res = self.client.get("/core/get_place", headers={"If-None-Match": etag, "Accept-Encoding": "gzip"})
+            self.assertEqual(res.status_code, 304)
+            # 304 называет вариант, который получил бы клиент
+            self.assertEqual(res.headers["etag"], snapshot.etag_gzip)
+
+    def test_not_modified_until_next_snapshot(self):
+        etag = self.client.get("/core/get_place").headers["etag"]
+
+        res = self.client.get("/core/get_place", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.content, b"")
+
+        publish_snapshot(version=2)
+        res = self.client.get("/core/get_place", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["etag"], etag)
+        self.assertEqual(json.loads(res.content)["version"], 2)
+
+
+class TestAddDevice(unittest.TestCase):
+    def setUp(self):
+        self.device = NewDevice.model_config["json_schema_extra"]["examples"][0]
+        self.client = make_client()
+
+    def test_inserted_without_lookup(self):
+        insert = mock.AsyncMock(return_value=mock.Mock(inserted_id="abc"))
+        with mock.patch("app.core.router_core.motorchik.insert_one", insert), \
+                mock.patch("app.core.router_core.motorchik.unique_confirmed", return_value=True), \
+                mock.patch("app.core.router_core.motorchik.find_one") as find_one:
+            res = self.client.post("/core/add_device", json=self.device)
+        self.assertEqual(res.json(), {"status": "ok", "inserted_id": "abc"})
+        find_one.assert_not_called()
+
+    def test_duplicate_host_is_conflict(self):
+        insert = mock.AsyncMock(side_effect=DuplicateKeyError("E11000 duplicate key"))
+        with mock.patch("app.core.router_core.motorchik.insert_one", insert), \
+                mock.patch("app.core.router_core.motorchik.unique_confirmed", return_value=True):
+            res = self.client.post("/core/add_device", json=self.device)
+        self.assertEqual(res.status_code, 409)
+
+    def test_lookup_until_index_is_confirmed(self):
+        insert = mock.AsyncMock()
+        find_one = mock.AsyncMock(return_value={"_id": "abc"})
+        with mock.patch("app.core.router_core.motorchik.insert_one", insert), \
+                mock.patch("app.core.router_core.motorchik.unique_confirmed", return_value=False), \
+                mock.patch("app.core.router_core.motorchik.find_one", find_one):
+            res = self.client.post("/core/add_device", json=self.device)
+        self.assertEqual(res.status_code, 409)
+        insert.assert_not_called()
+
+
+class TestSearch(unittest.TestCase):
+    def test_search_answers_from_snapshot(self):
+        publish_snapshot()
+        res = make_client().post("/core/search/", json={"query": "10.0.0.50"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["10.0.0.50"]["devices"]["10.0.0.1"]["port_name"], "gi1")
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        publish_snapshot()
+        self.client = make_client()
+        self.row = {
+            "device": "10.0.0.1", "port": "1", "port_name": "gi1",
+            "mac": "00:0a:00:00:00:01", "vlan": "10", "ip": "10.0.0.50",
+        }
+
+    def test_ndjson(self):
+        res = self.client.get("/core/export", params={"fmt": "ndjson"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([json.loads(line) for line in res.text.splitlines()], [self.row])
+
+    def test_csv(self):
+        res = self.client.get("/core/export", params={"fmt": "csv"})
+        self.assertEqual(res.text.splitlines(), [
+            "device,port,port_name,mac,vlan,ip",
+            "10.0.0.1,1,gi1,00:0a:00:00:00:01,10,10.0.0.50",
+        ])
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow не установлен")
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+
+        res = self.client.get("/core/export", params={"fmt": "parquet"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(pq.read_table(io.BytesIO(res.content)).to_pylist(), [self.row])
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get("/core/export", params={"fmt": "xml"}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import asyncio
+import time
+import unittest
+
+from app.core.scheduler import PollScheduler
+from app.snmp.session import TokenBucket
+
+
+class TestPollScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrency_is_bounded(self):
+        scheduler = PollScheduler(max_devices=3, device_concurrency=2, device_timeout=5)
+        in_flight = {"now": 0, "max": 0}
+
+        async def poll_device(device, slots):
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+            await asyncio.sleep(0.01)
+            in_flight["now"] -= 1
+            return device * 2
+
+        results = await scheduler.run(range(10), poll_device)
+        self.assertEqual(results, [device * 2 for device in range(10)])
+        self.assertEqual(in_flight["max"], 3)
+
+    async def test_slow_device_does_not_hold_the_cycle(self):
+        scheduler = PollScheduler(max_devices=10, device_concurrency=1, device_timeout=0.05)
+
+        async def poll_device(device, slots):
+            await asyncio.sleep(10 if device == "slow" else 0)
+            if device == "broken":
+                raise RuntimeError("SNMP agent gone")
+            return device
+
+        results = await scheduler.run(["fast", "slow", "broken"], poll_device)
+        self.assertEqual(results, ["fast", None, None])
+        self.assertEqual((scheduler.timeouts, scheduler.errors), (1, 1))
+        self.assertLess(scheduler.cycle_time, 1)
+
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+    async def test_rate_limit(self):
+        bucket = TokenBucket(rate=100, burst=5)
+        started = time.monotonic()
+        for _ in range(15):
+            await bucket.acquire()
+        # 5 запросов всплеском, остальные 10 - со скоростью 100 в секунду
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+
+if __name__ == '__main__':
+    unittest.main()
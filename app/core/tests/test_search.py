@@ -0,0 +1,63 @@
+import unittest
+
+from app.core.core import build_indexes, generate_mac_ip_pair
+from app.core.fdb_store import FdbTable, mac_to_int
+from app.core.models import DeviceInfo, PortInfo
+
+
+def make_devices():
+    return {
+        "10.0.0.1": DeviceInfo(host="10.0.0.1", ports={"1": PortInfo(name="gi1"), "2": PortInfo(name="gi2")}),
+        "10.0.0.2": DeviceInfo(host="10.0.0.2", ports={"7": PortInfo(name="te7")}),
+    }
+
+
+def make_fdb_tables():
+    return {
+        "10.0.0.1": FdbTable.from_dict({
+            "1": {"00:0a:00:00:00:01": "10", "00:0b:00:00:00:02": "10"},
+            "2": {"00:0b:00:00:00:01": "20"},
+        }),
+        "10.0.0.2": FdbTable.from_dict({"7": {"00:0a:00:00:00:01": "10"}}),
+    }
+
+
+class TestSearchIndexes(unittest.TestCase):
+    def setUp(self):
+        self.devices = make_devices()
+        self.mac_ip = {
+            mac_to_int("00:0a:00:00:00:01"): ["10.0.0.50", "10.0.0.51"],
+            mac_to_int("00:0b:00:00:00:02"): ["10.0.0.2"],
+        }
+        self.mac_index, self.ip_index = build_indexes(make_fdb_tables(), self.mac_ip)
+
+    def test_indexes(self):
+        self.assertEqual(
+            sorted(self.mac_index.lookup(mac_to_int("00:0a:00:00:00:01"))),
+            [("10.0.0.1", "1", 10), ("10.0.0.2", "7", 10)]
+        )
+        self.assertEqual(self.ip_index["10.0.0.51"], mac_to_int("00:0a:00:00:00:01"))
+
+    def test_search_by_ip(self):
+        ret = generate_mac_ip_pair("10.0.0.51", self.mac_ip, self.devices, self.mac_index, self.ip_index)
+        self.assertEqual(ret, {"10.0.0.50": {"mac": "00:0a:00:00:00:01", "devices": {
+            "10.0.0.1": {"port": "1", "port_name": "gi1", "port_macs_counter": 2},
+            "10.0.0.2": {"port": "7", "port_name": "te7", "port_macs_counter": 1},
+        }}})
+
+    def test_search_by_mac_skips_own_device(self):
+        ret = generate_mac_ip_pair("00:0B:00:00:00:02", self.mac_ip, self.devices, self.mac_index, self.ip_index)
+        self.assertEqual(ret, {"10.0.0.2": {"mac": "00:0b:00:00:00:02", "devices": {
+            "10.0.0.1": {"port": "1", "port_name": "gi1", "port_macs_counter": 2},
+        }}})
+
+        ret = generate_mac_ip_pair("00:0b:00:00:00:01", self.mac_ip, self.devices, self.mac_index, self.ip_index)
+        self.assertEqual(ret["?"]["devices"]["10.0.0.1"]["port_name"], "gi2")
+
+    def test_unknown_query(self):
+        self.assertIsNone(generate_mac_ip_pair("10.9.9.9", self.mac_ip, self.devices, self.mac_index, self.ip_index))
+        self.assertIsNone(generate_mac_ip_pair("bad", self.mac_ip, self.devices, self.mac_index, self.ip_index))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import asyncio
+import unittest
+
+from app.core.core import CoreManager
+from app.core.fdb_store import mac_to_int
+from app.core.snapshot import TopologySnapshot
+from app.core.tests.fake_device import FakeFleet, device_data, devices_collection
+from app.snmp.tests.test_oid_query import FakeAgent
+
+CORE_MAC = "00:00:00:00:00:01"
+ACCESS_MAC = "00:00:00:00:00:02"
+PC_MAC = "00:0a:00:00:00:01"
+SERVER_MAC = "00:0a:00:00:00:02"
+
+
+def make_fleet():
+    return FakeFleet({
+        # ядро: на порту 1 видно access-свитч и PC за ним, на порту 2 - сервер
+        "10.0.0.1": FakeAgent(device_data(
+            "10.0.0.1", CORE_MAC, fdb=[(ACCESS_MAC, 1, 1), (PC_MAC, 1, 1), (SERVER_MAC, 1, 2)],
+            arp=[(PC_MAC, "10.0.0.50")]
+        )),
+        # access: ядро на порту 4, PC на порту 2
+        "10.0.0.2": FakeAgent(device_data(
+            "10.0.0.2", ACCESS_MAC, fdb=[(CORE_MAC, 1, 4), (PC_MAC, 1, 2)]
+        )),
+    })
+
+
+class SlowAgent(FakeAgent):
+    def __init__(self, data, release: asyncio.Event):
+        super().__init__(data)
+        self.release = release
+
+    async def bulk_cmd(self, *args, **options):
+        await self.release.wait()
+        return await super().bulk_cmd(*args, **options)
+
+
+class DeadAgent(FakeAgent):
+    async def _timeout(self, *args, **options):
+        return "No SNMP response received before timeout", 0, 0, []
+
+    get_cmd = next_cmd = bulk_cmd = _timeout
+
+
+class TestSnapshot(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        CoreManager.snapshot = TopologySnapshot.empty()
+        CoreManager.fingerprints, CoreManager.poll_stats = ({}, {})
+
+    async def test_cycle_publishes_complete_snapshot(self):
+        fleet = make_fleet()
+        self.addCleanup(fleet.patch())
+        with devices_collection("10.0.0.1", "10.0.0.2", "10.0.0.3"):
+            fleet.agents["10.0.0.3"] = DeadAgent([])
+            await CoreManager.update_device_tree()
+
+        snapshot = CoreManager.snapshot
+        self.assertEqual(snapshot.version, 1)
+        self.assertEqual(sorted(snapshot.device_dict), ["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(snapshot.unreachable, ["10.0.0.3"])
+        self.assertEqual(snapshot.mac_ip_dict[mac_to_int(PC_MAC)], ["10.0.0.50"])
+        self.assertEqual(snapshot.ip_index["10.0.0.2"], mac_to_int(ACCESS_MAC))
+        self.assertEqual(list(snapshot.device_tree), ["10.0.0.1"])
+        self.assertIn("10.0.0.2", snapshot.device_tree["10.0.0.1"]["ports"]["1"]["uplink"])
+
+    async def test_readers_see_previous_snapshot_during_cycle(self):
+        release = asyncio.Event()
+        fleet = make_fleet()
+        fleet.agents["10.0.0.2"] = SlowAgent(fleet.agents["10.0.0.2"].data, release)
+        self.addCleanup(fleet.patch())
+        previous = CoreManager.snapshot
+
+        with devices_collection("10.0.0.1", "10.0.0.2"):
+            cycle = asyncio.create_task(CoreManager.update_device_tree())
+            await asyncio.sleep(0.05)
+            self.assertIs(CoreManager.snapshot, previous)
+            release.set()
+            await cycle
+
+        self.assertEqual(CoreManager.snapshot.version, previous.version + 1)
+        self.assertEqual(len(CoreManager.snapshot.device_dict), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app.core import snapshot_store
+from app.core.core import CoreManager
+from app.core.fdb_store import mac_to_int
+from app.core.snapshot import TopologySnapshot
+from app.core.snapshot_store import FileSnapshotStore, MongoSnapshotStore, decode_snapshot, encode_snapshot
+from app.core.tests.fake_device import devices_collection
+from app.core.tests.test_snapshot import PC_MAC, DeadAgent, make_fleet
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def to_list(self, length=None):
+        return self.documents
+
+
+class FakeMongo:
+    """ Коллекции в словарях, ровно то, чем пользуется MongoSnapshotStore """
+
+    def __init__(self):
+        self.collections = {}
+
+    async def update_one(self, collection, find_filter: dict, new_data: dict):
+        document = self.collections.setdefault(collection, {}).setdefault(find_filter["_id"], {"_id": find_filter["_id"]})
+        document.update(new_data["$set"])
+
+    async def find_one(self, collection, find_filter: dict, projection=None):
+        return self.collections.get(collection, {}).get(find_filter["_id"])
+
+    def find(self, collection, find_filter: dict):
+        documents = self.collections.get(collection, {})
+        return FakeCursor([documents[_id] for _id in find_filter["_id"]["$in"] if _id in documents])
+
+
+async def poll_once() -> TopologySnapshot:
+    fleet = make_fleet()
+    unpatch = fleet.patch()
+    try:
+        with devices_collection("10.0.0.1", "10.0.0.2", "10.0.0.3"):
+            fleet.agents["10.0.0.3"] = DeadAgent([])
+            await CoreManager.update_device_tree()
+    finally:
+        unpatch()
+    return CoreManager.snapshot
+
+
+class TestSnapshotStore(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        CoreManager.snapshot = TopologySnapshot.empty()
+        CoreManager.fingerprints, CoreManager.poll_stats = ({}, {})
+
+    async def test_encoded_snapshot_gives_same_api_payload(self):
+        snapshot = await poll_once()
+        restored = decode_snapshot(encode_snapshot(snapshot))
+        restored.serialize()
+
+        self.assertTrue(restored.restored)
+        self.assertEqual(restored.version, snapshot.version)
+        self.assertEqual(restored.timestamp, snapshot.timestamp)
+        self.assertEqual(restored.payload, snapshot.payload)
+        self.assertEqual(restored.ip_index, snapshot.ip_index)
+        self.assertEqual(restored.fdb.lookup(mac_to_int(PC_MAC)), snapshot.fdb.lookup(mac_to_int(PC_MAC)))
+
+    async def test_fdb_id_above_16_bits_survives_encoding(self):
+        snapshot = await poll_once()
+        wide_mac = mac_to_int("00:0c:00:00:00:01")
+        snapshot.fdb.tables["10.0.0.1"].add("1", wide_mac, 70000)
+        restored = decode_snapshot(encode_snapshot(snapshot))
+
+        self.assertEqual(restored.fdb.lookup(wide_mac), [("10.0.0.1", "1", 70000)])
+
+    async def test_file_store(self):
+        snapshot = await poll_once()
+        with tempfile.TemporaryDirectory() as tmp:
+            store = FileSnapshotStore(os.path.join(tmp, "snapshot.bin"))
+            self.assertIsNone(await store.load())
+            self.assertIsNone(await store.version())
+            await store.save(snapshot)
+            restored = await store.load()
+            self.assertEqual(await store.version(), snapshot.version)
+        self.assertEqual(sorted(restored.device_dict), sorted(snapshot.device_dict))
+
+    async def test_mongo_store_in_chunks(self):
+        snapshot = await poll_once()
+        store = MongoSnapshotStore(FakeMongo())
+        with mock.patch.object(snapshot_store, "MONGO_CHUNK_SIZE", 100):
+            await store.save(snapshot)
+        self.assertGreater(store.engine.collections["snapshots"]["topology"]["chunks"], 1)
+        restored = await store.load()
+        self.assertEqual(restored.device_tree, snapshot.device_tree)
+        self.assertEqual(await store.version(), snapshot.version)
+
+        # оборванная запись следующей версии: кусок переписан, заголовок - нет
+        await store.engine.update_one("snapshots", {"_id": "topology.0"}, {"$set": {"timestamp": "2024-01-01T00:00:00+00:00"}})
+        self.assertIsNone(await store.load())
+
+    async def test_warm_start_publishes_stored_snapshot(self):
+        snapshot = await poll_once()
+        store = MongoSnapshotStore(FakeMongo())
+        await store.save(snapshot)
+
+        CoreManager.snapshot = TopologySnapshot.empty()
+        with mock.patch("app.core.core.snapshot_store", store):
+            await CoreManager.warm_start()
+        self.assertTrue(CoreManager.snapshot.restored)
+        self.assertEqual(CoreManager.snapshot.version, snapshot.version)
+        self.assertIsNotNone(CoreManager.snapshot.payload)
+
+        # следующий опрос продолжает нумерацию версий
+        self.assertEqual((await poll_once()).version, snapshot.version + 1)
+
+    async def test_cycle_saves_snapshot(self):
+        store = MongoSnapshotStore(FakeMongo())
+        fleet = make_fleet()
+        self.addCleanup(fleet.patch())
+        with devices_collection("10.0.0.1", "10.0.0.2"), mock.patch("app.core.core.snapshot_store", store):
+            await CoreManager.update_device_tree()
+        self.assertEqual(store.engine.collections["snapshots"]["topology"]["version"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import time
+import unittest
+from typing import Dict, List
+
+from app.core.topology import TopologyEngine
+
+
+def links_from_tree(parent_of: Dict[str, str], root: str) -> Dict[str, dict]:
+    """
+    links_dict, каким его собрал бы опрос сети с деревом parent_of {устройство: родитель}:
+    на порту к каждому потомку видно все его поддерево, на порту "up" - все остальные.
+    Порт к потомку называется по имени потомка.
+    """
+    children: Dict[str, List[str]] = {}
+    for host, parent in parent_of.items():
+        children.setdefault(parent, []).append(host)
+    hosts = [root] + list(parent_of)
+    subtree: Dict[str, List[str]] = {}
+    for host in reversed(hosts):
+        subtree[host] = [host] + [el for child in children.get(host, []) for el in subtree[child]]
+
+    links_dict = {}
+    for host in hosts:
+        ports = {
+            child: {"port_name": child, "port_macs_counter": len(subtree[child]), "links": subtree[child]}
+            for child in children.get(host, [])
+        }
+        if host != root:
+            below = set(subtree[host])
+            ports["up"] = {"port_name": "up", "port_macs_counter": 0, "links": [el for el in hosts if el not in below]}
+        links_dict[host] = {"host": host, "device_macs_counter": len(subtree[host]) * 10, "ports": ports}
+    return links_dict
+
+
+def parents_in(tree: dict) -> Dict[str, str]:
+    found = {}
+    stack = list(tree.values())
+    while stack:
+        node = stack.pop()
+        for port, data in node["ports"].items():
+            for host, child in data.get("uplink", {}).items():
+                found[host] = node["host"]
+                stack.append(child)
+    return found
+
+
+class TestTopologyEngine(unittest.TestCase):
+    def setUp(self):
+        self.engine = TopologyEngine()
+
+    def test_same_tree_as_poll_sees(self):
+        parent_of = {"dist1": "core", "dist2": "core", "acc1": "dist1", "acc2": "dist1", "acc3": "dist2"}
+        tree = self.engine.build(links_from_tree(parent_of, "core"))
+
+        self.assertEqual(list(tree), ["core"])
+        self.assertEqual(parents_in(tree), parent_of)
+        self.assertEqual(list(tree["core"]["ports"]["dist1"]["uplink"]), ["dist1"])
+        self.assertIn("acc2", tree["core"]["ports"]["dist1"]["uplink"]["dist1"]["ports"]["acc2"]["uplink"])
+        # порт к корню остается без uplink, как и раньше
+        self.assertNotIn("uplink", tree["core"]["ports"]["dist1"]["uplink"]["dist1"]["ports"]["up"])
+
+    def test_unmanaged_switch_puts_several_devices_on_one_port(self):
+        links_dict = links_from_tree({"acc1": "core", "acc2": "core"}, "core")
+        links_dict["core"]["ports"] = {"hub": {"port_name": "hub", "port_macs_counter": 2, "links": ["acc1", "acc2"]}}
+        links_dict["acc2"]["device_macs_counter"] = 20
+        tree = self.engine.build(links_dict)
+        self.assertEqual(list(tree["core"]["ports"]["hub"]["uplink"]), ["acc2", "acc1"])
+
+    def test_unchanged_links_reuse_structure(self):
+        links_dict = links_from_tree({"dist": "core", "acc": "dist"}, "core")
+        first = self.engine.build(links_dict)
+        links_dict["acc"]["device_macs_counter"] = 7
+        second = self.engine.build(links_dict)
+
+        self.assertEqual((self.engine.computed, self.engine.reused), (1, 1))
+        self.assertEqual(parents_in(first), parents_in(second))
+        self.assertEqual(second["core"]["ports"]["dist"]["uplink"]["dist"]["ports"]["acc"]["uplink"]["acc"]
+                         ["device_macs_counter"], 7)
+        # прошлое дерево не тронуто
+        self.assertEqual(first["core"]["ports"]["dist"]["uplink"]["dist"]["ports"]["acc"]["uplink"]["acc"]
+                         ["device_macs_counter"], 10)
+
+        links_dict["core"]["ports"]["dist"]["links"] = ["dist"]
+        self.engine.build(links_dict)
+        self.assertEqual(self.engine.computed, 2)
+
+    def test_deep_chain_without_recursion(self):
+        parent_of = {"sw{}".format(i): "sw{}".format(i - 1) if i > 1 else "root" for i in range(1, 1500)}
+        links_dict = {}
+        # цепочка: каждое устройство видит предыдущих на "up", следующих на "down"
+        hosts = ["root"] + list(parent_of)
+        for i, host in enumerate(hosts):
+            ports = {}
+            if i + 1 < len(hosts):
+                ports["down"] = {"port_name": "down", "port_macs_counter": 0, "links": hosts[i + 1:]}
+            if i:
+                ports["up"] = {"port_name": "up", "port_macs_counter": 0, "links": hosts[:i]}
+            links_dict[host] = {"host": host, "device_macs_counter": len(hosts) - i, "ports": ports}
+        self.assertEqual(parents_in(self.engine.build(links_dict)), parent_of)
+
+    def test_contradicting_fdb_does_not_loop(self):
+        links_dict = links_from_tree({"a": "core", "b": "core"}, "core")
+        # a и b видят друг друга "вниз" - кольцо родителей
+        links_dict["a"]["ports"] = {"up": {"port_name": "up", "port_macs_counter": 0, "links": ["core"]},
+                                    "x": {"port_name": "x", "port_macs_counter": 0, "links": ["b"]}}
+        links_dict["b"]["ports"] = {"up": {"port_name": "up", "port_macs_counter": 0, "links": ["core"]},
+                                    "x": {"port_name": "x", "port_macs_counter": 0, "links": ["a"]}}
+        parents = parents_in(self.engine.build(links_dict))
+        self.assertEqual(sorted(parents), ["a", "b"])
+        self.assertIn("core", parents.values())
+
+    def test_thousands_of_switches(self):
+        # ядро, 40 распределения, по 50 доступа на каждом
+        parent_of = {}
+        for d in range(40):
+            parent_of["d{}".format(d)] = "core"
+            for a in range(50):
+                parent_of["a{}.{}".format(d, a)] = "d{}".format(d)
+        links_dict = links_from_tree(parent_of, "core")
+
+        started = time.perf_counter()
+        tree = self.engine.build(links_dict)
+        computed = time.perf_counter() - started
+
+        self.assertEqual(parents_in(tree), parent_of)
+        self.assertLess(computed, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import asyncio
+import contextlib
+import io
+import unittest
+from unittest import mock
+
+from app.benchmarks.bench_poll import _Cursor, device_documents
+from app.benchmarks.snmp_agent import AGENT_PORT, AgentProtocol, FleetSpec
+from app.core.core import CoreManager
+from app.core.snapshot import TopologySnapshot
+from app.core.workers import ProcessPoller
+
+
+class TestProcessPoller(unittest.IsolatedAsyncioTestCase):
+    """
+    Агенты в event loop теста, опрос - из двух процессов-шардов через настоящий UDP на loopback.
+    """
+
+    async def asyncSetUp(self):
+        self.spec = FleetSpec(devices=4, ports=8, fdb=30, arp=10)
+        self.stats = {"received": 0, "sent": 0, "dropped": 0}
+        loop = asyncio.get_running_loop()
+        for index in range(self.spec.devices):
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: AgentProtocol(self.spec.device_table(index), self.spec, False, self.stats),
+                local_addr=(self.spec.host(index), AGENT_PORT)
+            )
+            self.addCleanup(transport.close)
+
+        CoreManager.snapshot = TopologySnapshot.empty()
+        CoreManager.fingerprints, CoreManager.poll_stats = ({}, {})
+        self.poller = ProcessPoller(workers=2, max_devices=4)
+        self.addCleanup(self.poller.shutdown)
+        for patcher in (
+                mock.patch.object(CoreManager, "process_poller", self.poller),
+                mock.patch("app.core.core.motorchik.find", return_value=_Cursor(device_documents(self.spec.hosts()))),
+                mock.patch("app.core.core.snapshot_store", None),
+                mock.patch("app.core.core.mac_history", None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, CoreManager, "snapshot", TopologySnapshot.empty())
+
+    async def cycle(self) -> TopologySnapshot:
+        with contextlib.redirect_stdout(io.StringIO()):
+            await CoreManager.update_device_tree()
+        return CoreManager.snapshot
+
+    async def test_shards_poll_and_skip_unchanged_devices(self):
+        self.assertEqual(len({self.poller.shard(host) for host in self.spec.hosts()}), 2)
+
+        first = await self.cycle()
+        core = self.spec.host(0)
+        self.assertEqual(sorted(first.device_dict), sorted(self.spec.hosts()))
+        self.assertEqual(list(first.device_tree), [core])
+        self.assertEqual(len(first.mac_ip_dict), 10 + 4)
+        self.assertEqual(self.poller.errors, 0)
+
+        # второй цикл: устройства не менялись - процессы обход пропускают, данные берутся из прежнего снимка
+        received = self.stats["received"]
+        second = await self.cycle()
+        self.assertEqual(second.version, 2)
+        self.assertEqual({el["skipped"] for el in CoreManager.poll_stats.values()}, {1})
+        self.assertEqual(second.device_dict, first.device_dict)
+        self.assertEqual(len(second.fdb), len(first.fdb))
+        self.assertLess(self.stats["received"] - received, received)
+
+
+if __name__ == '__main__':
+    unittest.main()
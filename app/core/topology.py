@@ -0,0 +1,174 @@
+"""
+Дерево подключения коммутаторов по LLDP и FDB.
+На входе links_dict (см. CoreManager.update_device_tree), по узлу на устройство:
+- "ports": {порт: {"port_name", "port_macs_counter", "links"}} - устройства, чьи MAC видны на порту в FDB;
+- "lldp": {порт: {..., "links"}} - соседи по LLDP, ровно те, кто подключен к порту напрямую.
+На выходе - дерево того же вида, что отдает /core/get_place:
+{корень: {"host", "device_macs_counter", "ports": {порт: {"port_name", "port_macs_counter", "links",
+"uplink": {соседний хост: узел, ...}}}}}.
+
+Как строится, без рекурсии:
+1. Корень - устройство с наибольшим числом маков.
+2. Обход в ширину от корня по ребрам LLDP: сосед вешается на тот порт, где его видно.
+3. Устройства без LLDP - по FDB. У каждого устройства порт к корню (аплинк) - тот, где виден корень;
+   если корня не видно - порт, за которым больше всего устройств. Остальные порты смотрят вниз.
+   Родитель устройства X - порт вниз, за которым X виден и где устройств меньше всего: чем ближе к X,
+   тем меньше за портом остается. При равенстве (так бывает, если FDB смотрели не для всех MAC) -
+   тот из равных, кто глубже в дереве. X вешается, как только в дереве все равные кандидаты.
+4. Если данные FDB противоречивы и кандидаты ждут друг друга по кругу, X вешается на лучшего
+   из кандидатов, уже попавших в дерево.
+Все это - O(ребер LLDP + портов вниз * устройств за ними).
+
+Дерево зависит только от корня, портов вниз и ребер LLDP, поэтому оно запоминается по ним:
+если сеть не менялась, следующий цикл только раскладывает свежие счетчики маков по готовой структуре.
+"""
+import time
+from collections import deque
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from app.metrics import gauge_callback
+
+# (устройство, порт) -> соседи на порту, ближние к устройству
+Children = Dict[Tuple[str, str], List[str]]
+# {(хост, порт, устройства за портом)}
+PortLinks = FrozenSet[Tuple[str, str, Tuple[str, ...]]]
+
+
+def _uplink_port(root: str, ports: dict) -> Optional[str]:
+    uplinks = [port for port, data in ports.items() if root in data["links"]]
+    if not uplinks:
+        uplinks = list(ports)
+    if not uplinks:
+        return None
+    return max(uplinks, key=lambda port: len(ports[port]["links"]))
+
+
+class TopologyEngine:
+
+    def __init__(self):
+        self._key: Optional[Tuple[str, PortLinks, PortLinks]] = None
+        self._children: Children = {}
+        self.computed = 0
+        self.reused = 0
+        self.last_time = 0.0
+        self.last_computed = False
+
+    @staticmethod
+    def downstream(root: str, links_dict: Dict[str, dict]) -> PortLinks:
+        """
+        Порты FDB, смотрящие от корня. Аплинки, за которыми видна почти вся сеть, сюда не попадают -
+        их больше всего, а дереву они не нужны.
+        """
+        return frozenset(
+            (host, port, tuple(data["links"]))
+            for host, node in links_dict.items()
+            for uplink in [None if host == root else _uplink_port(root, node["ports"])]
+            for port, data in node["ports"].items() if port != uplink
+        )
+
+    @staticmethod
+    def lldp_edges(links_dict: Dict[str, dict]) -> PortLinks:
+        return frozenset(
+            (host, port, tuple(data["links"]))
+            for host, node in links_dict.items() for port, data in node.get("lldp", {}).items()
+        )
+
+    @staticmethod
+    def infer(root: str, downstream: PortLinks, lldp: PortLinks) -> Children:
+        """ Кто к какому порту какого устройства подключен """
+        adjacency: Dict[str, List[Tuple[str, str]]] = {}
+        for host, port, links in sorted(lldp):
+            for link in links:
+                adjacency.setdefault(host, []).append((port, link))
+
+        # кандидаты в родители по FDB: X -> [(устройств за портом, хост, порт)]
+        candidates: Dict[str, List[Tuple[int, str, str]]] = {}
+        for host, port, links in downstream:
+            for link in links:
+                if link != host and link != root:
+                    candidates.setdefault(link, []).append((len(links), host, port))
+        # ближайшие кандидаты, сколько из них еще не в дереве и кого ждет каждый хост
+        nearest: Dict[str, List[Tuple[int, str, str]]] = {}
+        waiting: Dict[str, int] = {}
+        dependents: Dict[str, List[str]] = {}
+        for link, found in candidates.items():
+            size = min(found)[0]
+            nearest[link] = [el for el in found if el[0] == size]
+            waiting[link] = len(nearest[link])
+            for _, host, _ in nearest[link]:
+                dependents.setdefault(host, []).append(link)
+
+        children: Children = {}
+        depth = {root: 0}
+        queue = deque([root])
+
+        def attach(link: str, host: str, port: str):
+            children.setdefault((host, port), []).append(link)
+            depth[link] = depth[host] + 1
+            queue.append(link)
+
+        while True:
+            while queue:
+                host = queue.popleft()
+                for port, link in adjacency.get(host, ()):
+                    if link not in depth:
+                        attach(link, host, port)
+                for link in dependents.pop(host, ()):
+                    waiting[link] -= 1
+                    if not waiting[link] and link not in depth:
+                        _, parent, port = max(nearest[link], key=lambda el: (depth[el[1]], el[1]))
+                        attach(link, parent, port)
+
+            # противоречивые FDB: кандидаты ждут друг друга - вешаем одного на лучшего из уже найденных
+            stuck = sorted(
+                (size, -depth[host], link, host, port)
+                for link, found in candidates.items() if link not in depth
+                for size, host, port in found if host in depth
+            )
+            if not stuck:
+                break
+            _, _, link, host, port = stuck[0]
+            attach(link, host, port)
+        return children
+
+    def build(self, links_dict: Dict[str, dict]) -> dict:
+        if not links_dict:
+            return {}
+        started = time.perf_counter()
+        root = max(links_dict.values(), key=lambda node: node["device_macs_counter"])["host"]
+        key = (root, self.downstream(root, links_dict), self.lldp_edges(links_dict))
+        self.last_computed = key != self._key
+        if not self.last_computed:
+            self.reused += 1
+        else:
+            self._children = self.infer(*key)
+            self._key = key
+            self.computed += 1
+
+        def counter(host: str) -> int:
+            return links_dict[host]["device_macs_counter"] if host in links_dict else 0
+
+        # узлы создаются заново: счетчики маков свежие, а прошлое дерево уже отдано клиентам
+        nodes = {}
+        for host in {root} | {link for links in self._children.values() for link in links}:
+            node = links_dict.get(host, {"host": host, "device_macs_counter": 0, "ports": {}})
+            ports = {port: dict(data) for port, data in node.get("lldp", {}).items()}
+            ports.update((port, dict(data)) for port, data in node["ports"].items())
+            nodes[host] = {"host": node["host"], "device_macs_counter": node["device_macs_counter"], "ports": ports}
+        for (host, port), links in self._children.items():
+            port_data = nodes[host]["ports"].setdefault(port, {"links": []})
+            # клиент рисует первого соседа на порту - самого крупного
+            port_data["uplink"] = {link: nodes[link] for link in sorted(links, key=lambda el: (-counter(el), el))}
+        self.last_time = time.perf_counter() - started
+        return {root: nodes[root]}
+
+    def stats(self) -> dict:
+        return {"computed": self.computed, "reused": self.reused, "last_time": round(self.last_time, 4)}
+
+
+topology_engine = TopologyEngine()
+
+
+@gauge_callback("netviewer_topology", "Сборка дерева: TopologyEngine.stats()", "stat")
+def collect_topology():
+    return topology_engine.stats()
@@ -0,0 +1,166 @@
+"""
+Опрос устройств в отдельных процессах (POLL_WORKERS > 0).
+Разбор BER в pysnmp и decode_* занимают CPU, и в одном event loop с FastAPI цикл опроса
+поднимает задержку API и упирается в одно ядро. Здесь устройства делятся на шарды по crc32(host),
+у каждого шарда свой процесс со своим event loop, SnmpEngine, пулом сессий и PollScheduler.
+Устройство всегда попадает в один и тот же процесс, поэтому там же живут его отпечатки
+(change_detection) и счетчики пропусков.
+
+Процесс возвращает по устройству компактный результат: (DeviceInfo, FdbTable с колонками array, пары mac-ip).
+Если устройство не изменилось, вместо данных приходит UNCHANGED, и прежние данные основной процесс
+берет из своего снимка. Основному процессу остается слить результаты в снимок и отвечать на HTTP.
+
+Процессы запускаются через spawn: форк процесса с работающим event loop, потоками bcrypt и клиентом
+MongoDB ненадежен. Упавший процесс пересоздается, его устройства в этом цикле считаются недоступными.
+Запись ответов (SNMP_RECORD_FILE) из нескольких процессов в один файл перемешала бы кадры,
+поэтому с ней опрос остается в основном процессе.
+Счетчики PDU, обходов и разбора процессы пишут сами, в многопроцессном режиме prometheus_client (app.metrics).
+"""
+import asyncio
+import math
+import multiprocessing
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from app.core.core import CoreManager
+from app.core.models import NewDevice
+from app.core.scheduler import PollScheduler
+from app.settings import settings
+
+UNCHANGED = "unchanged"
+
+
+class ShardPoller(CoreManager):
+    """
+    CoreManager внутри процесса-шарда: снимка здесь нет, только список устройств,
+    для которых он есть в основном процессе.
+    """
+    known: set = set()
+
+    @classmethod
+    def has_previous(cls, host: str) -> bool:
+        return host in cls.known
+
+    @classmethod
+    def previous_result(cls, host: str):
+        return UNCHANGED
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _init_worker():
+    global _loop
+    # один loop на всю жизнь процесса: к нему привязаны транспорты SnmpEngine и сессии
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+
+
+async def _poll_shard(documents: List[dict], known: List[str], scheduler: PollScheduler) -> dict:
+    ShardPoller.known = set(known)
+    devices = [NewDevice(**document) for document in documents]
+    results = await scheduler.run(devices, ShardPoller.update_device_info)
+    return {
+        "results": results,
+        "stats": {dev.host: ShardPoller.poll_stats.get(dev.host) for dev in devices},
+        "timeouts": scheduler.timeouts,
+        "errors": scheduler.errors,
+        "durations": scheduler.durations,
+    }
+
+
+def poll_shard(documents: List[dict], known: List[str], max_devices: int) -> dict:
+    """ Выполняется в процессе шарда """
+    scheduler = PollScheduler(
+        max_devices=max_devices,
+        device_concurrency=settings.POLL_DEVICE_CONCURRENCY,
+        device_timeout=settings.POLL_DEVICE_TIMEOUT
+    )
+    return _loop.run_until_complete(_poll_shard(documents, known, scheduler))
+
+
+class ProcessPoller:
+    """
+    Цикл опроса по процессам-шардам, снаружи - как PollScheduler: run() отдает результаты
+    в порядке devices, после цикла есть cycle_time, timeouts, errors, durations.
+    POLL_MAX_DEVICES делится между шардами, так что всего одновременно опрашивается столько же устройств.
+    """
+
+    def __init__(self, workers: int, max_devices: int):
+        self.workers = max(1, workers)
+        self.max_devices = max(1, math.ceil(max_devices / self.workers))
+        self._executors: List[Optional[ProcessPoolExecutor]] = [None] * self.workers
+        self.cycle_time: float = 0
+        self.timeouts: int = 0
+        self.errors: int = 0
+        self.durations: Dict[str, float] = {}
+
+    def shard(self, host: str) -> int:
+        return zlib.crc32(host.encode()) % self.workers
+
+    def _executor(self, shard: int) -> ProcessPoolExecutor:
+        if self._executors[shard] is None:
+            self._executors[shard] = ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+            )
+        return self._executors[shard]
+
+    async def _run_shard(self, shard: int, devices: List[NewDevice]) -> Optional[dict]:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._executor(shard), poll_shard,
+                [dev.model_dump() for dev in devices],
+                [dev.host for dev in devices if CoreManager.has_previous(dev.host)],
+                self.max_devices
+            )
+        except BrokenProcessPool as ex:
+            print("процесс опроса {} упал: {}, пересоздаю".format(shard, ex))
+            self._executors[shard].shutdown(wait=False, cancel_futures=True)
+            self._executors[shard] = None
+            self.errors += len(devices)
+            return None
+
+    async def run(self, devices: List[NewDevice]) -> list:
+        started = time.monotonic()
+        self.timeouts, self.errors, self.durations = (0, 0, {})
+        shards: Dict[int, List[int]] = {}
+        for i, dev in enumerate(devices):
+            shards.setdefault(self.shard(dev.host), []).append(i)
+
+        outputs = await asyncio.gather(*[
+            self._run_shard(shard, [devices[i] for i in indexes]) for shard, indexes in shards.items()
+        ])
+
+        results = [None] * len(devices)
+        for indexes, output in zip(shards.values(), outputs):
+            if output is None:
+                continue
+            self.timeouts += output["timeouts"]
+            self.errors += output["errors"]
+            self.durations.update(output["durations"])
+            for i, result in zip(indexes, output["results"]):
+                host = devices[i].host
+                if output["stats"][host] is not None:
+                    CoreManager.poll_stats[host] = output["stats"][host]
+                results[i] = CoreManager.previous_result(host) if result == UNCHANGED else result
+        self.cycle_time = time.monotonic() - started
+        return results
+
+    def shutdown(self):
+        for executor in self._executors:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._executors = [None] * self.workers
+
+
+def make_process_poller() -> Optional[ProcessPoller]:
+    if settings.POLL_WORKERS <= 0:
+        return None
+    if settings.SNMP_RECORD_FILE:
+        print("SNMP_RECORD_FILE задан - опрос остается в основном процессе")
+        return None
+    return ProcessPoller(settings.POLL_WORKERS, settings.POLL_MAX_DEVICES)
@@ -1,3 +1,5 @@
+from pymongo import ASCENDING
+
 from app.database.mongo_motor import MongoMotorEngine
 from app.settings import settings
 
@@ -7,5 +9,14 @@ motorchik = MongoMotorEngine(
                 settings.DB_USER, settings.DB_PASSWORD,
                 settings.DB_HOST, settings.DB_PORT
             ),
-            database="macfinder"
+            database="macfinder",
+            batch_size=settings.DB_BATCH_SIZE,
+            maxPoolSize=settings.DB_MAX_POOL_SIZE,
+            minPoolSize=settings.DB_MIN_POOL_SIZE,
+            maxIdleTimeMS=settings.DB_MAX_IDLE_TIME_MS,
+            serverSelectionTimeoutMS=settings.DB_SERVER_SELECTION_TIMEOUT_MS,
         )
+
+# Индексы создаются на старте приложения (motorchik.ensure_indexes), unique заодно защищает от дублей при гонках
+motorchik.declare_index("devices", [("host", ASCENDING)], unique=True)
+motorchik.declare_index("users", [("login", ASCENDING)], unique=True)
@@ -1,7 +1,9 @@
-from typing import Optional
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Set, Union
 
 import motor.motor_asyncio
 from pydantic import BaseModel
+from pymongo import IndexModel
 
 
 class MongoMotorEngine:
@@ -10,16 +12,24 @@ class MongoMotorEngine:
     _client: Optional[motor.motor_asyncio.AsyncIOMotorClient]
     _db: Optional[motor.motor_asyncio.AsyncIOMotorDatabase]
 
-    def __init__(self, connection_uri: str, database: str):
+    def __init__(self, connection_uri: str, database: str, batch_size: int = 1000, **client_options):
         """
         Для инициализации подключения указать connection URI
         В стиле 'mongodb://localhost:27017'
         Таким образом экземпляр будет привязан к конкретному хосту, порту и базе.
+        client_options уходят в AsyncIOMotorClient как есть: maxPoolSize, minPoolSize, maxIdleTimeMS,
+        serverSelectionTimeoutMS и т.п. batch_size - сколько документов курсор тянет с сервера за раз.
         """
         self._connection_uri = connection_uri
         self._db_name = database
+        self._client_options = client_options
+        self._batch_size = batch_size
         self._client = None
         self._db = None
+        # индексы, которые должны быть в базе: {collection: [IndexModel, ...]}, создаются ensure_indexes()
+        self._indexes: Dict[str, List[IndexModel]] = {}
+        # коллекции, у которых все объявленные unique-индексы найдены в базе (list_indexes)
+        self._unique_confirmed: Set[str] = set()
 
     def is_connected(self, disconnect: bool = False) -> bool:
         if disconnect:
@@ -29,24 +39,102 @@ class MongoMotorEngine:
             self._client, self._db = (None, None)
             return False
         if self._client is None:
-            self._client = motor.motor_asyncio.AsyncIOMotorClient(self._connection_uri)
+            self._client = motor.motor_asyncio.AsyncIOMotorClient(self._connection_uri, **self._client_options)
             self._db = self._client[self._db_name]
         return True
 
-    async def insert_one(self, collection: str, document: BaseModel):
+    def declare_index(self, collection: str, keys, **kwargs):
+        """
+        Объявить индекс: keys как у pymongo ([("host", ASCENDING)]), kwargs - unique, expireAfterSeconds, name...
+        Сам индекс создается в ensure_indexes() при старте приложения.
+        """
+        self._indexes.setdefault(collection, []).append(IndexModel(keys, **kwargs))
+
+    async def ensure_indexes(self) -> bool:
+        """
+        Создает все объявленные индексы. Уже существующие сервер пропускает, так что звать можно на каждом старте.
+        Ошибка по одной коллекции (например, дубли под unique) не мешает остальным.
+        После создания unique-индексы сверяются с list_indexes; True - все они на месте.
+        """
+        if not self.is_connected():
+            return False
+        for collection, indexes in self._indexes.items():
+            try:
+                names = await self._db[collection].create_indexes(indexes)
+                print("индексы {}: {}".format(collection, ", ".join(names)))
+            except Exception as e:
+                print("ВНИМАНИЕ: индексы {} не созданы: {}".format(collection, e))
+            await self.check_unique_indexes(collection)
+        return all(self.unique_confirmed(collection) for collection in self._indexes)
+
+    async def check_unique_indexes(self, collection: str) -> bool:
+        """ Все ли объявленные unique-индексы коллекции есть в базе; без них дубли не отсекаются - пишем об этом громко """
+        declared = [index.document for index in self._indexes.get(collection, []) if index.document.get("unique")]
+        try:
+            existing = await self._db[collection].list_indexes().to_list(length=None)
+        except Exception as e:
+            print("ВНИМАНИЕ: индексы {} не прочитаны: {}".format(collection, e))
+            existing = []
+        unique_keys = [list(index["key"].items()) for index in existing if index.get("unique")]
+        missing = [index for index in declared if list(index["key"].items()) not in unique_keys]
+        if missing:
+            self._unique_confirmed.discard(collection)
+            print("ВНИМАНИЕ: в {} нет unique-индексов {}, дубли проверяются отдельным запросом".format(
+                collection, ", ".join(str(dict(index["key"])) for index in missing)
+            ))
+            return False
+        self._unique_confirmed.add(collection)
+        return True
+
+    def unique_confirmed(self, collection: str) -> bool:
+        """ False - уникальность в collection индексом пока не гарантирована, перед вставкой нужен find_one """
+        declared = any(index.document.get("unique") for index in self._indexes.get(collection, []))
+        return not declared or collection in self._unique_confirmed
+
+    async def keep_indexes(self, retry_interval: float):
+        """ ensure_indexes(), пока все unique-индексы не подтвердятся: база могла быть недоступна или с дублями """
+        while not await self.ensure_indexes():
+            await asyncio.sleep(retry_interval)
+
+    async def insert_one(self, collection: str, document: Union[BaseModel, dict]):
         if self.is_connected():
-            result = await self._db[collection].insert_one(document.model_dump())
+            if isinstance(document, BaseModel):
+                document = document.model_dump()
+            result = await self._db[collection].insert_one(document)
             return result
         return None
 
-    def find(self, collection, find_filter: dict):
+    async def insert_many(self, collection: str, documents: List[Union[BaseModel, dict]], ordered: bool = False):
+        """ Одним запросом; неупорядоченно - сервер не останавливается на первой ошибке """
+        if self.is_connected() and documents:
+            return await self._db[collection].insert_many(
+                [el.model_dump() if isinstance(el, BaseModel) else el for el in documents], ordered=ordered
+            )
+        return None
+
+    def find(self, collection, find_filter: dict, projection: Optional[dict] = None, batch_size: Optional[int] = None):
+        """
+        Курсор: to_list() - все сразу, async for - потоком, пачками по batch_size документов.
+        projection - только нужные поля ({"_id": False, "host": True}).
+        """
         if self.is_connected():
-            return self._db[collection].find(filter=find_filter)
+            return self._db[collection].find(
+                filter=find_filter, projection=projection, batch_size=batch_size or self._batch_size
+            )
         return None
 
-    async def find_one(self, collection, find_filter: dict):
+    async def iterate(
+            self, collection, find_filter: dict, projection: Optional[dict] = None, batch_size: Optional[int] = None
+    ) -> AsyncIterator[dict]:
+        """ Документы по одному, не держа в памяти всю выборку """
+        cursor = self.find(collection, find_filter, projection, batch_size)
+        if cursor is not None:
+            async for document in cursor:
+                yield document
+
+    async def find_one(self, collection, find_filter: dict, projection: Optional[dict] = None):
         if self.is_connected():
-            return await self._db[collection].find_one(filter=find_filter)
+            return await self._db[collection].find_one(filter=find_filter, projection=projection)
         return None
 
     async def drop_collection(self, collection):
@@ -54,12 +142,18 @@ class MongoMotorEngine:
             return await self._db.drop_collection(collection)
         return None
 
-    async def update_one(self, collection, find_filter: dict, new_data: dict):
+    async def update_one(self, collection, find_filter: dict, new_data: dict, upsert: bool = True):
         if self.is_connected():
-            return await self._db[collection].update_one(filter=find_filter, update=new_data, upsert=True)
+            return await self._db[collection].update_one(filter=find_filter, update=new_data, upsert=upsert)
         return None
 
-    async def update_many(self, collection, find_filter: dict, new_data: dict):
+    async def update_many(self, collection, find_filter: dict, new_data: dict, upsert: bool = True):
         if self.is_connected():
-            return await self._db[collection].update_many(filter=find_filter, update=new_data, upsert=True)
+            return await self._db[collection].update_many(filter=find_filter, update=new_data, upsert=upsert)
+        return None
+
+    async def bulk_write(self, collection, requests: list, ordered: bool = False):
+        """ requests - pymongo InsertOne/UpdateOne/...; неупорядоченно - сервер не останавливается на первой ошибке """
+        if self.is_connected() and requests:
+            return await self._db[collection].bulk_write(requests, ordered=ordered)
         return None
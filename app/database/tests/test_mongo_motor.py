@@ -0,0 +1,97 @@
+import asyncio
+import contextlib
+import io
+import unittest
+from collections import defaultdict
+from unittest import mock
+
+from pydantic import BaseModel
+from pymongo import ASCENDING
+
+from app.database.mongo_motor import MongoMotorEngine
+
+
+class Document(BaseModel):
+    host: str
+
+
+def make_engine() -> MongoMotorEngine:
+    """ Движок с подмененной базой - без живого MongoDB """
+    engine = MongoMotorEngine(connection_uri="mongodb://localhost:27017", database="test", batch_size=500)
+    engine._client, engine._db = (mock.MagicMock(), mock.MagicMock())
+    collections = defaultdict(mock.MagicMock)
+    engine._db.__getitem__.side_effect = collections.__getitem__
+    return engine
+
+
+class TestMongoMotorEngine(unittest.IsolatedAsyncioTestCase):
+    async def test_declared_indexes_are_created_per_collection(self):
+        engine = make_engine()
+        engine.declare_index("devices", [("host", ASCENDING)], unique=True)
+        engine.declare_index("users", [("login", ASCENDING)], unique=True)
+        engine._db["devices"].create_indexes = mock.AsyncMock(side_effect=Exception("duplicate key"))
+        engine._db["users"].create_indexes = mock.AsyncMock(return_value=["login_1"])
+
+        await engine.ensure_indexes()
+
+        engine._db["devices"].list_indexes.return_value.to_list = mock.AsyncMock(
+            return_value=[{"key": {"_id": 1}}]
+        )
+        engine._db["users"].list_indexes.return_value.to_list = mock.AsyncMock(
+            return_value=[{"key": {"_id": 1}}, {"key": {"login": 1}, "unique": True}]
+        )
+
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertFalse(await engine.ensure_indexes())
+
+        indexes = engine._db["users"].create_indexes.call_args[0][0]
+        self.assertEqual(indexes[0].document["key"], {"login": ASCENDING})
+        self.assertTrue(indexes[0].document["unique"])
+        # devices.host не создан (дубли в базе) - это видно в логе, и вставки проверяют дубли сами
+        self.assertIn("ВНИМАНИЕ: в devices нет unique-индексов {'host': 1}", out.getvalue())
+        self.assertFalse(engine.unique_confirmed("devices"))
+        self.assertTrue(engine.unique_confirmed("users"))
+        self.assertTrue(engine.unique_confirmed("history"))
+
+    async def test_indexes_are_retried_until_confirmed(self):
+        engine = make_engine()
+        engine.declare_index("devices", [("host", ASCENDING)], unique=True)
+        engine._db["devices"].create_indexes = mock.AsyncMock(side_effect=[Exception("no server"), ["host_1"]])
+        engine._db["devices"].list_indexes.return_value.to_list = mock.AsyncMock(side_effect=[
+            [], [{"key": {"host": 1}, "unique": True}]
+        ])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            await asyncio.wait_for(engine.keep_indexes(0), 1)
+
+        self.assertEqual(engine._db["devices"].create_indexes.await_count, 2)
+        self.assertTrue(engine.unique_confirmed("devices"))
+
+    async def test_insert_accepts_models_and_dicts(self):
+        engine = make_engine()
+        engine._db["devices"].insert_one = mock.AsyncMock()
+        engine._db["devices"].insert_many = mock.AsyncMock()
+
+        await engine.insert_one("devices", Document(host="10.0.0.1"))
+        await engine.insert_one("devices", {"host": "10.0.0.2"})
+        await engine.insert_many("devices", [Document(host="10.0.0.3"), {"host": "10.0.0.4"}])
+
+        self.assertEqual(engine._db["devices"].insert_one.call_args_list[0][0][0], {"host": "10.0.0.1"})
+        self.assertEqual(engine._db["devices"].insert_one.call_args_list[1][0][0], {"host": "10.0.0.2"})
+        engine._db["devices"].insert_many.assert_called_once_with(
+            [{"host": "10.0.0.3"}, {"host": "10.0.0.4"}], ordered=False
+        )
+
+    async def test_empty_bulk_operations_skip_round_trip(self):
+        engine = make_engine()
+        self.assertIsNone(await engine.insert_many("devices", []))
+        self.assertIsNone(await engine.bulk_write("devices", []))
+
+    def test_find_passes_projection_and_batch_size(self):
+        engine = make_engine()
+        engine.find("devices", {}, projection={"_id": False})
+        engine._db["devices"].find.assert_called_once_with(filter={}, projection={"_id": False}, batch_size=500)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+"""
+Метрики Prometheus на prometheus_client: GET /metrics (METRICS_ENABLED).
+По умолчанию выключены; включенные лучше закрыть METRICS_TOKEN (Bearer-токен в scrape_config Prometheus).
+
+Counter и Histogram объявляются там, где считаются (app.snmp.oid_query, app.core.core, ...), в общем реестре registry.
+Импортировать их - отсюда (from app.metrics import Counter), а не из prometheus_client напрямую: так
+PROMETHEUS_MULTIPROC_DIR гарантированно задан до первого импорта prometheus_client.
+Значения, которые и так лежат в чужих структурах (размер снимка, пул bcrypt), не дублируются:
+их модуль объявляет gauge_callback, и функция читает их в момент запроса /metrics.
+
+Метки - только из конечных наборов (вид PDU, таблица, функция разбора, шаблон маршрута API);
+поустройственная метка есть только у самых медленных устройств (METRICS_TOP_DEVICES).
+Так что и на 1000 устройств ответ /metrics - несколько сотен строк.
+
+С процессами опроса (POLL_WORKERS, app.core.workers) включается многопроцессный режим prometheus_client:
+каталог PROMETHEUS_MULTIPROC_DIR создается здесь, процессы-шарды наследуют его через окружение
+и пишут свои счетчики в файлы, а /metrics суммирует файлы всех процессов (MultiProcessCollector).
+"""
+import atexit
+import hmac
+import os
+import shutil
+import tempfile
+import time
+from typing import Callable, List
+
+from app.settings import settings
+
+# до импорта prometheus_client: он выбирает, где хранить значения, один раз при импорте
+if settings.METRICS_ENABLED and settings.POLL_WORKERS > 0 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="netviewer-metrics-")
+    atexit.register(shutil.rmtree, os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+
+__all__ = ["Counter", "Histogram", "DURATION_BUCKETS", "registry", "gauge_callback", "render",
+           "MetricsMiddleware", "router"]
+
+# секунды: от быстрого ответа API до долгого цикла опроса
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+registry = CollectorRegistry()
+# gauge_callback-и: в многопроцессном режиме их надо добавить к реестру выдачи
+callbacks: List["GaugeCallback"] = []
+
+
+class GaugeCallback:
+    """
+    Gauge, которого нет в памяти процесса: read() вызывается при каждой выдаче /metrics
+    и возвращает число, {значение метки: число} (при labelname) или None - ряда сейчас нет.
+    """
+
+    def __init__(self, name: str, documentation: str, read: Callable, labelname: str = ""):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        self.labelname = labelname
+
+    def describe(self):
+        # без чтения значений при регистрации
+        return []
+
+    def collect(self):
+        try:
+            values = self.read()
+        except Exception as e:
+            print("metrics {}: {}".format(self.name, e))
+            return
+        if values is None:
+            return
+        family = GaugeMetricFamily(self.name, self.documentation, labels=[self.labelname] if self.labelname else None)
+        if self.labelname:
+            for label, value in values.items():
+                family.add_metric([str(label)], value)
+        else:
+            family.add_metric([], values)
+        yield family
+
+
+def gauge_callback(name: str, documentation: str, labelname: str = ""):
+    """ Декоратор: функция без аргументов становится GaugeCallback в registry """
+    def register(read: Callable):
+        callback = GaugeCallback(name, documentation, read, labelname)
+        registry.register(callback)
+        callbacks.append(callback)
+        return read
+    return register
+
+
+def render() -> bytes:
+    """ Текст для Prometheus: свои метрики или, в многопроцессном режиме, сумма по файлам всех процессов """
+    if not MULTIPROC_DIR:
+        return generate_latest(registry)
+    merged = CollectorRegistry()
+    MultiProcessCollector(merged, path=MULTIPROC_DIR)
+    for callback in callbacks:
+        merged.register(callback)
+    return generate_latest(merged)
+
+
+HTTP_SECONDS = Histogram(
+    "netviewer_http_request_duration_seconds", "Время до ответа API (до заголовков), по шаблону маршрута",
+    ["method", "route", "status"], buckets=DURATION_BUCKETS, registry=registry
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: время от запроса до начала ответа. Маршрут - шаблон (/core/history/),
+    а не сам путь, иначе метки росли бы с каждым новым URL. Не найденное - "unmatched".
+    Для потоков (/core/events) считается время до заголовков, а не длина потока.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+
+        async def send_measured(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                HTTP_SECONDS.labels(
+                    method=scope["method"], route=getattr(route, "path", "unmatched"), status=message["status"]
+                ).observe(time.perf_counter() - started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_measured)
+        except Exception:
+            # ответ 500 отдаст ServerErrorMiddleware снаружи, мимо send_measured
+            route = scope.get("route")
+            HTTP_SECONDS.labels(
+                method=scope["method"], route=getattr(route, "path", "unmatched"), status=500
+            ).observe(time.perf_counter() - started)
+            raise
+
+
+def check_metrics_token(request: Request):
+    """
+    /metrics без логина пользователя (Prometheus его не пройдет), но с METRICS_TOKEN - только по Bearer-токену:
+    в метриках адреса самых медленных устройств и размеры снимка.
+    """
+    if not settings.METRICS_TOKEN:
+        return
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), settings.METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Metrics token required",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+
+router = APIRouter(tags=["Metrics"], dependencies=[Depends(check_metrics_token)])
+
+
+@router.get("/metrics", summary="Метрики в формате Prometheus")
+async def get_metrics():
+    return Response(render(), media_type=CONTENT_TYPE_LATEST)
@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -14,8 +15,45 @@ class Settings(BaseSettings):
     DB_NAME: str
     DB_USER: str
     DB_PASSWORD: str
+    DB_MAX_POOL_SIZE: int = 100  # соединений с MongoDB в пуле, не больше
+    DB_MIN_POOL_SIZE: int = 0
+    DB_MAX_IDLE_TIME_MS: Optional[int] = None  # простаивающее соединение закрывается через столько мс (None - никогда)
+    DB_SERVER_SELECTION_TIMEOUT_MS: int = 30000  # сколько ждать доступный сервер, прежде чем запрос упадет
+    DB_BATCH_SIZE: int = 1000  # документов за одну выборку курсора
+    DB_INDEX_RETRY_INTERVAL: float = 60  # секунд между попытками создать индексы, пока unique не подтвердятся
     SECRET_KEY: str
     ALGORITHM: str
+    AUTH_CACHE_SIZE: int = 1024  # сколько токенов держать в кэше авторизации
+    AUTH_CACHE_TTL: float = 60  # секунд, после которых пользователь по токену перечитывается из базы
+    AUTH_HASH_WORKERS: int = 2  # потоков для bcrypt: столько паролей проверяется одновременно
+    AUTH_HASH_MAX_QUEUE: int = 32  # сколько проверок может ждать в очереди, сверх этого - 503
+    SNMP_SESSION_IDLE_TIMEOUT: int = 600  # секунд без запросов, после которых сессия к устройству закрывается
+    SNMP_DEVICE_PDU_RATE: float = 50  # не больше стольких SNMP запросов в секунду к одному устройству (0 - без лимита)
+    POLL_MAX_DEVICES: int = 32  # сколько устройств опрашиваем одновременно
+    POLL_WORKERS: int = 0  # процессов для опроса устройств (app.core.workers), 0 - опрос в основном процессе
+    POLL_DEVICE_CONCURRENCY: int = 2  # сколько обходов одного устройства идут параллельно
+    POLL_DEVICE_TIMEOUT: float = 300  # секунд на опрос одного устройства, дальше бросаем его до следующего цикла
+    POLL_CHANGE_DETECTION: bool = True  # перед тяжелыми обходами проверять, изменилось ли что-то на устройстве
+    POLL_LLDP: bool = False  # спрашивать соседей по LLDP (+1 обход на устройство за цикл); дерево - по ним, FDB - для остальных
+    POLL_FULL_WALK_EVERY: int = 10  # не пропускать полный обход устройства больше стольких циклов подряд
+    SNMP_RECORD_FILE: str = ""  # дописывать сырые ответы устройств в этот файл (app.snmp.recorder)
+    SNMP_REPLAY_FILE: str = ""  # отвечать из записи вместо устройств, сеть не трогается
+    DISCOVERY_WINDOW: int = 256  # одновременных SNMP GET при переборе сетей (app.core.discovery)
+    DISCOVERY_TIMEOUT: float = 1  # секунд ждать ответа от адреса при переборе
+    DISCOVERY_RETRIES: int = 0  # повторов запроса к молчащему адресу
+    DISCOVERY_MAX_ADDRESSES: int = 65536  # больше адресов за один перебор не принимаем
+    SNAPSHOT_STORE: str = ""  # где хранить последний снимок для быстрого старта: mongo, file, "" - нигде (снимок целиком каждый цикл)
+    SNAPSHOT_FILE: str = "snapshot.bin"  # файл снимка при SNAPSHOT_STORE=file, относительно каталога проекта
+    CLUSTER_ENABLED: bool = False  # несколько экземпляров: опрашивает один лидер по аренде в MongoDB (app.core.cluster)
+    CLUSTER_LEASE_TTL: float = 15  # секунд жизни аренды лидера: за столько ведомый заменит упавшего лидера
+    CLUSTER_NODE_ID: str = ""  # имя экземпляра в аренде, "" - hostname:pid
+    METRICS_ENABLED: bool = False  # GET /metrics в формате Prometheus и замер времени ответов API (app.metrics)
+    METRICS_TOKEN: str = ""  # /metrics только с заголовком "Authorization: Bearer <токен>"; "" - /metrics открыт всем
+    METRICS_TOP_DEVICES: int = 20  # столько самых медленных устройств цикла отдавать в метриках поименно
+    HISTORY_ENABLED: bool = False  # писать историю MAC-адресов (app.core.history): bulk_write в MongoDB каждый цикл
+    HISTORY_WRITE_INTERVAL: int = 600  # секунд: не чаще этого продлевать last_seen у MAC, который стоит на месте
+    HISTORY_RETENTION_DAYS: int = 180  # сколько хранить историю
+    HISTORY_MAX_LIMIT: int = 1000  # больше стольких отрезков /core/history/ за один запрос не отдает
 
     model_config = SettingsConfigDict(
         env_file=BASE_DIR / "app/.env"
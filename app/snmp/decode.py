@@ -0,0 +1,256 @@
+"""
+Разбор результатов обхода (get_oid_from_to, table_to_walk) без строковых преобразований OID.
+OID берется кортежем целых (ObjectName.asTuple()), хвост после корня - срезом кортежа,
+MAC собирается из октетов (в целое или через таблицу hex-октетов).
+На выходе легкие записи (NamedTuple) для внутренних потребителей вроде CoreManager.
+Pydantic-обертка ResultQueryOID собирается из этих записей только в extract_* для ответов /snmp/*.
+"""
+import functools
+from datetime import timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from pysnmp.proto.rfc1902 import TimeTicks
+
+from app.metrics import Counter, Histogram, registry
+
+# "00".."ff" - чтобы не форматировать каждый октет заново
+HEX_OCTETS = tuple("{:02x}".format(i) for i in range(256))
+# dot1qFdbId - Unsigned32, под него колонка vlans в FdbTable (array("I"))
+FDB_ID_MAX = 2 ** 32 - 1
+
+PARSE_SECONDS = Histogram(
+    "netviewer_parse_duration_seconds", "Время разбора одного ответа функцией decode_*/extract_*", ["function"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5), registry=registry
+)
+
+
+PARSE_SKIPPED = Counter(
+    "netviewer_parse_skipped_rows_total", "Строки обхода с неожиданным индексом, пропущенные при разборе", ["function"],
+    registry=registry
+)
+
+
+def _skipped(function: str, count: int, example):
+    """ Кривые строки не валят разбор всего устройства: пропускаются, счет - в PARSE_SKIPPED и в лог """
+    if count:
+        PARSE_SKIPPED.labels(function=function).inc(count)
+        print("{}: пропущено строк с неожиданным индексом: {}, например {}".format(function, count, example))
+
+
+def parse_timed(function):
+    """ Длительность каждого вызова - в PARSE_SECONDS с меткой по имени функции """
+    timer = PARSE_SECONDS.labels(function=function.__name__)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with timer.time():
+            return function(*args, **kwargs)
+    return wrapper
+
+
+# колонки ipAddrEntry
+IP_ADDR_COLUMNS = {
+    1: "ipAdEntAddr",
+    2: "ipAdEntIfIndex",
+    3: "ipAdEntNetMask",
+    4: "ipAdEntBcastAddr",
+    5: "ipAdEntReasmMaxSize",
+}
+
+
+class FdbRecord(NamedTuple):
+    mac: int
+    vlan: int
+    port: str  # logical_interface_id
+
+
+class PortRecord(NamedTuple):
+    port: str  # logical_interface_id
+    name: str
+
+
+class ArpRecord(NamedTuple):
+    port: str  # logical_interface_id
+    ip: str
+    mac: Optional[int]  # None - пустой (или не Ethernet) ipNetToMediaPhysAddress
+
+
+class LldpRecord(NamedTuple):
+    local_port: int  # lldpRemLocalPortNum, он же индекс lldpLocPortTable
+    chassis_id: str  # MAC, если lldpRemChassisIdSubtype = macAddress(4), иначе текст
+    port_id: str
+    sys_name: str
+    mgmt_ip: str  # IPv4 из lldpRemManAddrTable, "" - не сообщил
+
+
+def oid_tuple(oid) -> Tuple[int, ...]:
+    """ ObjectName/ObjectIdentity/строка -> (1, 3, 6, ...) """
+    if isinstance(oid, str):
+        return tuple(int(el) for el in oid.strip('.').split('.'))
+    return tuple(oid.asTuple())
+
+
+def octets_to_mac(octets) -> str:
+    """ b"\\x00\\x0a..." или кортеж чисел -> "00:0a:..." """
+    return ":".join([HEX_OCTETS[el] for el in octets])
+
+
+def octets_to_int(octets) -> Optional[int]:
+    """ 6 октетов -> 48-битное целое, пусто (или не Ethernet-адрес) -> None """
+    return int.from_bytes(bytes(octets), "big") if len(octets) == 6 else None
+
+
+def int_to_mac(value: int) -> str:
+    return octets_to_mac(value.to_bytes(6, "big"))
+
+
+def _tails(data):
+    """ (хвост OID после oid_start, value) для каждой строки обхода """
+    cut = len(oid_tuple(data["oid_start"]))
+    for oid, value in data["result_list"]:
+        yield oid.asTuple()[cut:], value
+
+
+@parse_timed
+def decode_system_info(data) -> List[Tuple[str, str]]:
+    """
+    Ветка system: [(oid, текст), ...]. Аптайм (TimeTicks) - в виде "59 days, 21:28:43",
+    значения-OID (sysObjectID) пропускаются.
+    """
+    records = []
+    for oid, value in data["result_list"]:
+        if isinstance(value, TimeTicks):
+            records.append((str(oid), str(timedelta(milliseconds=10 * int(value)))))
+        else:
+            text = str(value)
+            if not text.startswith("1.3.6.1"):
+                records.append((str(oid), text))
+    return records
+
+
+@parse_timed
+def decode_mac_vlan_port(data) -> List[FdbRecord]:
+    """
+    dot1qTpFdbPort: 1.3.6.1.2.1.17.7.1.2.2.1.2.VLAN.M.A.C.A.D.R = PORT
+    Пропускаются строки не из 7 чисел, с октетом MAC больше 255 и с FDB id больше FDB_ID_MAX.
+    """
+    records, skipped, example = ([], 0, None)
+    for tail, value in _tails(data):
+        if len(tail) != 7 or tail[0] > FDB_ID_MAX or max(tail[1:]) > 255:
+            skipped, example = (skipped + 1, tail)
+            continue
+        records.append(FdbRecord(int.from_bytes(bytes(tail[1:]), "big"), tail[0], str(int(value))))
+    _skipped("decode_mac_vlan_port", skipped, example)
+    return records
+
+
+@parse_timed
+def decode_ports(data) -> List[PortRecord]:
+    """
+    ifName/ifDescr: 1.3.6.1.2.1.31.1.1.1.1.PORT = PORT_NAME
+    """
+    return [
+        PortRecord(str(tail[0]) if len(tail) == 1 else ".".join(map(str, tail)), str(value))
+        for tail, value in _tails(data)
+    ]
+
+
+@parse_timed
+def decode_ip_addr(data) -> List[Dict[str, str]]:
+    """
+    ipAddrTable: 1.3.6.1.2.1.4.20.1.COLUMN.I.P.A.D = VALUE
+    На выходе по словарю на адрес с ключами из IP_ADDR_COLUMNS (неизвестная колонка - "unknown").
+    """
+    entries: Dict[Tuple[int, ...], Dict[str, str]] = {}
+    skipped, example = (0, None)
+    for tail, value in _tails(data):
+        if len(tail) != 5:
+            skipped, example = (skipped + 1, tail)
+            continue
+        entries.setdefault(tail[1:], {})[IP_ADDR_COLUMNS.get(tail[0], "unknown")] = value.prettyPrint()
+    _skipped("decode_ip_addr", skipped, example)
+    return list(entries.values())
+
+
+@parse_timed
+def decode_arp(data) -> List[ArpRecord]:
+    """
+    ipNetToMediaPhysAddress: 1.3.6.1.2.1.4.22.1.2.IFINDEX.I.P.A.D = MAC
+    """
+    records, skipped, example = ([], 0, None)
+    for tail, value in _tails(data):
+        if len(tail) != 5:
+            skipped, example = (skipped + 1, tail)
+            continue
+        records.append(ArpRecord(str(tail[0]), "%d.%d.%d.%d" % tail[1:], octets_to_int(value.asOctets())))
+    _skipped("decode_arp", skipped, example)
+    return records
+
+
+@parse_timed
+def decode_phys_address(data) -> Dict[str, Optional[int]]:
+    """
+    ifPhysAddress: 1.3.6.1.2.1.2.2.1.6.PORT = MAC -> {PORT: mac}, пустой MAC - None
+    """
+    return {".".join(map(str, tail)): octets_to_int(value.asOctets()) for tail, value in _tails(data)}
+
+
+def lldp_text(value) -> str:
+    """ Идентификатор LLDP: печатный текст как есть, 6 октетов - MAC, остальное - hex """
+    octets = value.asOctets()
+    if octets and all(32 <= el < 127 for el in octets):
+        return octets.decode("ascii")
+    if len(octets) == 6:
+        return octets_to_mac(octets)
+    return octets.hex()
+
+
+@parse_timed
+def decode_lldp_local_ports(data) -> Dict[int, List[str]]:
+    """
+    lldpLocPortTable: 1.0.8802.1.1.2.1.3.7.1.COLUMN.PORTNUM = VALUE, колонки lldpLocPortId (3) и lldpLocPortDesc (4)
+    -> {PORTNUM: [PortId, PortDesc]} - по ним lldpLocPortNum сопоставляется с ifIndex
+    """
+    ports: Dict[int, List[str]] = {}
+    for tail, value in _tails(data):
+        if len(tail) != 2:
+            raise ValueError("unexpected lldpLocPortTable index {}".format(tail))
+        ports.setdefault(tail[1], []).append(lldp_text(value))
+    return ports
+
+
+@parse_timed
+def decode_lldp_remote(rem_data, man_addr_data) -> List[LldpRecord]:
+    """
+    lldpRemTable: 1.0.8802.1.1.2.1.4.1.1.COLUMN.TIMEMARK.LOCALPORT.INDEX = VALUE,
+    колонки lldpRemChassisIdSubtype (4), lldpRemChassisId (5), lldpRemPortId (7), lldpRemSysName (9).
+    lldpRemManAddrTable: 1.0.8802.1.1.2.1.4.2.1.COLUMN.TIMEMARK.LOCALPORT.INDEX.SUBTYPE.LEN.A.D.D.R -
+    адрес только в индексе, IPv4 - SUBTYPE 1 и LEN 4.
+    """
+    rows: Dict[Tuple[int, ...], Dict[int, object]] = {}
+    for tail, value in _tails(rem_data):
+        if len(tail) != 4:
+            raise ValueError("unexpected lldpRemTable index {}".format(tail))
+        rows.setdefault(tail[1:], {})[tail[0]] = value
+
+    addresses: Dict[Tuple[int, ...], str] = {}
+    for tail, _ in _tails(man_addr_data):
+        if len(tail) == 10 and tail[4:6] == (1, 4):
+            addresses.setdefault(tail[1:4], "%d.%d.%d.%d" % tail[6:])
+
+    records = []
+    for index, columns in rows.items():
+        if 5 not in columns:
+            continue
+        chassis_id = columns[5]
+        if int(columns.get(4, 0)) == 4 and len(chassis_id.asOctets()) == 6:
+            chassis_id = octets_to_mac(chassis_id.asOctets())
+        else:
+            chassis_id = lldp_text(chassis_id)
+        records.append(LldpRecord(
+            index[1], chassis_id,
+            lldp_text(columns[7]) if 7 in columns else "",
+            str(columns[9]) if 9 in columns else "",
+            addresses.get(index, "")
+        ))
+    return records
@@ -10,6 +10,7 @@ class QueryOID(BaseModel):
     snmp_ver: int = 1  # 0 - for SNMP v1, 1 - for SNMP v2c (default)
     oid_start: str
     oid_stop: str
+    max_repetitions: int = 25  # сколько строк просить в одном GETBULK (только для SNMP v2c)
 
     model_config = {
         "json_schema_extra": {
@@ -27,6 +28,7 @@ class QueryOID(BaseModel):
                         "snmp_ver": 1,
                         "oid_start": "oid.1",
                         "oid_stop": "oid.2",
+                        "max_repetitions": 25,
                     }
                 }
             ]
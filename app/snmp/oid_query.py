@@ -1,28 +1,161 @@
-import re
+from typing import Iterable, List, Optional, Tuple
 
 from pysnmp.hlapi import varbinds
 from pysnmp.hlapi.asyncio import *
-
+from pysnmp.proto.rfc1905 import EndOfMibView, NoSuchObject, NoSuchInstance
+
+from app.metrics import Counter, registry
+from app.settings import settings
+from app.snmp.decode import (
+    IP_ADDR_COLUMNS,
+    oid_tuple,
+    int_to_mac,
+    decode_ip_addr,
+    decode_mac_vlan_port,
+    decode_ports,
+    decode_arp,
+    decode_phys_address,
+    parse_timed,
+)
 from app.snmp.models import QueryOID, ResultQueryOID
+from app.snmp.recorder import Frame, ReplaySource, WalkRecorder
+from app.snmp.session import SnmpSession, session_pool
 
 snmp_engine = SnmpEngine()
 mibViewController = varbinds.AbstractVarBinds.getMibViewController(snmp_engine)
 
+# Запись сырых ответов в файл и воспроизведение из него вместо сети (app.snmp.recorder)
+walk_recorder: Optional[WalkRecorder] = WalkRecorder(settings.SNMP_RECORD_FILE) if settings.SNMP_RECORD_FILE else None
+replay_source: Optional[ReplaySource] = ReplaySource.load(settings.SNMP_REPLAY_FILE) if settings.SNMP_REPLAY_FILE else None
+
+SNMP_PDUS = Counter("netviewer_snmp_pdus_total", "SNMP-запросов отправлено устройствам", ["kind"], registry=registry)
+SNMP_ERRORS = Counter(
+    "netviewer_snmp_errors_total",
+    "Неудачные SNMP-запросы: timeout - нет ответа, transport - прочие ошибки, status - агент ответил ошибкой",
+    ["type"], registry=registry
+)
+
 # Нет доверия к этой конструкции, а если некий новоявленный прибор даст свой вариант реализации?
-info_key = {
-    "1": "ipAdEntAddr",
-    "2": "ipAdEntIfIndex",
-    "3": "ipAdEntNetMask",
-    "4": "ipAdEntBcastAddr",
-    "5": "ipAdEntReasmMaxSize",
-}
+info_key = {str(key): name for key, name in IP_ADDR_COLUMNS.items()}
+
+
+def _error_status_text(error_status, error_index, var_binds) -> str:
+    """
+    Текст ошибки уровня PDU. var_binds - таблица строк, как ее отдают nextCmd/bulkCmd.
+    """
+    var_bind = '?'
+    if error_index and var_binds and len(var_binds[0]) >= int(error_index):
+        var_bind = var_binds[0][int(error_index) - 1][0]
+    return "ERROR_STATUS: {} at {}".format(error_status.prettyPrint(), var_bind)
+
+
+def _replayed(query: QueryOID, frame: Optional[Frame], oid) -> Tuple[list, Optional[str]]:
+    """
+    Строки и ошибка записанного ответа. Нет записи - как будто устройство не ответило.
+    """
+    if frame is None:
+        return [], "REPLAY: no recorded answer from {}:{} for {}".format(query.host, query.port, oid)
+    return list(frame.rows), frame.error
+
+
+def _count_pdu(kind: str, error_indication, error_status):
+    SNMP_PDUS.labels(kind=kind).inc()
+    if error_indication:
+        SNMP_ERRORS.labels(type="timeout" if "timeout" in str(error_indication).lower() else "transport").inc()
+    elif error_status:
+        SNMP_ERRORS.labels(type="status").inc()
+
+
+def _is_end_of_walk(value) -> bool:
+    """
+    Агент сообщает о конце MIB-дерева или отсутствии объекта - дальше идти некуда.
+    """
+    return value.tagSet in (EndOfMibView.tagSet, NoSuchObject.tagSet, NoSuchInstance.tagSet)
+
+
+async def _walk_next(session: SnmpSession, oid_current, oid_stop, results: dict):
+    """
+    Обход по одному GETNEXT на строку. Единственный вариант для SNMP v1.
+    """
+    while True:
+
+        await session.limiter.acquire()
+        error_indication, error_status, error_index, var_binds = await nextCmd(
+            snmp_engine,
+            session.auth,
+            session.transport,
+            session.context,
+            ObjectType(ObjectIdentity(oid_current)),
+            lookupMib=False
+        )
+        _count_pdu("next", error_indication, error_status)
+
+        if error_indication:
+            print("ERROR:: ", error_indication)
+            results["error"] = str(error_indication)
+            break
+        elif error_status:
+            results["error"] = _error_status_text(error_status, error_index, var_binds)
+            print(results["error"])
+            break
+        else:
+            oid_current, value = var_binds[0][0]
+            if oid_current >= oid_stop or _is_end_of_walk(value):
+                break
+            else:
+                # print("value: {}, type: {}".format(str(value), type(value)))
+                results["result_list"].append([oid_current, value])
+                results["count"] += 1
+
+
+async def _walk_bulk(session: SnmpSession, max_repetitions: int, oid_current, oid_stop, results: dict):
+    """
+    Обход через GETBULK (SNMP v2c): за один запрос агент отдает до max_repetitions строк.
+    Ответ может "перелететь" за oid_stop - хвост отбрасываем и заканчиваем обход.
+    """
+    while True:
+
+        await session.limiter.acquire()
+        error_indication, error_status, error_index, var_bind_table = await bulkCmd(
+            snmp_engine,
+            session.auth,
+            session.transport,
+            session.context,
+            0, max_repetitions,
+            ObjectType(ObjectIdentity(oid_current)),
+            lookupMib=False
+        )
+        _count_pdu("bulk", error_indication, error_status)
+
+        if error_indication:
+            print("ERROR:: ", error_indication)
+            results["error"] = str(error_indication)
+            return
+        elif error_status:
+            results["error"] = _error_status_text(error_status, error_index, var_bind_table)
+            print(results["error"])
+            return
+        elif not var_bind_table:
+            return
+
+        for row in var_bind_table:
+            oid_current, value = row[0]
+            if oid_current >= oid_stop or _is_end_of_walk(value):
+                return
+            results["result_list"].append([oid_current, value])
+            results["count"] += 1
 
 
 async def get_oid_from_to(query: QueryOID):
     """
     Запрашивает список oid начиная с query.oid_start до query.oid_stop (исключая последний).
+    Для SNMP v2c обход идет через GETBULK по query.max_repetitions строк за запрос,
+    для SNMP v1 (snmp_ver=0) - по одному GETNEXT на строку.
     Возвращает словарь, в котором в ключе result_list список объектов
-    [pysnmp.proto.rfc1902.ObjectIdentity, pysnmp.proto.rfc1902.Integer/OctetString/...]
+    [pysnmp.proto.rfc1902.ObjectName, pysnmp.proto.rfc1902.Integer/OctetString/...]
+    Ответы не прогоняются через MIB (lookupMib=False): это в разы дороже самого разбора,
+    а extract_*/decode_* нужны только числовые OID.
+    С walk_recorder ответ дописывается в файл записи, с replay_source - берется из записи, без сети.
     """
     print("New query: {}:{} ({}) {} - {}".format(
         query.host, query.port, query.community, query.oid_start, query.oid_stop
@@ -38,49 +171,203 @@ async def get_oid_from_to(query: QueryOID):
         "count": 0,
         "error": None,
     }
-    oid_current = oid_start
 
-    while True:
+    if replay_source is not None:
+        frame = replay_source.walk(query.host, query.port, oid_start.getOid(), oid_stop.getOid())
+        results["result_list"], results["error"] = _replayed(query, frame, oid_start)
+        results["count"] = len(results["result_list"])
+        return results
+
+    # транспорт и community к устройству берем из пула, а не собираем на каждый запрос
+    session = session_pool.get(query)
+    if query.snmp_ver and query.max_repetitions > 1:
+        await _walk_bulk(session, query.max_repetitions, oid_start.getOid(), oid_stop.getOid(), results)
+    else:
+        await _walk_next(session, oid_start.getOid(), oid_stop.getOid(), results)
+
+    if walk_recorder is not None:
+        walk_recorder.walk(
+            query.host, query.port, oid_start.getOid(), oid_stop.getOid(), results["error"], results["result_list"]
+        )
+    return results
 
-        error_indication, error_status, error_index, var_binds = await nextCmd(
-            snmp_engine,
-            CommunityData(query.community, mpModel=query.snmp_ver),
-            UdpTransportTarget((query.host, query.port)),
-            ContextData(),
-            ObjectType(oid_current)
+
+async def get_oids(query: QueryOID, oids: List[str]):
+    """
+    Один GET на несколько скалярных OID сразу (query.oid_start/oid_stop не используются).
+    Объекты, которых на устройстве нет (noSuchObject/noSuchInstance), в результат не попадают.
+    На выходе словарь как у get_oid_from_to(): result_list из [oid, value], count, error.
+    """
+    results = {
+        "result_list": [],
+        "count": 0,
+        "error": None,
+    }
+    if replay_source is not None:
+        frame = replay_source.get(query.host, query.port, [oid_tuple(oid) for oid in oids])
+        results["result_list"], results["error"] = _replayed(query, frame, oids)
+        results["count"] = len(results["result_list"])
+        return results
+
+    session = session_pool.get(query)
+
+    await session.limiter.acquire()
+    error_indication, error_status, error_index, var_binds = await getCmd(
+        snmp_engine, session.auth, session.transport, session.context,
+        *[ObjectType(ObjectIdentity(oid)) for oid in oids],
+        lookupMib=False
+    )
+    _count_pdu("get", error_indication, error_status)
+
+    if error_indication:
+        results["error"] = str(error_indication)
+    elif error_status:
+        results["error"] = _error_status_text(error_status, error_index, [var_binds])
+    else:
+        for oid, value in var_binds:
+            if not _is_end_of_walk(value):
+                results["result_list"].append([oid, value])
+                results["count"] += 1
+
+    if walk_recorder is not None:
+        walk_recorder.get(
+            query.host, query.port, [oid_tuple(oid) for oid in oids], results["error"], results["result_list"]
         )
+    return results
+
+
+def ip_addr_columns(oid_start: str, oid_stop: str) -> List[Tuple[str, str]]:
+    """
+    Разбивает диапазон ipAddrEntry (oid_start - oid_stop) на колонки из info_key
+    для get_table(): [(oid_start.1, oid_start.2), ..., (oid_start.5, oid_stop)]
+    """
+    oid_start = oid_start.rstrip('.')
+    keys = sorted(info_key, key=int)
+    columns = [(oid_start + '.' + key, oid_start + '.' + next_key) for key, next_key in zip(keys, keys[1:])]
+    columns.append((oid_start + '.' + keys[-1], oid_stop))
+    return columns
+
+
+async def get_table(query: QueryOID, columns: List[Tuple[str, str]]):
+    """
+    Обход нескольких колонок таблицы (или просто нескольких диапазонов OID) одновременно:
+    в каждом запросе по одному varbind на каждую еще не законченную колонку.
+    columns - список пар (oid_start, oid_stop), query задает только устройство и max_repetitions.
+    Для SNMP v2c обход идет через GETBULK, для SNMP v1 - через GETNEXT.
+
+    На выходе словарь:
+    {
+        "columns": [ObjectIdentity oid_start колонки, ...],
+        "column_lists": [[[oid, value], ...], ...],  # по колонке, как result_list у get_oid_from_to
+        "rows": {"index": {номер колонки: value}},   # строки, собранные по индексу (хвосту OID после колонки)
+        "count": int,
+        "error": str,
+    }
+    Колонку в виде, понятном extract_*, отдает table_to_walk().
+    """
+    print("New table query: {}:{} ({}) {} columns".format(
+        query.host, query.port, query.community, len(columns)
+    ))
+
+    starts = [ObjectIdentity(start).resolveWithMib(mibViewController) for start, _ in columns]
+    stops = [ObjectIdentity(stop).resolveWithMib(mibViewController).getOid() for _, stop in columns]
+    prefixes = [str(start) + '.' for start in starts]
+
+    results = {
+        "columns": starts,
+        "column_lists": [[] for _ in columns],
+        "rows": {},
+        "count": 0,
+        "error": None,
+    }
+    current = [start.getOid() for start in starts]
+
+    def add_row(col, oid, value):
+        results["column_lists"][col].append([oid, value])
+        results["rows"].setdefault(str(oid)[len(prefixes[col]):], {})[col] = value
+        results["count"] += 1
+
+    if replay_source is not None:
+        # каждая колонка записана отдельным обходом своего диапазона
+        for col, start in enumerate(current):
+            rows, error = _replayed(query, replay_source.walk(query.host, query.port, start, stops[col]), start)
+            for oid, value in rows:
+                add_row(col, oid, value)
+            results["error"] = results["error"] or error
+        return results
+
+    active = list(range(len(columns)))
+    session = session_pool.get(query)
+    use_bulk = query.snmp_ver and query.max_repetitions > 1
+
+    while active:
+        var_binds = [ObjectType(ObjectIdentity(current[col])) for col in active]
+        await session.limiter.acquire()
+        if use_bulk:
+            error_indication, error_status, error_index, var_bind_table = await bulkCmd(
+                snmp_engine, session.auth, session.transport, session.context,
+                0, query.max_repetitions, *var_binds, lookupMib=False
+            )
+        else:
+            error_indication, error_status, error_index, var_bind_table = await nextCmd(
+                snmp_engine, session.auth, session.transport, session.context, *var_binds, lookupMib=False
+            )
+        _count_pdu("bulk" if use_bulk else "next", error_indication, error_status)
 
         if error_indication:
             print("ERROR:: ", error_indication)
             results["error"] = str(error_indication)
             break
         elif error_status:
-            print("ERROR_STATUS: {} at {}".format(
-                error_status.prettyPrint(),
-                error_index and var_binds[int(error_index) - 1][0] or '?'
-            ))
-            results["error"] = "ERROR_STATUS: {} at {}".format(
-                error_status.prettyPrint(),
-                error_index and var_binds[int(error_index) - 1][0] or '?'
-            )
+            results["error"] = _error_status_text(error_status, error_index, var_bind_table)
+            print(results["error"])
+            break
+        elif not var_bind_table:
             break
-        else:
-            oid_current, value = var_binds[0][0]
-            if oid_current >= oid_stop:
-                break
-            else:
-                # print("value: {}, type: {}".format(str(value), type(value)))
-                results["result_list"].append([oid_current, value])
-                results["count"] += 1
 
+        finished = set()
+        for row in var_bind_table:
+            # агент может урезать последнюю строку, чтобы ответ влез в датаграмму
+            for col, var_bind in zip(active, row):
+                if col in finished:
+                    continue
+                oid, value = var_bind
+                if oid >= stops[col] or _is_end_of_walk(value):
+                    finished.add(col)
+                    continue
+                current[col] = oid
+                add_row(col, oid, value)
+
+        active = [col for col in active if col not in finished]
+
+    if walk_recorder is not None:
+        for col, start in enumerate(starts):
+            walk_recorder.walk(
+                query.host, query.port, start.getOid(), stops[col], results["error"], results["column_lists"][col]
+            )
     return results
 
 
+def table_to_walk(table: dict, oid_start: str, columns: Iterable[int]) -> dict:
+    """
+    Собирает из результата get_table() структуру как у get_oid_from_to() - для extract_*.
+    oid_start - корень, от которого extract_* отсчитывают хвост OID; columns - номера колонок в запросе.
+    """
+    result_list = [elem for col in columns for elem in table["column_lists"][col]]
+    return {
+        "oid_start": ObjectIdentity(oid_start).resolveWithMib(mibViewController),
+        "result_list": result_list,
+        "count": len(result_list),
+        "error": table["error"],
+    }
+
+
+@parse_timed
 def extract_info_ip(data) -> ResultQueryOID:
     """
     Принимает на входе результат опроса коммутатора - структуру данных которую отдает get_oid_from_to(),
     внутри списка result_list объекты времени выполнения:
-    [pysnmp.proto.rfc1902.ObjectIdentity, pysnmp.proto.rfc1902.Integer/OctetString/...]
+    [pysnmp.proto.rfc1902.ObjectName, pysnmp.proto.rfc1902.Integer/OctetString/...]
     Функциональность не работает с операциями ввода/вывода, поэтому не async
     *************************************************************************************************
     Эквивалент `SnmpWalk -csv -v:2c -c:public -r:host -os:.1.3.6.1.2.1.4.20.1 -op:.1.3.6.1.2.1.4.20.2`
@@ -103,17 +390,9 @@ def extract_info_ip(data) -> ResultQueryOID:
     }
     """
 
-    oid_root = str(data["oid_start"]) + '.'
     results = ResultQueryOID()
-    ip_addr_entry = {}
     try:
-        for elem in data["result_list"]:
-            key, addr = str(elem[0]).split(oid_root)[1].split('.', maxsplit=1)
-            ip_addr_entry.setdefault(addr, {})
-            info_key.setdefault(key, "unknown")  # возможно это излишняя страховка
-            ip_addr_entry[addr].update({info_key[key]: elem[1].prettyPrint()})
-
-        results.results_list = [ip_addr_entry[el] for el in ip_addr_entry]
+        results.results_list = decode_ip_addr(data)
         results.count = len(results.results_list)
     except Exception as ex:
         results.error = "extract_info_ip: Error was occurred: {}".format(ex)
@@ -121,11 +400,12 @@ def extract_info_ip(data) -> ResultQueryOID:
     return results
 
 
+@parse_timed
 def extract_mac_vlan_port(data) -> ResultQueryOID:
     """
     Принимает на входе результат опроса коммутатора - структуру данных которую отдает get_oid_from_to(),
     внутри списка result_list объекты времени выполнения:
-    [pysnmp.proto.rfc1902.ObjectIdentity, pysnmp.proto.rfc1902.Integer/OctetString/...]
+    [pysnmp.proto.rfc1902.ObjectName, pysnmp.proto.rfc1902.Integer/OctetString/...]
     Функциональность не работает с операциями ввода/вывода, поэтому не async
     *************************************************************************************************
     Структура OID-шек с маками такова:
@@ -137,45 +417,26 @@ def extract_mac_vlan_port(data) -> ResultQueryOID:
     А комментарий/описание порта можно вынуть из 1.3.6.1.2.1.31.1.1.1.18.PORT
     !!! Обязательно проверять значение ключа error. Если оно не null - результатам верить нельзя.
     """
-    oid_root = str(data["oid_start"])
     results = ResultQueryOID()
-
-    reg_exp = re.compile(oid_root + '.')    # для всех в этом запросе будет одинаковый
-    for elem in data["result_list"]:
-        try:
-            cut_oid = reg_exp.split(str(elem[0]))
-            # print("elem: {} = {}".format(str(elem[0]), str(elem[1])))
-            if len(cut_oid):
-                # vlan указан в позиции между OID и MAC
-                vlan_and_mac = cut_oid[1].split('.')
-                vlan = vlan_and_mac[0]
-                # mac представлен в десятичных числах, переводим в hex
-                mac = ":".join(['{0:02x}'.format(int(el)) for el in vlan_and_mac[1:]])
-                logical_interface_id = str(elem[1])
-                # print("\tmac: {},\tvlan: {},\tlogical_interface_id: {}".format(mac, vlan, logical_interface_id))
-                results.results_list.append(
-                    {
-                        "mac": mac,
-                        "vlan": vlan,
-                        "logical_interface_id": logical_interface_id
-                    }
-                )
-                results.count += 1
-        except Exception as ex:
-            print("\n{}\nПри разборе элемента произошла ошибка\n{}".format(
-                str(elem), ex
-            ))
-            results.error = "extract_mac_vlan_port: Exception: {}".format(ex)
-            break
+    try:
+        results.results_list = [
+            {"mac": int_to_mac(rec.mac), "vlan": str(rec.vlan), "logical_interface_id": rec.port}
+            for rec in decode_mac_vlan_port(data)
+        ]
+        results.count = len(results.results_list)
+    except Exception as ex:
+        print("\nПри разборе элемента произошла ошибка\n{}".format(ex))
+        results.error = "extract_mac_vlan_port: Exception: {}".format(ex)
 
     return results
 
 
+@parse_timed
 def extract_port_and_port_name(data) -> ResultQueryOID:
     """
     Принимает на входе результат опроса коммутатора - структуру данных которую отдает get_oid_from_to(),
     внутри списка result_list объекты времени выполнения:
-    [pysnmp.proto.rfc1902.ObjectIdentity, pysnmp.proto.rfc1902.Integer/OctetString/...]
+    [pysnmp.proto.rfc1902.ObjectName, pysnmp.proto.rfc1902.Integer/OctetString/...]
     Функциональность не работает с операциями ввода/вывода, поэтому не async
     *************************************************************************************************
     Струкрура OID-шек с инфо по портам такова:
@@ -194,33 +455,24 @@ def extract_port_and_port_name(data) -> ResultQueryOID:
     }
     """
     results = ResultQueryOID()
-    oid_root_str = str(data["oid_start"]) + '.'
-
-    for elem in data["result_list"]:
-        try:
-            results.results_list.append(
-                {
-                    "logical_interface_id": str(elem[0]).split(oid_root_str)[1],
-                    "port_name": str(elem[1])
-                }
-            )
-            results.count += 1
-
-        except Exception as ex:
-            print("\n{}\nПри разборе элемента произошла ошибка\n{}".format(
-                str(elem), ex
-            ))
-            results.error = "extract_port_and_port_name: Exception: {}".format(ex)
-            break
+    try:
+        results.results_list = [
+            {"logical_interface_id": rec.port, "port_name": rec.name} for rec in decode_ports(data)
+        ]
+        results.count = len(results.results_list)
+    except Exception as ex:
+        print("\nПри разборе элемента произошла ошибка\n{}".format(ex))
+        results.error = "extract_port_and_port_name: Exception: {}".format(ex)
 
     return results
 
 
+@parse_timed
 def extract_arp_table(data) -> ResultQueryOID:
     """
     Принимает на входе результат опроса коммутатора - структуру данных которую отдает get_oid_from_to(),
     внутри списка result_list объекты времени выполнения:
-    [pysnmp.proto.rfc1902.ObjectIdentity, pysnmp.proto.rfc1902.Integer/OctetString/...]
+    [pysnmp.proto.rfc1902.ObjectName, pysnmp.proto.rfc1902.Integer/OctetString/...]
     Функциональность не работает с операциями ввода/вывода, поэтому не async
     *************************************************************************************************
     {
@@ -236,19 +488,11 @@ def extract_arp_table(data) -> ResultQueryOID:
     }
     """
     results = ResultQueryOID()
-    oid_root_str = str(data["oid_start"]) + '.'
-
     try:
-        for elem in data["result_list"]:
-            logical_interface_id, ip_addr = str(elem[0]).split(oid_root_str)[1].split(".", maxsplit=1)
-            mac: OctetString = elem[1]
-            results.results_list.append(
-                {
-                    "logical_interface_id": logical_interface_id,
-                    "ip_addr": ip_addr,
-                    "mac": ":".join(["{0:02x}".format(el) for el in mac.asNumbers()]),
-                }
-            )
+        results.results_list = [
+            {"logical_interface_id": rec.port, "ip_addr": rec.ip, "mac": int_to_mac(rec.mac) if rec.mac is not None else ""}
+            for rec in decode_arp(data)
+        ]
         results.count = len(results.results_list)
     except Exception as ex:
         print("\nПри разборе элемента произошла ошибка\n{}".format(ex))
@@ -257,20 +501,13 @@ def extract_arp_table(data) -> ResultQueryOID:
     return results
 
 
+@parse_timed
 def extract_mac_addr(data) -> ResultQueryOID:
     results = ResultQueryOID()
-    oid_root_str = str(data["oid_start"]) + '.'
     try:
-        tmp_dict = {"ports": {}}
-        for elem in data["result_list"]:
-            mac: OctetString = elem[1]
-            tmp_dict["ports"].update(
-                {
-                    str(elem[0]).split(oid_root_str)[1]:
-                    ":".join(["{0:02x}".format(el) for el in mac.asNumbers()]),
-                }
-            )
-        results.results_list.append(tmp_dict)
+        results.results_list.append({"ports": {
+            port: int_to_mac(mac) if mac is not None else "" for port, mac in decode_phys_address(data).items()
+        }})
         results.count = len(results.results_list)
     except Exception as ex:
         print("\nПри разборе элемента произошла ошибка\n{}".format(ex))
@@ -0,0 +1,228 @@
+"""
+Запись и воспроизведение сырых ответов устройств.
+Режим записи (SNMP_RECORD_FILE): каждый обход get_oid_from_to, каждая колонка get_table и каждый GET get_oids
+дописываются кадром в бинарный файл - только в конец, файл можно копировать прямо во время опроса.
+Режим воспроизведения (SNMP_REPLAY_FILE): те же функции отвечают из файла, сеть не трогается.
+Дальше ответы идут обычным путем - decode_*/extract_*, update_device_info, сборка дерева.
+
+Формат файла: MAGIC, затем кадры "<I длина><тело>". Тело:
+    вид (b"W" - обход диапазона, b"G" - GET), время записи (double),
+    host, port, для W - oid_start и oid_stop, для G - список запрошенных OID,
+    текст ошибки (пустой - ошибки не было), строки [(oid, значение)].
+OID - "<H число элементов" и сами элементы "<I", значение - байт типа и его содержимое.
+Community в файл не пишется.
+"""
+import struct
+import time
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from pysnmp.proto import rfc1902
+
+MAGIC = b"NVSNMP1\n"
+WALK = b"W"
+GET = b"G"
+
+_FRAME_LEN = struct.Struct("<I")
+_HEAD = struct.Struct("<cdH")  # вид, время, порт
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_U64 = struct.Struct("<Q")
+
+# код типа в файле -> (класс значения, как пишется: "int" - знаковое, "uint" - беззнаковое, "bytes", "oid")
+VALUE_TYPES = {
+    0: (rfc1902.Integer32, "int"),
+    1: (rfc1902.OctetString, "bytes"),
+    2: (rfc1902.ObjectIdentifier, "oid"),
+    3: (rfc1902.IpAddress, "bytes"),
+    4: (rfc1902.Counter32, "uint"),
+    5: (rfc1902.Gauge32, "uint"),
+    6: (rfc1902.TimeTicks, "uint"),
+    7: (rfc1902.Opaque, "bytes"),
+    8: (rfc1902.Counter64, "uint"),
+}
+# типы различаем по тегу ASN.1: у Unsigned32 тег как у Gauge32, у Bits - как у OctetString
+_TYPE_CODES = {cls.tagSet: code for code, (cls, _) in VALUE_TYPES.items()}
+
+
+class Frame(NamedTuple):
+    kind: bytes
+    recorded_at: float
+    host: str
+    port: int
+    oids: Tuple[Tuple[int, ...], ...]  # W - (oid_start, oid_stop), G - запрошенные OID
+    error: Optional[str]
+    rows: List[Tuple[rfc1902.ObjectName, object]]  # как result_list у get_oid_from_to
+
+
+def _pack_str(text: str) -> bytes:
+    data = text.encode()
+    return _U32.pack(len(data)) + data
+
+
+def _pack_oid(oid: Tuple[int, ...]) -> bytes:
+    return _U16.pack(len(oid)) + struct.pack("<%dI" % len(oid), *oid)
+
+
+def _pack_value(value) -> bytes:
+    code = _TYPE_CODES.get(value.tagSet)
+    if code is None:
+        raise ValueError("unsupported SNMP value type {}".format(value.__class__.__name__))
+    kind = VALUE_TYPES[code][1]
+    if kind == "int":
+        return _U8.pack(code) + _I64.pack(int(value))
+    if kind == "uint":
+        return _U8.pack(code) + _U64.pack(int(value))
+    if kind == "oid":
+        return _U8.pack(code) + _pack_oid(tuple(value))
+    data = value.asOctets()
+    return _U8.pack(code) + _U32.pack(len(data)) + data
+
+
+def pack_frame(kind: bytes, host: str, port: int, oids, error: Optional[str], rows) -> bytes:
+    """ rows - [(ObjectName, значение)] как в result_list """
+    parts = [_HEAD.pack(kind, time.time(), port), _pack_str(host), _U16.pack(len(oids))]
+    parts.extend(_pack_oid(tuple(oid)) for oid in oids)
+    parts.append(_pack_str(error or ""))
+    parts.append(_U32.pack(len(rows)))
+    for oid, value in rows:
+        parts.append(_pack_oid(oid.asTuple()))
+        parts.append(_pack_value(value))
+    body = b"".join(parts)
+    return _FRAME_LEN.pack(len(body)) + body
+
+
+class _Reader:
+    """ Разбор тела кадра по смещению """
+    __slots__ = ("data", "pos")
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def take(self, fmt: struct.Struct):
+        value = fmt.unpack_from(self.data, self.pos)
+        self.pos += fmt.size
+        return value
+
+    def bytes(self) -> bytes:
+        size, = self.take(_U32)
+        self.pos += size
+        return self.data[self.pos - size:self.pos]
+
+    def oid(self) -> Tuple[int, ...]:
+        size, = self.take(_U16)
+        oid = struct.unpack_from("<%dI" % size, self.data, self.pos)
+        self.pos += 4 * size
+        return oid
+
+    def value(self):
+        code, = self.take(_U8)
+        if code not in VALUE_TYPES:
+            raise ValueError("unknown value type code {}".format(code))
+        cls, kind = VALUE_TYPES[code]
+        if kind == "int":
+            return cls(self.take(_I64)[0])
+        if kind == "uint":
+            return cls(self.take(_U64)[0])
+        if kind == "oid":
+            return cls(self.oid())
+        return cls(self.bytes())
+
+
+def unpack_frame(body: bytes) -> Frame:
+    reader = _Reader(body)
+    kind, recorded_at, port = reader.take(_HEAD)
+    host = reader.bytes().decode()
+    oids = tuple(reader.oid() for _ in range(reader.take(_U16)[0]))
+    error = reader.bytes().decode() or None
+    rows = [(rfc1902.ObjectName(reader.oid()), reader.value()) for _ in range(reader.take(_U32)[0])]
+    return Frame(kind, recorded_at, host, port, oids, error, rows)
+
+
+def read_frames(path: str) -> Iterator[Frame]:
+    """
+    Кадры файла по порядку. Недописанный последний кадр (процесс прибили посреди записи) молча отбрасывается.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not an SNMP recording".format(path))
+        while True:
+            head = f.read(_FRAME_LEN.size)
+            if len(head) < _FRAME_LEN.size:
+                return
+            size, = _FRAME_LEN.unpack(head)
+            body = f.read(size)
+            if len(body) < size:
+                return
+            yield unpack_frame(body)
+
+
+class WalkRecorder:
+    """
+    Дописывает кадры в файл. Кадр пишется одним write и сразу сбрасывается на диск,
+    поэтому параллельные обходы не перемешиваются, а оборванный файл теряет не больше одного кадра.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: BinaryIO = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+            self._file.flush()
+        self.frames = 0
+
+    def _write(self, frame: bytes):
+        self._file.write(frame)
+        self._file.flush()
+        self.frames += 1
+
+    def walk(self, host: str, port: int, oid_start, oid_stop, error: Optional[str], rows):
+        self._write(pack_frame(WALK, host, port, (oid_start, oid_stop), error, rows))
+
+    def get(self, host: str, port: int, oids, error: Optional[str], rows):
+        self._write(pack_frame(GET, host, port, oids, error, rows))
+
+    def close(self):
+        self._file.close()
+
+
+class ReplaySource:
+    """
+    Ответы из записи, ключ - (вид, host, port, OID запроса).
+    Если один и тот же запрос записан несколько раз (несколько циклов опроса), ответы отдаются по очереди,
+    последний повторяется - так воспроизводится ход нескольких циклов подряд.
+    """
+
+    def __init__(self, frames):
+        self._frames: Dict[tuple, List[Frame]] = {}
+        self._served: Dict[tuple, int] = {}
+        self.hosts: Dict[str, int] = {}
+        for frame in frames:
+            self._frames.setdefault((frame.kind, frame.host, frame.port, frame.oids), []).append(frame)
+            self.hosts.setdefault(frame.host, frame.port)
+
+    @classmethod
+    def load(cls, path: str) -> "ReplaySource":
+        return cls(read_frames(path))
+
+    def __len__(self):
+        return sum(len(frames) for frames in self._frames.values())
+
+    def _next(self, key) -> Optional[Frame]:
+        frames = self._frames.get(key)
+        if not frames:
+            return None
+        served = self._served.get(key, 0)
+        self._served[key] = served + 1
+        return frames[min(served, len(frames) - 1)]
+
+    def walk(self, host: str, port: int, oid_start, oid_stop) -> Optional[Frame]:
+        return self._next((WALK, host, port, (tuple(oid_start), tuple(oid_stop))))
+
+    def get(self, host: str, port: int, oids) -> Optional[Frame]:
+        return self._next((GET, host, port, tuple(tuple(oid) for oid in oids)))
+
+    def rewind(self):
+        self._served.clear()
@@ -1,11 +1,9 @@
-from datetime import timedelta
-
 import pysnmp
 from fastapi import APIRouter, Depends
-from pysnmp.proto.rfc1902 import TimeTicks
 
 from app.auth.auth import get_current_user
 from app.auth.models import UserData4Auth
+from app.snmp.decode import decode_system_info
 from app.snmp.oid_query import (
     QueryOID, get_oid_from_to, extract_mac_vlan_port, ResultQueryOID,
     extract_port_and_port_name, extract_info_ip, extract_arp_table, extract_mac_addr
@@ -90,18 +88,7 @@ async def query_info(query: QueryOID, user: UserData4Auth = Depends(get_current_
 
     try:
         # убираю пустые строки, перевожу аптайм в строку, на выходе словарь
-
-        for el in ret_data["result_list"]:
-            if isinstance(el[1], TimeTicks):
-                results.results_list.append(
-                    {str(el[0]): str(timedelta(milliseconds=10 * int(el[1])))}
-                )
-            else:
-                if not str(el[1]).startswith("1.3.6.1"):
-                    results.results_list.append(
-                        {str(el[0]): str(el[1])}
-                    )
-
+        results.results_list = [{oid: text} for oid, text in decode_system_info(ret_data)]
         results.count = len(results.results_list)
     except Exception as ex:
         print("error: {}".format(ex))
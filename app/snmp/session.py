@@ -0,0 +1,95 @@
+import asyncio
+import time
+from typing import Dict, Tuple
+
+from pysnmp.hlapi.asyncio import CommunityData, ContextData, UdpTransportTarget
+
+from app.settings import settings
+from app.snmp.models import QueryOID
+
+
+class TokenBucket:
+    """
+    Ограничение частоты запросов к устройству: не больше rate PDU в секунду, всплеском до burst.
+    Токены резервируются сразу (счетчик может уйти в минус), поэтому конкурирующим обходам
+    не нужна блокировка - каждый просто спит свою очередь. rate <= 0 - без ограничений.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class SnmpSession:
+    """
+    Все, что нужно для запросов к одному устройству: транспорт, community и контекст.
+    Создается один раз на устройство и переиспользуется между обходами и циклами опроса,
+    вместо того чтобы собирать UdpTransportTarget (с резолвом адреса) на каждый PDU.
+    """
+
+    def __init__(self, host: str, port: int, community: str, snmp_ver: int, pdu_rate: float = 0):
+        self.host = host
+        self.port = port
+        self.transport = UdpTransportTarget((host, port))
+        self.auth = CommunityData(community, mpModel=snmp_ver)
+        self.context = ContextData()
+        self.limiter = TokenBucket(pdu_rate)
+        self.last_used = time.monotonic()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+
+class SnmpSessionPool:
+    """
+    Сессии ключуются по (host, port, community, snmp_ver).
+    У каждой сессии свой TokenBucket на pdu_rate запросов в секунду - бережем CPU коммутаторов.
+    Сессии, которыми не пользовались дольше idle_timeout секунд, выбрасываются при очередном обращении к пулу
+    (но не чаще, чем раз в idle_timeout / 2).
+    """
+
+    def __init__(self, idle_timeout: float, pdu_rate: float = 0):
+        self._idle_timeout = idle_timeout
+        self._pdu_rate = pdu_rate
+        self._sessions: Dict[Tuple[str, int, str, int], SnmpSession] = {}
+        self._last_sweep = time.monotonic()
+
+    def get(self, query: QueryOID) -> SnmpSession:
+        key = (query.host, query.port, query.community, query.snmp_ver)
+        self._evict_idle()
+
+        session = self._sessions.get(key)
+        if session is None:
+            session = SnmpSession(*key, pdu_rate=self._pdu_rate)
+            self._sessions[key] = session
+        session.touch()
+        return session
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        if now - self._last_sweep < self._idle_timeout / 2:
+            return
+        self._last_sweep = now
+        for key in [k for k, s in self._sessions.items() if now - s.last_used > self._idle_timeout]:
+            del self._sessions[key]
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+session_pool = SnmpSessionPool(
+    idle_timeout=settings.SNMP_SESSION_IDLE_TIMEOUT,
+    pdu_rate=settings.SNMP_DEVICE_PDU_RATE
+)
@@ -0,0 +1,133 @@
+import contextlib
+import io
+import unittest
+
+from pysnmp.proto.rfc1902 import Integer, IpAddress, ObjectName, OctetString, TimeTicks
+
+from app.metrics import registry
+from app.snmp import decode, oid_query
+
+
+def walk(oid_start, rows):
+    return {"oid_start": ObjectName(oid_start), "result_list": [[ObjectName(oid), value] for oid, value in rows]}
+
+
+class TestDecode(unittest.TestCase):
+    def test_mac_vlan_port(self):
+        data = walk("1.3.6.1.2.1.17.7.1.2.2.1.2", [
+            ("1.3.6.1.2.1.17.7.1.2.2.1.2.10.0.10.0.0.0.255", Integer(49)),
+            ("1.3.6.1.2.1.17.7.1.2.2.1.2.4094.255.255.255.255.255.254", Integer(1)),
+        ])
+        self.assertEqual(decode.decode_mac_vlan_port(data), [
+            decode.FdbRecord(0x000a000000ff, 10, "49"),
+            decode.FdbRecord(0xfffffffffffe, 4094, "1"),
+        ])
+        # ответ для /snmp/query/macs - в прежнем виде
+        self.assertEqual(oid_query.extract_mac_vlan_port(data).results_list[0], {
+            "mac": "00:0a:00:00:00:ff", "vlan": "10", "logical_interface_id": "49"
+        })
+
+    def test_bad_rows_are_skipped_and_counted(self):
+        skipped = registry.get_sample_value("netviewer_parse_skipped_rows_total", {"function": "decode_arp"}) or 0
+        data = walk("1.3.6.1.2.1.17.7.1.2.2.1.2", [
+            ("1.3.6.1.2.1.17.7.1.2.2.1.2.10.1.2", Integer(1)),
+            ("1.3.6.1.2.1.17.7.1.2.2.1.2.10.0.10.0.0.0.255", Integer(49)),
+        ])
+        arp = walk("1.3.6.1.2.1.4.22.1.2", [
+            ("1.3.6.1.2.1.4.22.1.2.5.10.0", OctetString(b"")),
+            ("1.3.6.1.2.1.4.22.1.2.5.10.0.1.5", OctetString(b"")),
+        ])
+        ip_addr = walk("1.3.6.1.2.1.4.20.1", [("1.3.6.1.2.1.4.20.1.1.10.0.0", IpAddress("10.0.0.1"))])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(decode.decode_mac_vlan_port(data), [decode.FdbRecord(0x000a000000ff, 10, "49")])
+            self.assertEqual(decode.decode_arp(arp), [decode.ArpRecord("5", "10.0.1.5", None)])
+            self.assertEqual(decode.decode_ip_addr(ip_addr), [])
+            self.assertEqual(oid_query.extract_mac_vlan_port(data).count, 1)
+        self.assertEqual(
+            registry.get_sample_value("netviewer_parse_skipped_rows_total", {"function": "decode_arp"}) - skipped, 1
+        )
+
+    def test_out_of_range_fdb_rows_are_skipped(self):
+        skipped = registry.get_sample_value(
+            "netviewer_parse_skipped_rows_total", {"function": "decode_mac_vlan_port"}
+        ) or 0
+        data = walk("1.3.6.1.2.1.17.7.1.2.2.1.2", [
+            # октет MAC больше 255
+            ("1.3.6.1.2.1.17.7.1.2.2.1.2.10.0.10.0.0.256.1", Integer(2)),
+            # FDB id не влезает в Unsigned32
+            ("1.3.6.1.2.1.17.7.1.2.2.1.2.{}.0.10.0.0.0.1".format(2 ** 32), Integer(3)),
+            ("1.3.6.1.2.1.17.7.1.2.2.1.2.{}.0.10.0.0.0.255".format(2 ** 32 - 1), Integer(49)),
+        ])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(decode.decode_mac_vlan_port(data), [decode.FdbRecord(0x000a000000ff, 2 ** 32 - 1, "49")])
+        self.assertEqual(registry.get_sample_value(
+            "netviewer_parse_skipped_rows_total", {"function": "decode_mac_vlan_port"}
+        ) - skipped, 2)
+
+    def test_arp(self):
+        data = walk("1.3.6.1.2.1.4.22.1.2", [
+            ("1.3.6.1.2.1.4.22.1.2.100004.10.0.1.4", OctetString(bytes.fromhex("6213a2978400"))),
+            ("1.3.6.1.2.1.4.22.1.2.5.10.0.1.5", OctetString(b"")),
+        ])
+        self.assertEqual(decode.decode_arp(data), [
+            decode.ArpRecord("100004", "10.0.1.4", 0x6213a2978400),
+            decode.ArpRecord("5", "10.0.1.5", None),
+        ])
+        self.assertEqual(oid_query.extract_arp_table(data).results_list[0]["mac"], "62:13:a2:97:84:00")
+
+    def test_ports_ip_addr_and_phys_address(self):
+        ports = walk("1.3.6.1.2.1.2.2.1.2", [("1.3.6.1.2.1.2.2.1.2.49", OctetString("gi1/0/1"))])
+        self.assertEqual(decode.decode_ports(ports), [decode.PortRecord("49", "gi1/0/1")])
+
+        ip_addr = walk("1.3.6.1.2.1.4.20.1", [
+            ("1.3.6.1.2.1.4.20.1.1.10.0.0.1", IpAddress("10.0.0.1")),
+            ("1.3.6.1.2.1.4.20.1.2.10.0.0.1", Integer(53)),
+        ])
+        self.assertEqual(decode.decode_ip_addr(ip_addr), [{"ipAdEntAddr": "10.0.0.1", "ipAdEntIfIndex": "53"}])
+
+        phys = walk("1.3.6.1.2.1.2.2.1.6", [("1.3.6.1.2.1.2.2.1.6.1", OctetString(bytes.fromhex("000102030405")))])
+        self.assertEqual(decode.decode_phys_address(phys), {"1": 0x000102030405})
+
+    def test_system_info(self):
+        data = walk("1.3.6.1.2.1.1.1", [
+            ("1.3.6.1.2.1.1.1.0", OctetString("switch")),
+            ("1.3.6.1.2.1.1.2.0", ObjectName("1.3.6.1.4.1.11")),
+            ("1.3.6.1.2.1.1.3.0", TimeTicks(8640000)),
+        ])
+        self.assertEqual(decode.decode_system_info(data), [
+            ("1.3.6.1.2.1.1.1.0", "switch"), ("1.3.6.1.2.1.1.3.0", "1 day, 0:00:00")
+        ])
+
+    def test_mac_formatting(self):
+        self.assertEqual(decode.int_to_mac(0x000a0b0c0d0e), "00:0a:0b:0c:0d:0e")
+        self.assertEqual(decode.octets_to_mac(b"\xff\x00"), "ff:00")
+
+    def test_lldp(self):
+        local = walk("1.0.8802.1.1.2.1.3.7.1", [
+            ("1.0.8802.1.1.2.1.3.7.1.3.7", OctetString("gi1/0/7")),
+            ("1.0.8802.1.1.2.1.3.7.1.4.7", OctetString("uplink")),
+        ])
+        self.assertEqual(decode.decode_lldp_local_ports(local), {7: ["gi1/0/7", "uplink"]})
+
+        remote = walk("1.0.8802.1.1.2.1.4.1.1", [
+            ("1.0.8802.1.1.2.1.4.1.1.4.0.7.1", Integer(4)),
+            ("1.0.8802.1.1.2.1.4.1.1.4.0.8.2", Integer(7)),
+            ("1.0.8802.1.1.2.1.4.1.1.5.0.7.1", OctetString(bytes.fromhex("00000000000a"))),
+            ("1.0.8802.1.1.2.1.4.1.1.5.0.8.2", OctetString("core-1")),
+            ("1.0.8802.1.1.2.1.4.1.1.7.0.7.1", OctetString("Gi0/1")),
+            ("1.0.8802.1.1.2.1.4.1.1.9.0.7.1", OctetString("access-7")),
+        ])
+        man_addr = walk("1.0.8802.1.1.2.1.4.2.1", [
+            ("1.0.8802.1.1.2.1.4.2.1.3.0.7.1.1.4.10.0.0.7", Integer(2)),
+            ("1.0.8802.1.1.2.1.4.2.1.3.0.7.1.2.16." + ".".join(["0"] * 16), Integer(2)),
+        ])
+        self.assertEqual(decode.decode_lldp_remote(remote, man_addr), [
+            decode.LldpRecord(7, "00:00:00:00:00:0a", "Gi0/1", "access-7", "10.0.0.7"),
+            decode.LldpRecord(8, "core-1", "", "", ""),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
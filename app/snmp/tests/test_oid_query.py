@@ -0,0 +1,152 @@
+import unittest
+from unittest import mock
+
+from pysnmp.hlapi.asyncio import ObjectIdentity, ObjectType
+from pysnmp.proto.rfc1902 import Integer, OctetString, ObjectName
+from pysnmp.proto.rfc1905 import EndOfMibView, NoSuchObject
+
+from app.snmp import oid_query
+from app.snmp.models import QueryOID
+
+
+def make_agent_data():
+    """
+    Кусок ifTable: ifDescr (.2) и ifType (.3) для пяти портов.
+    """
+    data = []
+    for column, value in ((2, lambda i: OctetString("gi1/0/{}".format(i))), (3, lambda i: Integer(6))):
+        for if_index in range(1, 6):
+            data.append((ObjectName("1.3.6.1.2.1.2.2.1.{}.{}".format(column, if_index)), value(if_index)))
+    return data
+
+
+class FakeAgent:
+    """
+    Подменяет getCmd/nextCmd/bulkCmd и отвечает из отсортированного списка OID-ов, считая запросы.
+    """
+
+    def __init__(self, data):
+        self.data = sorted(data, key=lambda el: el[0])
+        self.pdu_count = {"get": 0, "next": 0, "bulk": 0}
+
+    def patch(self):
+        """
+        Подменяет команды в oid_query, возвращает функцию отката.
+        """
+        patchers = [
+            mock.patch.object(oid_query, "getCmd", self.get_cmd),
+            mock.patch.object(oid_query, "nextCmd", self.next_cmd),
+            mock.patch.object(oid_query, "bulkCmd", self.bulk_cmd),
+        ]
+        for patcher in patchers:
+            patcher.start()
+        return lambda: [patcher.stop() for patcher in patchers]
+
+    @staticmethod
+    def _unmake(var_binds, options):
+        """
+        Как unmakeVarBinds в pysnmp: с lookupMib (по умолчанию) - ObjectType, разобранные по MIB,
+        с lookupMib=False - сырые пары (ObjectName, value).
+        """
+        if not options.get("lookupMib", True):
+            return list(var_binds)
+        return [
+            ObjectType(ObjectIdentity(name), value).resolveWithMib(oid_query.mibViewController)
+            for name, value in var_binds
+        ]
+
+    def _next_column(self, oid, count):
+        rows = [el for el in self.data if el[0] > oid][:count]
+        while len(rows) < count:
+            rows.append((oid, EndOfMibView()))
+        return rows
+
+    def _next_rows(self, var_binds, count, options):
+        columns = [self._next_column(self._oid(var_bind), count) for var_bind in var_binds]
+        return [self._unmake(row, options) for row in zip(*columns)]
+
+    @staticmethod
+    def _oid(var_bind):
+        return ObjectName(str(var_bind.resolveWithMib(oid_query.mibViewController)[0]))
+
+    async def get_cmd(self, engine, auth, transport, context, *var_binds, **options):
+        self.pdu_count["get"] += 1
+        values = dict(self.data)
+        return None, 0, 0, self._unmake(
+            [(self._oid(var_bind), values.get(self._oid(var_bind), NoSuchObject())) for var_bind in var_binds],
+            options
+        )
+
+    async def next_cmd(self, engine, auth, transport, context, *var_binds, **options):
+        self.pdu_count["next"] += 1
+        return None, 0, 0, self._next_rows(var_binds, 1, options)
+
+    async def bulk_cmd(self, engine, auth, transport, context, non_repeaters, max_repetitions, *var_binds, **options):
+        self.pdu_count["bulk"] += 1
+        return None, 0, 0, self._next_rows(var_binds, max_repetitions, options)
+
+
+class TestGetOidFromTo(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.agent = FakeAgent(make_agent_data())
+        self.addCleanup(self.agent.patch())
+
+    async def test_bulk_walk_stops_at_oid_stop(self):
+        res = await oid_query.get_oid_from_to(QueryOID(
+            host="127.0.0.1", oid_start=".1.3.6.1.2.1.2.2.1.2", oid_stop=".1.3.6.1.2.1.2.2.1.3", max_repetitions=3
+        ))
+        self.assertIsNone(res["error"])
+        self.assertEqual(res["count"], 5)
+        self.assertEqual(self.agent.pdu_count, {"get": 0, "next": 0, "bulk": 2})
+
+        ports = oid_query.extract_port_and_port_name(res)
+        self.assertEqual(ports.results_list[0], {"logical_interface_id": "1", "port_name": "gi1/0/1"})
+
+    async def test_snmp_v1_falls_back_to_getnext(self):
+        res = await oid_query.get_oid_from_to(QueryOID(
+            host="127.0.0.1", snmp_ver=0, oid_start=".1.3.6.1.2.1.2.2.1.2", oid_stop=".1.3.6.1.2.1.2.2.1.3"
+        ))
+        self.assertEqual(res["count"], 5)
+        self.assertEqual(self.agent.pdu_count, {"get": 0, "next": 6, "bulk": 0})
+
+    async def test_walk_ends_on_end_of_mib(self):
+        res = await oid_query.get_oid_from_to(QueryOID(
+            host="127.0.0.1", oid_start=".1.3.6.1.2.1.2.2.1.3", oid_stop=".1.3.6.1.2.1.2.2.1.9"
+        ))
+        self.assertIsNone(res["error"])
+        self.assertEqual(res["count"], 5)
+
+
+    async def test_table_walk_joins_columns_by_index(self):
+        table = await oid_query.get_table(
+            QueryOID(host="127.0.0.1", oid_start=".1.3.6.1.2.1.2.2.1.2", oid_stop=".1.3.6.1.2.1.2.2.1.3"),
+            [(".1.3.6.1.2.1.2.2.1.2", ".1.3.6.1.2.1.2.2.1.3"), (".1.3.6.1.2.1.2.2.1.3", ".1.3.6.1.2.1.2.2.1.4")]
+        )
+        self.assertIsNone(table["error"])
+        self.assertEqual(table["count"], 10)
+        self.assertEqual(self.agent.pdu_count, {"get": 0, "next": 0, "bulk": 1})
+        self.assertEqual(str(table["rows"]["3"][0]), "gi1/0/3")
+        self.assertEqual(int(table["rows"]["3"][1]), 6)
+
+        ports = oid_query.extract_port_and_port_name(
+            oid_query.table_to_walk(table, ".1.3.6.1.2.1.2.2.1.2", [0])
+        )
+        self.assertEqual(ports.count, 5)
+        self.assertEqual(ports.results_list[4], {"logical_interface_id": "5", "port_name": "gi1/0/5"})
+
+    async def test_table_walk_over_getnext(self):
+        table = await oid_query.get_table(
+            QueryOID(host="127.0.0.1", snmp_ver=0, oid_start=".1.3.6.1.2.1.2.2.1.2", oid_stop=".1.3.6.1.2.1.2.2.1.3"),
+            [(".1.3.6.1.2.1.2.2.1.2", ".1.3.6.1.2.1.2.2.1.3"), (".1.3.6.1.2.1.2.2.1.3", ".1.3.6.1.2.1.2.2.1.4")]
+        )
+        self.assertEqual(table["count"], 10)
+        self.assertEqual(self.agent.pdu_count, {"get": 0, "next": 6, "bulk": 0})
+
+    def test_ip_addr_columns(self):
+        columns = oid_query.ip_addr_columns(".1.3.6.1.2.1.4.20.1", ".1.3.6.1.2.1.4.20.2")
+        self.assertEqual(columns[0], (".1.3.6.1.2.1.4.20.1.1", ".1.3.6.1.2.1.4.20.1.2"))
+        self.assertEqual(columns[-1], (".1.3.6.1.2.1.4.20.1.5", ".1.3.6.1.2.1.4.20.2"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pysnmp.proto import rfc1902
+
+from app.snmp import oid_query
+from app.snmp.models import QueryOID
+from app.snmp.recorder import ReplaySource, WalkRecorder, read_frames
+from app.snmp.tests.test_oid_query import FakeAgent, make_agent_data
+
+PORTS = (".1.3.6.1.2.1.2.2.1.2", ".1.3.6.1.2.1.2.2.1.3")
+TYPES = (".1.3.6.1.2.1.2.2.1.3", ".1.3.6.1.2.1.2.2.1.4")
+
+
+def query(**kwargs):
+    return QueryOID(host="127.0.0.1", oid_start=PORTS[0], oid_stop=PORTS[1], **kwargs)
+
+
+class TestRecorderFile(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.unlink(self.path)
+        self.addCleanup(lambda: os.path.exists(self.path) and os.unlink(self.path))
+
+    def test_round_trip_of_value_types(self):
+        rows = [
+            (rfc1902.ObjectName("1.3.6.1.2.1.1.{}.0".format(i)), value)
+            for i, value in enumerate([
+                rfc1902.Integer32(-5), rfc1902.OctetString(b"\x00\x0a\xff"), rfc1902.ObjectIdentifier("1.3.6.1.4.1.9"),
+                rfc1902.IpAddress("10.0.0.1"), rfc1902.Counter32(7), rfc1902.Gauge32(8), rfc1902.Unsigned32(9),
+                rfc1902.TimeTicks(12345), rfc1902.Counter64(2 ** 40),
+            ])
+        ]
+        recorder = WalkRecorder(self.path)
+        recorder.walk("10.0.0.1", 161, (1, 3, 6, 1, 2, 1, 1), (1, 3, 6, 1, 2, 1, 2), None, rows)
+        recorder.get("10.0.0.1", 161, [(1, 3, 6, 1, 2, 1, 1, 3, 0)], "timeout", [])
+        recorder.close()
+
+        walk, get = list(read_frames(self.path))
+        self.assertEqual(walk.host, "10.0.0.1")
+        self.assertEqual(walk.oids, ((1, 3, 6, 1, 2, 1, 1), (1, 3, 6, 1, 2, 1, 2)))
+        self.assertIsNone(walk.error)
+        for (oid, value), (read_oid, read_value) in zip(rows, walk.rows):
+            self.assertEqual(oid, read_oid)
+            self.assertEqual(value.tagSet, read_value.tagSet)
+            self.assertEqual(value, read_value)
+        self.assertEqual(get.error, "timeout")
+
+    def test_truncated_last_frame_is_dropped(self):
+        recorder = WalkRecorder(self.path)
+        for _ in range(2):
+            recorder.walk("h", 161, (1, 3), (1, 4), None, [(rfc1902.ObjectName("1.3.1"), rfc1902.Integer32(1))])
+        recorder.close()
+        with open(self.path, "rb+") as f:
+            f.truncate(os.path.getsize(self.path) - 3)
+        self.assertEqual(len(list(read_frames(self.path))), 1)
+
+    def test_repeated_requests_replay_cycle_by_cycle(self):
+        recorder = WalkRecorder(self.path)
+        for cycle in range(2):
+            recorder.walk("h", 161, (1, 3), (1, 4), None, [(rfc1902.ObjectName("1.3.1"), rfc1902.Integer32(cycle))])
+        recorder.close()
+
+        replay = ReplaySource.load(self.path)
+        self.assertEqual([int(replay.walk("h", 161, (1, 3), (1, 4)).rows[0][1]) for _ in range(3)], [0, 1, 1])
+        self.assertIsNone(replay.walk("other", 161, (1, 3), (1, 4)))
+
+
+class TestRecordAndReplay(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.unlink(self.path)
+        self.addCleanup(lambda: os.path.exists(self.path) and os.unlink(self.path))
+
+    async def record(self):
+        agent = FakeAgent(make_agent_data())
+        recorder = WalkRecorder(self.path)
+        with mock.patch.object(oid_query, "walk_recorder", recorder):
+            unpatch = agent.patch()
+            try:
+                walk = await oid_query.get_oid_from_to(query(max_repetitions=3))
+                table = await oid_query.get_table(query(), [PORTS, TYPES])
+                scalars = await oid_query.get_oids(query(), ["1.3.6.1.2.1.2.2.1.2.1", "1.3.6.1.2.1.2.2.1.3.9"])
+            finally:
+                unpatch()
+        recorder.close()
+        return walk, table, scalars
+
+    async def test_replay_gives_same_results_without_network(self):
+        walk, table, scalars = await self.record()
+        self.assertEqual(len(list(read_frames(self.path))), 4)  # обход, две колонки таблицы, GET
+
+        def no_network(*args, **kwargs):
+            raise AssertionError("replay must not send PDUs")
+
+        with mock.patch.object(oid_query, "replay_source", ReplaySource.load(self.path)), \
+                mock.patch.object(oid_query, "bulkCmd", no_network), \
+                mock.patch.object(oid_query, "getCmd", no_network):
+            replayed_walk = await oid_query.get_oid_from_to(query(max_repetitions=3))
+            replayed_table = await oid_query.get_table(query(), [PORTS, TYPES])
+            replayed_scalars = await oid_query.get_oids(query(), ["1.3.6.1.2.1.2.2.1.2.1", "1.3.6.1.2.1.2.2.1.3.9"])
+
+        self.assertEqual(
+            oid_query.extract_port_and_port_name(replayed_walk).results_list,
+            oid_query.extract_port_and_port_name(walk).results_list
+        )
+        self.assertEqual(replayed_table["count"], table["count"])
+        self.assertEqual(sorted(replayed_table["rows"]), sorted(table["rows"]))
+        self.assertEqual(str(replayed_table["rows"]["3"][0]), "gi1/0/3")
+        self.assertEqual(replayed_scalars["count"], scalars["count"])
+        self.assertIsNone(replayed_table["error"])
+
+    async def test_unrecorded_device_looks_unreachable(self):
+        await self.record()
+        with mock.patch.object(oid_query, "replay_source", ReplaySource.load(self.path)):
+            res = await oid_query.get_oid_from_to(QueryOID(host="127.0.0.2", oid_start=PORTS[0], oid_stop=PORTS[1]))
+        self.assertEqual(res["count"], 0)
+        self.assertIn("REPLAY", res["error"])
+
+
+if __name__ == '__main__':
+    unittest.main()
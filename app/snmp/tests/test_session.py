@@ -0,0 +1,30 @@
+import unittest
+from unittest import mock
+
+from app.snmp.models import QueryOID
+from app.snmp.session import SnmpSessionPool
+
+
+class TestSnmpSessionPool(unittest.TestCase):
+    def test_session_reused_per_device(self):
+        pool = SnmpSessionPool(idle_timeout=600)
+        query = QueryOID(host="127.0.0.1", oid_start="1.3.6.1.2.1.1.1", oid_stop="1.3.6.1.2.1.1.7")
+
+        first = pool.get(query)
+        self.assertIs(pool.get(query.model_copy(update={"oid_start": "1.3.6.1.2.1.2"})), first)
+        self.assertIsNot(pool.get(query.model_copy(update={"community": "private"})), first)
+        self.assertEqual(len(pool), 2)
+
+    def test_idle_sessions_evicted(self):
+        query = QueryOID(host="127.0.0.1", oid_start="1.3.6.1.2.1.1.1", oid_stop="1.3.6.1.2.1.1.7")
+
+        with mock.patch("app.snmp.session.time.monotonic", return_value=1000.0):
+            pool = SnmpSessionPool(idle_timeout=10)
+            first = pool.get(query)
+        with mock.patch("app.snmp.session.time.monotonic", return_value=1020.0):
+            self.assertIsNot(pool.get(query), first)
+        self.assertEqual(len(pool), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
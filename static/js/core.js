@@ -1,6 +1,8 @@
 let devices
 let macs_ip
 let tree
+let version = 0
+let events_source = null
 
 function getNextLevelInTree(tree, devices, level) {
     let elem = Object.keys(tree)[0];
@@ -13,7 +15,7 @@ function getNextLevelInTree(tree, devices, level) {
     }
 
     root_div.insertAdjacentHTML("beforeend",
-        `<span class="label" id="` + devices[elem].host +
+        `<span class="label` + (devices[elem].unreachable ? ` unreachable` : ``) + `" id="` + devices[elem].host +
         `" data-bs-toggle="offcanvas" data-bs-target="#device_info">` +
         devices[elem].host + `<br>` + devices[elem].info + `</span>`
     );
@@ -29,9 +31,8 @@ function getNextLevelInTree(tree, devices, level) {
             next_level_entry.classList.add("entry");
 
             next_level_entry.insertAdjacentHTML("beforeend",
-                `<span class="label">` +
-                devices[elem].ports[port].name +
-                ` (macs: ` + (macs.length) + ` )</span>`
+                `<span class="label" id="` + portLabelId(elem, port) + `">` +
+                portLabelText(devices[elem].ports[port]) + `</span>`
             );
 
             if ((port in tree[elem].ports) && ('uplink' in tree[elem].ports[port])) {
@@ -61,6 +62,26 @@ function getNextLevelInTree(tree, devices, level) {
 }
 
 
+function portLabelId(host, port) {
+    return "port_" + host + "_" + port
+}
+
+function portLabelText(port) {
+    return port.name + ` (macs: ` + Object.keys(port.macs).length + ` )`
+}
+
+// Дерево целиком строится из того, что уже есть в devices/tree, без запроса к серверу
+function renderPlace() {
+    let place = document.getElementById("place")
+    place.replaceChildren()
+    if (!Object.keys(tree).length) return
+
+    let root_tree = getNextLevelInTree(tree, devices, 1)
+    root_tree.addEventListener("click", show_device_info)
+    place.append(root_tree);
+}
+
+
 document.getElementById("menu_refresh").addEventListener("click", loadPlace)
 
 async function loadPlace() {
@@ -74,11 +95,10 @@ async function loadPlace() {
             devices = response.devices
             macs_ip = response.macs
             tree = response.tree
+            version = response.version
 
-            let root_tree = getNextLevelInTree(tree, devices, 1)
-            root_tree.addEventListener("click", show_device_info)
-
-            document.getElementById("place").append(root_tree);
+            renderPlace()
+            subscribeEvents()
             // document.getElementById(devices[data[0]].host).addEventListener("click", show_device_info);
             console.log("finished ok");
         }
@@ -89,6 +109,96 @@ async function loadPlace() {
 }
 
 
+////////////////////////////////////////////////////////////////////
+// Изменения топологии приходят с сервера через /core/events (SSE).
+// Мелкие изменения (маки на портах, недоступные устройства) правим прямо в DOM,
+// дерево перестраиваем локально только если появились новые узлы или порты.
+// Если пропустили версию - перечитываем /core/get_place целиком.
+////////////////////////////////////////////////////////////////////
+function subscribeEvents() {
+    if (events_source !== null) return
+
+    events_source = new EventSource("/core/events")
+    events_source.addEventListener("diff", applyDiff)
+    events_source.addEventListener("resync", loadPlace)
+}
+
+function getPort(host, port) {
+    if (!(port in devices[host].ports))
+        devices[host].ports[port] = {"name": port, "macs": {}}
+    return devices[host].ports[port]
+}
+
+function applyDiff(e) {
+    let diff = JSON.parse(e.data)
+    if (diff.prev_version !== version) {
+        loadPlace()
+        return
+    }
+    version = diff.version
+
+    let rerender = false
+    let touched_ports = {}
+
+    for (let ev of diff.events) {
+        if ((ev.type !== "device_added") && (ev.type !== "tree") && !(ev.host in devices)) {
+            rerender = true
+            continue
+        }
+        switch (ev.type) {
+            case "device_added":
+                devices[ev.host] = ev.device
+                rerender = true
+                break
+            case "device_unreachable":
+                devices[ev.host].unreachable = true
+                let label = document.getElementById(ev.host)
+                if (label) label.classList.add("unreachable")
+                break
+            case "mac_added":
+                getPort(ev.host, ev.port).macs[ev.mac] = ev.vlan
+                macs_ip[ev.mac] = ev.ips
+                touched_ports[portLabelId(ev.host, ev.port)] = [ev.host, ev.port]
+                break
+            case "mac_removed":
+                // на порту MAC хранится с одним VLAN; запись из другого VLAN не трогаем (и в mac_moved)
+                if (getPort(ev.host, ev.port).macs[ev.mac] === ev.vlan) {
+                    delete getPort(ev.host, ev.port).macs[ev.mac]
+                }
+                touched_ports[portLabelId(ev.host, ev.port)] = [ev.host, ev.port]
+                break
+            case "mac_moved":
+                if (getPort(ev.host, ev.from_port).macs[ev.mac] === ev.vlan) {
+                    delete getPort(ev.host, ev.from_port).macs[ev.mac]
+                }
+                getPort(ev.host, ev.to_port).macs[ev.mac] = ev.vlan
+                touched_ports[portLabelId(ev.host, ev.from_port)] = [ev.host, ev.from_port]
+                touched_ports[portLabelId(ev.host, ev.to_port)] = [ev.host, ev.to_port]
+                break
+            case "tree":
+                tree = ev.tree
+                rerender = true
+                break
+        }
+    }
+
+    if (!rerender) {
+        for (let id in touched_ports) {
+            let [host, port] = touched_ports[id]
+            let label = document.getElementById(id)
+            // порт появился или опустел - без перестройки дерева не обойтись
+            if (!label || !Object.keys(devices[host].ports[port].macs).length) {
+                rerender = true
+                break
+            }
+            label.innerText = portLabelText(devices[host].ports[port])
+        }
+    }
+    if (rerender) renderPlace()
+    console.log("diff v" + version + ": " + diff.events.length + " events")
+}
+
+
 function show_device_info(e) {
     let dev = e.target.id
     if (!(dev in devices)) return